@@ -35,6 +35,14 @@ def get_db():
     from app import get_db as app_get_db
     return app_get_db()
 
+def _schema_bootstrapped():
+    """True once app.run_schema_migrations() has created the admin tables at startup."""
+    try:
+        from app import SCHEMA_BOOTSTRAPPED
+        return bool(SCHEMA_BOOTSTRAPPED)
+    except Exception:
+        return False
+
 def get_admin_session():
     if 'admin_role' not in session:
         return None
@@ -94,7 +102,60 @@ def _parse_dt(value):
     except Exception:
         return None
 
+def _ensure_core_tables(conn, c, db_type):
+    """Create the tables the stats/insights queries read (no-op after startup migrations)."""
+    if _schema_bootstrapped():
+        return
+    try:
+        if db_type == 'postgres':
+            c.execute("CREATE TABLE IF NOT EXISTS bans (id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT, banned_by TEXT, banned_at TIMESTAMP, expires_at TIMESTAMP)")
+            c.execute("CREATE TABLE IF NOT EXISTS comment_restrictions (id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT, restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP)")
+            c.execute("CREATE TABLE IF NOT EXISTS verses (id SERIAL PRIMARY KEY, reference TEXT, text TEXT, translation TEXT, source TEXT, timestamp TEXT, book TEXT)")
+            c.execute("CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user')")
+            c.execute("CREATE TABLE IF NOT EXISTS likes (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
+            c.execute("CREATE TABLE IF NOT EXISTS saves (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
+            c.execute("CREATE TABLE IF NOT EXISTS comments (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
+            c.execute("CREATE TABLE IF NOT EXISTS community_messages (id SERIAL PRIMARY KEY, user_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT)")
+            c.execute("CREATE TABLE IF NOT EXISTS comment_replies (id SERIAL PRIMARY KEY, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL, user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
+            c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
+        else:
+            c.execute("CREATE TABLE IF NOT EXISTS bans (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT, banned_by TEXT, banned_at TIMESTAMP, expires_at TIMESTAMP)")
+            c.execute("CREATE TABLE IF NOT EXISTS comment_restrictions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT, restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP)")
+            c.execute("CREATE TABLE IF NOT EXISTS verses (id INTEGER PRIMARY KEY AUTOINCREMENT, reference TEXT, text TEXT, translation TEXT, source TEXT, timestamp TEXT, book TEXT)")
+            c.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user')")
+            c.execute("CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
+            c.execute("CREATE TABLE IF NOT EXISTS saves (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
+            c.execute("CREATE TABLE IF NOT EXISTS comments (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
+            c.execute("CREATE TABLE IF NOT EXISTS community_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT)")
+            c.execute("CREATE TABLE IF NOT EXISTS comment_replies (id INTEGER PRIMARY KEY AUTOINCREMENT, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL, user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
+            c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
+        conn.commit()
+    except Exception as e:
+        print(f"[DEBUG] Table creation warning: {e}")
+        if db_type == 'postgres':
+            conn.rollback()
+
+    # Ensure soft-delete columns exist for comment counts
+    try:
+        if db_type == 'postgres':
+            c.execute("ALTER TABLE comments ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
+            c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
+        else:
+            try:
+                c.execute("SELECT is_deleted FROM comments LIMIT 1")
+            except Exception:
+                c.execute("ALTER TABLE comments ADD COLUMN is_deleted INTEGER DEFAULT 0")
+            try:
+                c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
+            except Exception:
+                c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
+        conn.commit()
+    except Exception as e:
+        print(f"[DEBUG] Soft delete column warning: {e}")
+
 def _ensure_admin_feature_tables(conn, c, db_type):
+    if _schema_bootstrapped():
+        return
     if db_type == 'postgres':
         c.execute("""
             CREATE TABLE IF NOT EXISTS user_presence (
@@ -203,7 +264,22 @@ def _ensure_admin_feature_tables(conn, c, db_type):
         """)
     conn.commit()
 
+def _ensure_system_settings_table(c, db_type):
+    from app import ensure_system_settings_table
+    ensure_system_settings_table(c, db_type)
+
+def ensure_admin_schema(conn, c, db_type):
+    """Startup migration step: every table the admin panel queries."""
+    _ensure_core_tables(conn, c, db_type)
+    _ensure_admin_feature_tables(conn, c, db_type)
+    _ensure_user_safety_tables(conn, c, db_type)
+    _ensure_daily_actions_schema(c, db_type)
+    _ensure_audit_logs_schema(conn, c, db_type)
+    _ensure_system_settings_table(c, db_type)
+
 def _ensure_user_safety_tables(conn, c, db_type):
+    if _schema_bootstrapped():
+        return
     if db_type == 'postgres':
         c.execute("""
             CREATE TABLE IF NOT EXISTS user_blocks (
@@ -296,6 +372,8 @@ def _ensure_user_safety_tables(conn, c, db_type):
     conn.commit()
 
 def _ensure_daily_actions_schema(c, db_type):
+    if _schema_bootstrapped():
+        return
     cols = _get_table_columns(c, db_type, 'daily_actions')
     if cols:
         if db_type == 'postgres':
@@ -412,6 +490,8 @@ def _row_first_value(row, default=0):
 
 def _ensure_audit_logs_schema(conn, c, db_type):
     """Create/migrate audit_logs so queries work across older DB schemas."""
+    if _schema_bootstrapped():
+        return
     if db_type == 'postgres':
         c.execute("""
             CREATE TABLE IF NOT EXISTS audit_logs (
@@ -921,53 +1001,7 @@ def get_stats():
                 print(f"[DEBUG] Query failed: {query}, error: {e}")
                 return 0
         
-        # Ensure tables exist first
-        try:
-            if db_type == 'postgres':
-                c.execute("CREATE TABLE IF NOT EXISTS bans (id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT, banned_by TEXT, banned_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_restrictions (id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT, restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS verses (id SERIAL PRIMARY KEY, reference TEXT, text TEXT, translation TEXT, source TEXT, timestamp TEXT, book TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user')")
-                c.execute("CREATE TABLE IF NOT EXISTS likes (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS saves (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS comments (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS community_messages (id SERIAL PRIMARY KEY, user_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_replies (id SERIAL PRIMARY KEY, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL, user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-            else:
-                c.execute("CREATE TABLE IF NOT EXISTS bans (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT, banned_by TEXT, banned_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_restrictions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT, restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS verses (id INTEGER PRIMARY KEY AUTOINCREMENT, reference TEXT, text TEXT, translation TEXT, source TEXT, timestamp TEXT, book TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user')")
-                c.execute("CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS saves (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS comments (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS community_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_replies (id INTEGER PRIMARY KEY AUTOINCREMENT, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL, user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-            conn.commit()
-        except Exception as e:
-            print(f"[DEBUG] Table creation warning: {e}")
-            if db_type == 'postgres':
-                conn.rollback()
-
-        # Ensure soft-delete columns exist for comment counts
-        try:
-            if db_type == 'postgres':
-                c.execute("ALTER TABLE comments ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-                c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-            else:
-                try:
-                    c.execute("SELECT is_deleted FROM comments LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE comments ADD COLUMN is_deleted INTEGER DEFAULT 0")
-                try:
-                    c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-            conn.commit()
-        except Exception as e:
-            print(f"[DEBUG] Soft delete column warning: {e}")
+        _ensure_core_tables(conn, c, db_type)
         
         users = get_count("SELECT COUNT(*) as count FROM users")
         now_iso = datetime.now().isoformat()
@@ -2376,6 +2410,8 @@ def ban_user(user_id):
         
         conn.commit()
         conn.close()
+        from app import invalidate_ban_status
+        invalidate_ban_status(user_id)
         
         return jsonify({"success": True, "banned": banned})
     except Exception as e:
@@ -2532,31 +2568,11 @@ def get_recent_activity():
 def get_settings():
     admin = get_admin_session()
     maintenance_mode = os.environ.get('MAINTENANCE_MODE', 'false')
-    conn = None
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        if db_type == 'postgres':
-            c.execute("SELECT value FROM system_settings WHERE key = %s", ('maintenance_mode',))
-        else:
-            c.execute("SELECT value FROM system_settings WHERE key = ?", ('maintenance_mode',))
-        row = _row_to_dict(c.fetchone())
-        if row:
-            maintenance_mode = (row.get('value') if hasattr(row, 'keys') else row[0]) or maintenance_mode
-        conn.close()
+        from app import read_system_setting
+        maintenance_mode = read_system_setting('maintenance_mode') or maintenance_mode
     except Exception:
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
+        pass
     
     return jsonify({
         "site_name": os.environ.get('SITE_NAME', 'AI.Bible'),
@@ -2674,23 +2690,8 @@ def get_admin_insights():
         c = conn.cursor()
         _ensure_admin_feature_tables(conn, c, db_type)
         _ensure_daily_actions_schema(c, db_type)
-        if db_type == 'postgres':
-            c.execute("CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user')")
-            c.execute("CREATE TABLE IF NOT EXISTS likes (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS saves (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-        else:
-            c.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user')")
-            c.execute("CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS saves (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        _ensure_core_tables(conn, c, db_type)
+        _ensure_system_settings_table(c, db_type)
 
         now = datetime.now()
         active_cutoff = now - timedelta(minutes=5)
@@ -2718,16 +2719,10 @@ def get_admin_insights():
         for row in due_rows:
             _dispatch_announcement_row(c, db_type, row)
 
-        # Active users now from presence pings.
-        c.execute("SELECT user_id, last_seen FROM user_presence")
-        presence_rows = c.fetchall()
-        active_users_now = 0
-        for row in presence_rows:
-            row = _row_to_dict(row)
-            last_seen = row.get('last_seen') if hasattr(row, 'keys') else row[1]
-            dt = _parse_dt(last_seen)
-            if dt and dt >= active_cutoff:
-                active_users_now += 1
+        # Active users now from the in-memory presence registry.
+        from app import count_online_users, count_online_windows
+        active_users_now = count_online_users((now - active_cutoff).total_seconds())
+        active_users_windows = count_online_windows()
 
         if active_users_now == 0:
             try:
@@ -2914,21 +2909,15 @@ def get_admin_insights():
         announcements_sent = int(_row_first_value(sent_row, 0) or 0)
 
         # Maintenance mode state
-        if db_type == 'postgres':
-            c.execute("SELECT value FROM system_settings WHERE key = %s", ('maintenance_mode',))
-        else:
-            c.execute("SELECT value FROM system_settings WHERE key = ?", ('maintenance_mode',))
-        maint_row = c.fetchone()
-        maintenance_mode = False
-        if maint_row:
-            maint_row = _row_to_dict(maint_row)
-            maint_val = maint_row.get('value') if hasattr(maint_row, 'keys') else maint_row[0]
-            maintenance_mode = str(maint_val).strip().lower() in ('1', 'true', 'yes', 'on')
+        from app import read_system_setting
+        maint_val = read_system_setting('maintenance_mode', '0')
+        maintenance_mode = str(maint_val).strip().lower() in ('1', 'true', 'yes', 'on')
 
         conn.commit()
         conn.close()
         return jsonify({
             "active_users_now": active_users_now,
+            "active_users_windows": active_users_windows,
             "recent_signups": recent_signups,
             "daily_active_users": dau_series,
             "user_growth": growth_series,
@@ -3397,17 +3386,7 @@ def admin_chat():
 def get_system_settings():
     """Get system settings including verse refresh interval"""
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        
-        # Ensure settings table exists
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        from app import get_system_settings_snapshot
 
         defaults = {
             "verse_interval": "60",
@@ -3418,20 +3397,8 @@ def get_system_settings():
             "maintenance_mode": "0"
         }
 
-        placeholders = ",".join(["%s"] * len(defaults)) if db_type == 'postgres' else ",".join(["?"] * len(defaults))
-        c.execute(
-            f"SELECT key, value FROM system_settings WHERE key IN ({placeholders})",
-            tuple(defaults.keys())
-        )
-        rows = c.fetchall()
-        stored = {}
-        for row in rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                stored[str(row.get('key'))] = str(row.get('value'))
-            else:
-                stored[str(row[0])] = str(row[1])
-        conn.close()
+        snapshot = get_system_settings_snapshot()
+        stored = {key: str(snapshot[key]) for key in defaults if snapshot.get(key) is not None}
 
         merged = {**defaults, **stored}
         return jsonify({
@@ -3466,14 +3433,7 @@ def update_system_settings():
         conn, db_type = get_db()
         c = conn.cursor()
         
-        # Ensure settings table exists
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        _ensure_system_settings_table(c, db_type)
         
         updates = []
 
@@ -3609,6 +3569,8 @@ def update_system_settings():
             updates.append(f"maintenance_mode={maintenance_mode}")
 
         if updates:
+            from app import bump_system_settings_version
+            bump_system_settings_version(c, db_type)
             log_action(
                 "UPDATE_SETTINGS",
                 "Updated system settings: " + ", ".join(updates),
@@ -3618,6 +3580,9 @@ def update_system_settings():
 
         conn.commit()
         conn.close()
+        if updates:
+            from app import invalidate_system_settings_cache
+            invalidate_system_settings_cache()
         
         return jsonify({"success": True})
     except Exception as e:
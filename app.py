@@ -9,13 +9,23 @@ import secrets
 import json
 import random
 import logging
+import atexit
+import socket
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta, timezone
 import hashlib
+import base64
 from functools import wraps
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+from array import array
+import heapq
+import bisect
+import math
 from urllib.parse import quote
 import queue
-from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from bible_corpus import BibleCorpus, CANONICAL_BOOKS, parse_reference
 
 # Load environment variables from .env file (for local development)
 try:
@@ -24,6 +34,15 @@ try:
 except ImportError:
     pass  # python-dotenv not installed, use system env vars
 
+try:
+    import numpy as np
+    from verse_vectors import VectorIndex
+    from verse_neighbors import VerseNeighbors
+except ImportError:
+    np = None  # VerseSearchIndex scores in pure Python instead
+    VectorIndex = None  # and ?mode=vector falls back to token search
+    VerseNeighbors = None  # and recommendations use the book pools only
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -77,74 +96,121 @@ def role_priority(role):
     order = {'user': 0, 'host': 1, 'mod': 2, 'co_owner': 3, 'owner': 4}
     return order.get(normalize_role(role), 0)
 
-def get_user_equipped_items(c, db_type, user_id):
-    """Get a user's equipped profile items for display on comments/messages"""
-    if not user_id:
-        return {
-            "frame": None,
-            "name_color": None,
-            "title": None,
-            "badges": [],
-            "chat_effect": None,
-            "profile_bg": None
-        }
-    
-    try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT s.item_id, s.category, s.effects, s.name, s.icon, s.rarity
-                FROM user_inventory i
-                JOIN shop_items s ON i.item_id = s.item_id
-                WHERE i.user_id = %s AND i.equipped = TRUE
-            """, (user_id,))
-        else:
-            c.execute("""
-                SELECT s.item_id, s.category, s.effects, s.name, s.icon, s.rarity
-                FROM user_inventory i
-                JOIN shop_items s ON i.item_id = s.item_id
-                WHERE i.user_id = ? AND i.equipped = 1
-            """, (user_id,))
-        
-        equipped = {
-            "frame": None,
-            "name_color": None,
-            "title": None,
-            "badges": [],
-            "chat_effect": None,
-            "profile_bg": None
-        }
-        
+def _empty_equipped_items():
+    return {
+        "frame": None,
+        "name_color": None,
+        "title": None,
+        "badges": [],
+        "chat_effect": None,
+        "profile_bg": None
+    }
+
+def _shop_item_meta(c, db_type, item_ids):
+    """Display metadata for shop items, with effects JSON parsed once per process."""
+    with _SHOP_ITEM_META_LOCK:
+        missing = [item_id for item_id in item_ids if item_id not in _SHOP_ITEM_META]
+    if missing:
+        ids_sql, params = _build_in_clause_params(db_type, missing)
+        loaded = {item_id: None for item_id in missing}
+        c.execute(f"""
+            SELECT item_id, category, effects, name, icon, rarity
+            FROM shop_items
+            WHERE item_id IN ({ids_sql})
+        """, params)
         for row in c.fetchall():
             try:
-                category = row['category'] if hasattr(row, 'keys') else row[1]
-                effects = row['effects'] if isinstance(row['effects'], dict) else json.loads(row['effects'] or '{}')
-                item_data = {
-                    "item_id": row['item_id'] if hasattr(row, 'keys') else row[0],
-                    "name": row['name'] if hasattr(row, 'keys') else row[3],
-                    "icon": normalize_shop_icon(row['icon'] if hasattr(row, 'keys') else row[4], category),
-                    "rarity": row['rarity'] if hasattr(row, 'keys') else row[5],
-                    "effects": effects
+                category = row_pick(row, 'category', 1)
+                effects = row_pick(row, 'effects', 2)
+                loaded[row_pick(row, 'item_id', 0)] = {
+                    "category": category,
+                    "item_id": row_pick(row, 'item_id', 0),
+                    "name": row_pick(row, 'name', 3),
+                    "icon": normalize_shop_icon(row_pick(row, 'icon', 4), category),
+                    "rarity": row_pick(row, 'rarity', 5),
+                    "effects": effects if isinstance(effects, dict) else json.loads(effects or '{}')
                 }
-                
-                if category == 'badge':
-                    equipped['badges'].append(item_data)
-                elif category in equipped:
-                    equipped[category] = item_data
             except Exception as e:
                 logger.error(f"Error parsing equipped item: {e}")
+        with _SHOP_ITEM_META_LOCK:
+            _SHOP_ITEM_META.update(loaded)
+    with _SHOP_ITEM_META_LOCK:
+        return {item_id: _SHOP_ITEM_META.get(item_id) for item_id in item_ids}
+
+def invalidate_shop_item_meta():
+    with _SHOP_ITEM_META_LOCK:
+        _SHOP_ITEM_META.clear()
+
+def invalidate_user_cosmetics(user_id, broadcast=True):
+    """Forget user_id's cached equipped items here and, by default, on every worker."""
+    if not user_id:
+        return
+    with _COSMETICS_CACHE_LOCK:
+        _COSMETICS_CACHE.pop(int(user_id), None)
+    if broadcast:
+        publish_cache_event("cosmetics", {"user_id": int(user_id)})
+
+def get_equipped_items_for_users(c, db_type, user_ids):
+    """Equipped profile items for several users at once, as {user_id: equipped}.
+
+    Served from the per-user cosmetics cache; misses are resolved with one
+    user_inventory query for all of them. Returned dicts are shared, so treat
+    them as read-only.
+    """
+    wanted = {int(uid) for uid in user_ids if uid}
+    result = {}
+    now_ts = time.time()
+    with _COSMETICS_CACHE_LOCK:
+        for uid in wanted:
+            cached = _COSMETICS_CACHE.get(uid)
+            if cached and (now_ts - cached[0]) < COSMETICS_CACHE_TTL:
+                _COSMETICS_CACHE.move_to_end(uid)
+                result[uid] = cached[1]
+    missing = sorted(wanted - set(result))
+    if not missing:
+        return result
+
+    loaded = {uid: _empty_equipped_items() for uid in missing}
+    try:
+        ids_sql, params = _build_in_clause_params(db_type, missing)
+        equipped_true = 'TRUE' if db_type == 'postgres' else '1'
+        c.execute(f"""
+            SELECT user_id, item_id
+            FROM user_inventory
+            WHERE user_id IN ({ids_sql}) AND equipped = {equipped_true}
+        """, params)
+        rows = [(int(row_pick(row, 'user_id', 0)), row_pick(row, 'item_id', 1)) for row in c.fetchall()]
+        meta = _shop_item_meta(c, db_type, sorted({item_id for _, item_id in rows}))
+        for uid, item_id in rows:
+            item = meta.get(item_id)
+            if item is None:
                 continue
-        
-        return equipped
+            category = item["category"]
+            item_data = {key: item[key] for key in ("item_id", "name", "icon", "rarity", "effects")}
+            if category == 'badge':
+                loaded[uid]['badges'].append(item_data)
+            elif category in loaded[uid]:
+                loaded[uid][category] = item_data
     except Exception as e:
         logger.error(f"Error getting equipped items: {e}")
-        return {
-            "frame": None,
-            "name_color": None,
-            "title": None,
-            "badges": [],
-            "chat_effect": None,
-            "profile_bg": None
-        }
+        for uid in missing:
+            result[uid] = _empty_equipped_items()
+        return result
+
+    with _COSMETICS_CACHE_LOCK:
+        for uid, equipped in loaded.items():
+            _COSMETICS_CACHE[uid] = (now_ts, equipped)
+            _COSMETICS_CACHE.move_to_end(uid)
+        while len(_COSMETICS_CACHE) > COSMETICS_CACHE_MAX_USERS:
+            _COSMETICS_CACHE.popitem(last=False)
+    result.update(loaded)
+    return result
+
+def get_user_equipped_items(c, db_type, user_id):
+    """Get a user's equipped profile items for display on comments/messages"""
+    if not user_id:
+        return _empty_equipped_items()
+    return get_equipped_items_for_users(c, db_type, [user_id]).get(int(user_id)) or _empty_equipped_items()
 
 ADMIN_CODE = os.environ.get('ADMIN_CODE', 'God Is All')
 MASTER_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'God Is All')
@@ -241,20 +307,78 @@ if RENDER_ENV and not IS_POSTGRES:
     raise RuntimeError("Postgres DATABASE_URL is required in production (Render).")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SQLITE_PATH = os.path.join(BASE_DIR, 'bible_ios.db')
-BOOK_TEXT_CACHE = {}
-BOOK_META_CACHE = {}
+DB_POOL_ENABLED = str(os.environ.get('DB_POOL_ENABLED', '1')).strip().lower() in ('1', 'true', 'yes', 'on')
+DB_POOL_MAX_SIZE = max(1, int(os.environ.get('DB_POOL_MAX_SIZE', '20')))
+DB_POOL_TIMEOUT = max(0.5, float(os.environ.get('DB_POOL_TIMEOUT', '15')))
+DB_POOL_MAX_LIFETIME = max(30.0, float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')))
+DB_POOL_PING_AFTER = max(0.0, float(os.environ.get('DB_POOL_PING_AFTER', '30')))
 BAN_SCHEMA_READY = False
 RESTRICTION_SCHEMA_READY = False
 SQLITE_TUNING_APPLIED = False
 _SCHEMA_READY_FLAGS = set()
 _SCHEMA_READY_LOCK = threading.Lock()
+SCHEMA_BOOTSTRAPPED = False
+SYSTEM_SETTINGS_CACHE_TTL = max(0.5, float(os.environ.get('SYSTEM_SETTINGS_CACHE_TTL', '5.0')))
+SYSTEM_SETTINGS_VERSION_KEY = '_settings_version'
+_SYSTEM_SETTINGS_CACHE = {"values": None, "version": None, "checked_at": 0.0}
+_SYSTEM_SETTINGS_CACHE_LOCK = threading.Lock()
+_SYSTEM_SETTINGS_REFRESH_LOCK = threading.Lock()
+PRESENCE_FLUSH_INTERVAL = max(1.0, float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '15.0')))
+PRESENCE_RETENTION_SECONDS = max(300.0, float(os.environ.get('PRESENCE_RETENTION_SECONDS', '3600')))
+_PRESENCE = {}
+_PRESENCE_DIRTY = set()
+_PRESENCE_LOCK = threading.Lock()
+_PRESENCE_FLUSHER = {"thread": None, "pid": None, "wake": threading.Event()}
+PRESENCE_WINDOWS = {"1m": 60, "5m": 300, "15m": 900, "24h": 86400}
+# 0 for helper processes (realtime_asgi) that import this module only for its helpers: no migrations,
+# no generator/batch threads, no shop sync. The web workers keep the default.
+APP_BACKGROUND_TASKS = str(os.environ.get('APP_BACKGROUND_TASKS', '1')).strip().lower() in ('1', 'true', 'yes', 'on')
 IMMEDIATE_UPDATE_MODE = str(os.environ.get('IMMEDIATE_UPDATE_MODE', '1')).strip().lower() in ('1', 'true', 'yes', 'on')
 BAN_STATUS_CACHE_TTL = max(1.0, float(os.environ.get('BAN_STATUS_CACHE_TTL', '3.0')))
 _BAN_STATUS_CACHE = {}
 _BAN_STATUS_CACHE_LOCK = threading.Lock()
+COSMETICS_CACHE_TTL = max(1.0, float(os.environ.get('COSMETICS_CACHE_TTL', '60')))
+COSMETICS_CACHE_MAX_USERS = max(100, int(os.environ.get('COSMETICS_CACHE_MAX_USERS', '20000')))
+_COSMETICS_CACHE = OrderedDict()
+_COSMETICS_CACHE_LOCK = threading.Lock()
+_SHOP_ITEM_META = {}
+_SHOP_ITEM_META_LOCK = threading.Lock()
 API_RESPONSE_CACHE_TTL = max(1.0, float(os.environ.get('API_RESPONSE_CACHE_TTL', '3.0')))
-_API_RESPONSE_CACHE = {}
-_API_RESPONSE_CACHE_LOCK = threading.Lock()
+API_RESPONSE_CACHE_MAX_ENTRIES = max(16, int(os.environ.get('API_RESPONSE_CACHE_MAX_ENTRIES', '4096')))
+API_RESPONSE_CACHE_MAX_BYTES = max(64 * 1024, int(os.environ.get('API_RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))))
+API_RESPONSE_CACHE_SWEEP_INTERVAL = max(0.5, float(os.environ.get('API_RESPONSE_CACHE_SWEEP_INTERVAL', '5.0')))
+SHARED_CACHE_ENABLED = str(os.environ.get('SHARED_CACHE_ENABLED', '1')).strip().lower() in ('1', 'true', 'yes', 'on')
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH') or os.path.join(BASE_DIR, 'shared_cache.db')
+CACHE_BUS_CHANNEL = 'bible_cache_bus'
+CACHE_BUS_POLL_INTERVAL = max(0.01, float(os.environ.get('CACHE_BUS_POLL_INTERVAL', '0.05')))
+BOOK_CACHE_TTL = max(60.0, float(os.environ.get('BOOK_CACHE_TTL', '86400')))
+# Scripture text never changes upstream, so passages are kept for a long time.
+BIBLE_API_CACHE_TTL = max(3600.0, float(os.environ.get('BIBLE_API_CACHE_TTL', str(30 * 86400))))
+# Book lists (/data/<translation>) are served stale past this age while one request refreshes them.
+BIBLE_API_BOOKS_FRESH_SECONDS = max(60.0, float(os.environ.get('BIBLE_API_BOOKS_FRESH_SECONDS', '86400')))
+BIBLE_COMPARE_WORKERS = max(2, int(os.environ.get('BIBLE_COMPARE_WORKERS', '12')))
+BIBLE_COMPARE_DEADLINE_SECONDS = max(1.0, float(os.environ.get('BIBLE_COMPARE_DEADLINE_SECONDS', '6')))
+SEMANTIC_INDEX_REFRESH_SECONDS = max(1.0, float(os.environ.get('SEMANTIC_INDEX_REFRESH_SECONDS', '15')))
+SEMANTIC_INDEX_REBUILD_SECONDS = max(60.0, float(os.environ.get('SEMANTIC_INDEX_REBUILD_SECONDS', '3600')))
+RECOMMEND_POOL_REFRESH_SECONDS = max(1.0, float(os.environ.get('RECOMMEND_POOL_REFRESH_SECONDS', '30')))
+RECOMMEND_POOL_REBUILD_SECONDS = max(60.0, float(os.environ.get('RECOMMEND_POOL_REBUILD_SECONDS', '3600')))
+RECOMMEND_USER_TTL_SECONDS = max(5.0, float(os.environ.get('RECOMMEND_USER_TTL_SECONDS', '300')))
+RECOMMEND_USER_CACHE_SIZE = max(100, int(os.environ.get('RECOMMEND_USER_CACHE_SIZE', '5000')))
+RECOMMEND_MAX_BATCH = max(1, int(os.environ.get('RECOMMEND_MAX_BATCH', '20')))
+RECOMMEND_CF_SEEDS = max(1, int(os.environ.get('RECOMMEND_CF_SEEDS', '20')))
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR') or os.path.join(BASE_DIR, 'data', 'verse_vectors')
+VECTOR_INDEX_JOB_SECONDS = max(10.0, float(os.environ.get('VECTOR_INDEX_JOB_SECONDS', '300')))
+# Retrain from scratch once the corpus has grown this much since the last fit; fold-in otherwise.
+VECTOR_INDEX_RETRAIN_GROWTH = max(0.05, float(os.environ.get('VECTOR_INDEX_RETRAIN_GROWTH', '0.25')))
+VERSE_NEIGHBORS_DIR = os.environ.get('VERSE_NEIGHBORS_DIR') or os.path.join(BASE_DIR, 'data', 'verse_neighbors')
+VERSE_NEIGHBORS_JOB_SECONDS = max(60.0, float(os.environ.get('VERSE_NEIGHBORS_JOB_SECONDS', '3600')))
+# Incremental runs never see unlikes/unsaves; a periodic full retrain drops them.
+VERSE_NEIGHBORS_RETRAIN_SECONDS = max(3600.0, float(os.environ.get('VERSE_NEIGHBORS_RETRAIN_SECONDS', str(7 * 86400))))
+VERSE_NEIGHBORS_TOP_N = max(5, int(os.environ.get('VERSE_NEIGHBORS_TOP_N', '40')))
+# Share of recommendations drawn from "liked together" neighbours when the user has any.
+RECOMMEND_CF_SHARE = max(0.0, min(1.0, float(os.environ.get('RECOMMEND_CF_SHARE', '0.7'))))
+BIBLE_API_CACHE_MAX_ENTRIES = max(64, int(os.environ.get('BIBLE_API_CACHE_MAX_ENTRIES', '4096')))
+BIBLE_API_CACHE_MAX_BYTES = max(1024 * 1024, int(os.environ.get('BIBLE_API_CACHE_MAX_BYTES', str(64 * 1024 * 1024))))
 API_RESPONSE_CACHE_ENABLED = str(
     os.environ.get('API_RESPONSE_CACHE_ENABLED', '0' if IMMEDIATE_UPDATE_MODE else '1')
 ).strip().lower() in ('1', 'true', 'yes', 'on')
@@ -262,6 +386,27 @@ _RATE_LIMIT_BUCKETS = {}
 _RATE_LIMIT_LOCK = threading.Lock()
 REALTIME_HEARTBEAT_SECONDS = max(2, min(10, int(os.environ.get('REALTIME_HEARTBEAT_SECONDS', '5'))))
 REALTIME_STREAM_MAX_SECONDS = max(8, min(28, int(os.environ.get('REALTIME_STREAM_MAX_SECONDS', '15'))))
+REALTIME_POLL_INTERVAL = max(0.01, float(os.environ.get('REALTIME_POLL_INTERVAL', '0.05')))
+REALTIME_REPLAY_SECONDS = max(30, int(os.environ.get('REALTIME_REPLAY_SECONDS', '300')))
+REALTIME_REPLAY_MAX = max(100, int(os.environ.get('REALTIME_REPLAY_MAX', '2000')))
+REALTIME_CHANNEL = 'bible_realtime'
+GENERATOR_LEADER_LOCK_ID = 4_201_773
+GENERATOR_LEADER_RETRY_SECONDS = max(1.0, float(os.environ.get('GENERATOR_LEADER_RETRY_SECONDS', '5')))
+GENERATOR_LOCK_PATH = os.environ.get('GENERATOR_LOCK_PATH') or os.path.join(BASE_DIR, 'generator.lock')
+VERSE_PREFETCH_DEPTH = max(1, min(20, int(os.environ.get('VERSE_PREFETCH_DEPTH', '3'))))
+VERSE_FETCH_TIMEOUT = max(1.0, float(os.environ.get('VERSE_FETCH_TIMEOUT', '10')))
+LIBRARY_PAGE_SIZE = max(10, int(os.environ.get('LIBRARY_PAGE_SIZE', '100')))
+LIBRARY_PAGE_MAX = max(LIBRARY_PAGE_SIZE, int(os.environ.get('LIBRARY_PAGE_MAX', '500')))
+LIBRARY_SEARCH_PAGE_SIZE = max(10, min(LIBRARY_PAGE_MAX, int(os.environ.get('LIBRARY_SEARCH_PAGE_SIZE', '200'))))
+VERSE_HASH_BACKFILL_CHUNK = max(50, int(os.environ.get('VERSE_HASH_BACKFILL_CHUNK', '500')))
+VERSE_BREAKER_FAILURES = max(1, int(os.environ.get('VERSE_BREAKER_FAILURES', '3')))
+VERSE_BREAKER_ERROR_RATE = max(0.1, min(1.0, float(os.environ.get('VERSE_BREAKER_ERROR_RATE', '0.5'))))
+VERSE_BREAKER_WINDOW = max(4, int(os.environ.get('VERSE_BREAKER_WINDOW', '20')))
+VERSE_BREAKER_COOLDOWN_SECONDS = max(1.0, float(os.environ.get('VERSE_BREAKER_COOLDOWN_SECONDS', '30')))
+VERSE_BREAKER_MAX_COOLDOWN_SECONDS = max(
+    VERSE_BREAKER_COOLDOWN_SECONDS, float(os.environ.get('VERSE_BREAKER_MAX_COOLDOWN_SECONDS', '600'))
+)
+REALTIME_PUBLISH_LOCK_ID = 4_201_772
 _REALTIME_SUBSCRIBERS = {}
 _REALTIME_SUBSCRIBERS_LOCK = threading.Lock()
 logger.info(
@@ -348,74 +493,7 @@ LIMITED_TIME_EVENTS = [
     }
 ]
 
-FALLBACK_BOOKS = [
-    {"id": "GEN", "name": "Genesis"},
-    {"id": "EXO", "name": "Exodus"},
-    {"id": "LEV", "name": "Leviticus"},
-    {"id": "NUM", "name": "Numbers"},
-    {"id": "DEU", "name": "Deuteronomy"},
-    {"id": "JOS", "name": "Joshua"},
-    {"id": "JDG", "name": "Judges"},
-    {"id": "RUT", "name": "Ruth"},
-    {"id": "1SA", "name": "1 Samuel"},
-    {"id": "2SA", "name": "2 Samuel"},
-    {"id": "1KI", "name": "1 Kings"},
-    {"id": "2KI", "name": "2 Kings"},
-    {"id": "1CH", "name": "1 Chronicles"},
-    {"id": "2CH", "name": "2 Chronicles"},
-    {"id": "EZR", "name": "Ezra"},
-    {"id": "NEH", "name": "Nehemiah"},
-    {"id": "EST", "name": "Esther"},
-    {"id": "JOB", "name": "Job"},
-    {"id": "PSA", "name": "Psalms"},
-    {"id": "PRO", "name": "Proverbs"},
-    {"id": "ECC", "name": "Ecclesiastes"},
-    {"id": "SNG", "name": "Song of Solomon"},
-    {"id": "ISA", "name": "Isaiah"},
-    {"id": "JER", "name": "Jeremiah"},
-    {"id": "LAM", "name": "Lamentations"},
-    {"id": "EZK", "name": "Ezekiel"},
-    {"id": "DAN", "name": "Daniel"},
-    {"id": "HOS", "name": "Hosea"},
-    {"id": "JOL", "name": "Joel"},
-    {"id": "AMO", "name": "Amos"},
-    {"id": "OBA", "name": "Obadiah"},
-    {"id": "JON", "name": "Jonah"},
-    {"id": "MIC", "name": "Micah"},
-    {"id": "NAM", "name": "Nahum"},
-    {"id": "HAB", "name": "Habakkuk"},
-    {"id": "ZEP", "name": "Zephaniah"},
-    {"id": "HAG", "name": "Haggai"},
-    {"id": "ZEC", "name": "Zechariah"},
-    {"id": "MAL", "name": "Malachi"},
-    {"id": "MAT", "name": "Matthew"},
-    {"id": "MRK", "name": "Mark"},
-    {"id": "LUK", "name": "Luke"},
-    {"id": "JHN", "name": "John"},
-    {"id": "ACT", "name": "Acts"},
-    {"id": "ROM", "name": "Romans"},
-    {"id": "1CO", "name": "1 Corinthians"},
-    {"id": "2CO", "name": "2 Corinthians"},
-    {"id": "GAL", "name": "Galatians"},
-    {"id": "EPH", "name": "Ephesians"},
-    {"id": "PHP", "name": "Philippians"},
-    {"id": "COL", "name": "Colossians"},
-    {"id": "1TH", "name": "1 Thessalonians"},
-    {"id": "2TH", "name": "2 Thessalonians"},
-    {"id": "1TI", "name": "1 Timothy"},
-    {"id": "2TI", "name": "2 Timothy"},
-    {"id": "TIT", "name": "Titus"},
-    {"id": "PHM", "name": "Philemon"},
-    {"id": "HEB", "name": "Hebrews"},
-    {"id": "JAS", "name": "James"},
-    {"id": "1PE", "name": "1 Peter"},
-    {"id": "2PE", "name": "2 Peter"},
-    {"id": "1JN", "name": "1 John"},
-    {"id": "2JN", "name": "2 John"},
-    {"id": "3JN", "name": "3 John"},
-    {"id": "JUD", "name": "Jude"},
-    {"id": "REV", "name": "Revelation"},
-]
+FALLBACK_BOOKS = [dict(book) for book in CANONICAL_BOOKS]
 
 _BIBLE_BOOK_ALIASES = {
     "psalm": "psalms",
@@ -458,6 +536,12 @@ def _reference_sort_parts(reference):
         return (int(match.group(1)), int(match.group(2)))
     return (10**9, 10**9)
 
+BIBLE_CORPUS = BibleCorpus(
+    os.environ.get('BIBLE_CORPUS_PATH') or os.path.join(BASE_DIR, 'data', 'bible_corpus.db'),
+    normalize=_normalize_bible_book_name,
+    aliases=_BIBLE_BOOK_ALIASES
+)
+
 BIBLE_BOOK_ORDER = {}
 for index, entry in enumerate(FALLBACK_BOOKS):
     key = _normalize_bible_book_name(entry.get("name"))
@@ -470,23 +554,20 @@ for alias_name, target_name in _BIBLE_BOOK_ALIASES.items():
     if target_key in BIBLE_BOOK_ORDER and alias_key:
         BIBLE_BOOK_ORDER[alias_key] = BIBLE_BOOK_ORDER[target_key]
 
-def _verse_matches_title_query(verse, query_key):
-    if not query_key:
-        return True
-    book_name = verse.get("book") or _extract_book_from_reference(verse.get("ref"))
+def _canonical_book_key(book_name):
     book_key = _normalize_bible_book_name(book_name)
-    ref_key = _normalize_bible_book_name(verse.get("ref"))
     if book_key in _BIBLE_BOOK_ALIASES:
         book_key = _normalize_bible_book_name(_BIBLE_BOOK_ALIASES[book_key])
-    return query_key in book_key or query_key in ref_key
+    return book_key
+
+def verse_canonical_parts(reference, book):
+    """(book_key, book_ord, chapter_num, verse_num) as stored on verses for canonical order."""
+    book_key = _canonical_book_key(book or _extract_book_from_reference(reference))
+    chapter, verse_num = _reference_sort_parts(reference)
+    return book_key, BIBLE_BOOK_ORDER.get(book_key, 10**6), chapter, verse_num
 
 def _library_verse_sort_key(verse):
-    book_name = verse.get("book") or _extract_book_from_reference(verse.get("ref"))
-    book_key = _normalize_bible_book_name(book_name)
-    if book_key in _BIBLE_BOOK_ALIASES:
-        book_key = _normalize_bible_book_name(_BIBLE_BOOK_ALIASES[book_key])
-    book_index = BIBLE_BOOK_ORDER.get(book_key, 10**6)
-    chapter, verse_num = _reference_sort_parts(verse.get("ref"))
+    _, book_index, chapter, verse_num = verse_canonical_parts(verse.get("ref"), verse.get("book"))
     ref = str(verse.get("ref") or "").lower()
     return (book_index, chapter, verse_num, ref)
 
@@ -554,12 +635,20 @@ def _mark_schema_ready(db_type, name):
     with _SCHEMA_READY_LOCK:
         _SCHEMA_READY_FLAGS.add(token)
 
-def _clear_schema_ready(db_type, name):
+def _clear_schema_ready(db_type, name, broadcast=True):
     token = _schema_ready_token(db_type, name)
     with _SCHEMA_READY_LOCK:
         _SCHEMA_READY_FLAGS.discard(token)
+    if broadcast:
+        publish_cache_event("schema", {"db_type": db_type, "name": name})
+
+def _on_schema_flag_cleared(payload):
+    _clear_schema_ready(payload.get("db_type"), payload.get("name"), broadcast=False)
 
 def _is_schema_ready_with_table(c, db_type, name, required_table):
+    if SCHEMA_BOOTSTRAPPED:
+        # run_schema_migrations() already created every registered table at startup.
+        return True
     if not _is_schema_ready(db_type, name):
         return False
     if _table_exists(c, db_type, required_table):
@@ -608,6 +697,8 @@ def _tune_sqlite_connection(conn):
         pass
 
 def ensure_performance_indexes(c, db_type):
+    if SCHEMA_BOOTSTRAPPED:
+        return
     statements = [
         "CREATE INDEX IF NOT EXISTS idx_likes_user_ts ON likes(user_id, timestamp)",
         "CREATE INDEX IF NOT EXISTS idx_likes_verse ON likes(verse_id)",
@@ -685,49 +776,597 @@ def _build_in_clause_params(db_type, values):
     placeholder = "%s" if db_type == 'postgres' else "?"
     return ",".join([placeholder] * len(safe_values)), tuple(safe_values)
 
+class SharedCacheStore:
+    """Key/value store in a local SQLite file shared by every worker on the host.
+
+    Also carries the cache bus event log when the main database is SQLite. Every
+    method degrades to a miss/no-op on error so a broken file never breaks requests.
+    """
+
+    SWEEP_EVERY = 30.0
+    EVENT_RETENTION = 120.0
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.errors = 0
+
+    def _conn(self):
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == pid:
+            return conn
+        conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=2000")
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS cache_entries (
+                        key TEXT PRIMARY KEY,
+                        body BLOB NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries(expires_at)")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS bus_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        payload TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS realtime_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        target TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_realtime_events_created ON realtime_events(created_at)")
+                self._schema_ready = True
+        self._local.conn = conn
+        self._local.pid = pid
+        return conn
+
+    def _failed(self, action, e):
+        self.errors += 1
+        logger.warning(f"Shared cache {action} failed: {e}")
+        self._local.conn = None
+
+    def get(self, key):
+        """(body, expires_at) for a live key, else None."""
+        try:
+            row = self._conn().execute(
+                "SELECT body, expires_at FROM cache_entries WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed("read", e)
+            return None
+        return (bytes(row[0]), row[1]) if row else None
+
+    def set_many(self, items):
+        """items: iterable of (key, body bytes, expires_at)."""
+        items = list(items)
+        if not items:
+            return
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache_entries (key, body, expires_at) VALUES (?, ?, ?)",
+                    [(k, sqlite3.Binary(b), exp) for k, b, exp in items]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._failed("write", e)
+
+    def delete_prefixes(self, prefixes):
+        """Delete exact keys and key-prefix ranges, using the primary key index."""
+        try:
+            conn = self._conn()
+            for prefix in prefixes:
+                if not prefix:
+                    continue
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                conn.execute("DELETE FROM cache_entries WHERE key >= ? AND key < ?", (prefix, upper))
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.SWEEP_EVERY:
+            return
+        self._last_sweep = now
+        try:
+            conn = self._conn()
+            conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM bus_events WHERE created_at < ?", (now - self.EVENT_RETENTION,))
+            conn.execute("DELETE FROM realtime_events WHERE created_at < ?", (now - REALTIME_REPLAY_SECONDS,))
+        except sqlite3.Error as e:
+            self._failed("sweep", e)
+
+    def append_event(self, payload):
+        try:
+            self._conn().execute(
+                "INSERT INTO bus_events (payload, created_at) VALUES (?, ?)",
+                (payload, time.time())
+            )
+            return True
+        except sqlite3.Error as e:
+            self._failed("event append", e)
+            return False
+
+    def last_event_id(self):
+        try:
+            row = self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM bus_events").fetchone()
+            return int(row[0] or 0)
+        except sqlite3.Error as e:
+            self._failed("event read", e)
+            return 0
+
+    def events_after(self, last_id):
+        try:
+            return self._conn().execute(
+                "SELECT id, payload FROM bus_events WHERE id > ? ORDER BY id LIMIT 500", (last_id,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._failed("event read", e)
+            return []
+
+    def append_realtime(self, target, payload):
+        """Append a realtime event; returns its hub-wide sequence id (None on failure)."""
+        try:
+            cur = self._conn().execute(
+                "INSERT INTO realtime_events (target, payload, created_at) VALUES (?, ?, ?)",
+                (target, payload, time.time())
+            )
+            return cur.lastrowid
+        except sqlite3.Error as e:
+            self._failed("realtime append", e)
+            return None
+
+    def realtime_after(self, last_id, target=None, upto=None, limit=500):
+        """[(id, target, payload)] after last_id, optionally only those visible to target."""
+        sql = "SELECT id, target, payload FROM realtime_events WHERE id > ?"
+        params = [last_id]
+        if target is not None:
+            sql += " AND target IN ('*', ?)"
+            params.append(str(target))
+        if upto is not None:
+            sql += " AND id <= ?"
+            params.append(upto)
+        sql += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        try:
+            return self._conn().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            self._failed("realtime read", e)
+            return []
+
+    def realtime_bounds(self):
+        """(oldest retained id, newest id); (0, 0) when empty."""
+        try:
+            row = self._conn().execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM realtime_events").fetchone()
+            return int(row[0] or 0), int(row[1] or 0)
+        except sqlite3.Error as e:
+            self._failed("realtime read", e)
+            return 0, 0
+
+    def stats(self):
+        try:
+            row = self._conn().execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+            entries = int(row[0] or 0)
+        except sqlite3.Error:
+            entries = None
+        return {"path": self.path, "entries": entries, "errors": self.errors}
+
+class CacheBus:
+    """Fans cache invalidations out to every worker.
+
+    On Postgres messages travel over LISTEN/NOTIFY; otherwise they are appended to
+    the shared cache file and each worker polls for new rows every
+    CACHE_BUS_POLL_INTERVAL seconds. Handlers never see their own process's messages,
+    since the publisher already applied the change locally.
+    """
+
+    def __init__(self, store, channel, poll_interval):
+        self.store = store
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.backend = None
+        self.origin = None
+        self._handlers = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.received = 0
+        self.publish_errors = 0
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, payload):
+        self.ensure_listener()
+        message = json.dumps({"o": self.origin, "t": topic, "p": payload}, separators=(",", ":"))
+        try:
+            if self.backend == 'postgres':
+                conn, db_type = get_db()
+                try:
+                    c = conn.cursor()
+                    c.execute("SELECT pg_notify(%s, %s)", (self.channel, message))
+                    conn.commit()
+                finally:
+                    conn.close()
+            elif not self.store.append_event(message):
+                self.publish_errors += 1
+                return
+            self.published += 1
+        except Exception as e:
+            self.publish_errors += 1
+            logger.warning(f"Cache bus publish failed ({topic}): {e}")
+
+    def _dispatch(self, message):
+        try:
+            data = json.loads(message)
+        except Exception:
+            return
+        if data.get("o") == self.origin:
+            return
+        self.received += 1
+        for handler in self._handlers.get(data.get("t"), ()):
+            try:
+                handler(data.get("p"))
+            except Exception as e:
+                logger.warning(f"Cache bus handler failed ({data.get('t')}): {e}")
+
+    def _listen_postgres(self):
+        import select
+        import psycopg2.extensions
+        while True:
+            conn = None
+            try:
+                conn = _connect_postgres()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {self.channel}")
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"Cache bus listener reconnecting: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(1.0)
+
+    def _listen_file(self):
+        last_id = self.store.last_event_id()
+        while True:
+            time.sleep(self.poll_interval)
+            for event_id, message in self.store.events_after(last_id):
+                last_id = event_id
+                self._dispatch(message)
+
+    def ensure_listener(self):
+        """Start the listener once per process (again after a fork)."""
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self.origin = f"{pid}-{secrets.token_hex(4)}"
+            self.backend = 'postgres' if (IS_POSTGRES and POSTGRES_AVAILABLE) else 'file'
+            target = self._listen_postgres if self.backend == 'postgres' else self._listen_file
+            self._thread = threading.Thread(target=target, name="cache-bus")
+            self._thread.daemon = True
+            self._pid = pid
+            self._thread.start()
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "published": self.published,
+            "received": self.received,
+            "publish_errors": self.publish_errors,
+        }
+
+_SHARED_CACHE_STORE = SharedCacheStore(SHARED_CACHE_PATH) if SHARED_CACHE_ENABLED else None
+_CACHE_BUS = CacheBus(_SHARED_CACHE_STORE, CACHE_BUS_CHANNEL, CACHE_BUS_POLL_INTERVAL) if SHARED_CACHE_ENABLED else None
+
+def publish_cache_event(topic, payload):
+    """Tell the other workers about a local cache change; no-op when sharing is off."""
+    if _CACHE_BUS is not None:
+        _CACHE_BUS.publish(topic, payload)
+
+class ResponseCache:
+    """Bounded LRU cache of pre-serialized JSON responses.
+
+    Keys are colon-delimited namespaces ("comments:<viewer>:<verse>"); every key is
+    indexed under each of its namespace prefixes ("comments:", "comments:<viewer>:")
+    so invalidating a namespace only touches the entries inside it. Entries are
+    evicted least-recently-used once max_entries or max_bytes is exceeded, and a
+    background sweeper drops expired entries nobody reads again.
+
+    With a shared store, local misses fall through to the host-wide cache file and
+    invalidations are broadcast on the cache bus so every worker drops its copy.
+    """
+
+    def __init__(self, max_entries, max_bytes, sweep_interval, name='api', shared=None):
+        self.name = name
+        self.shared = shared
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()  # key -> (body bytes, expires_at)
+        self._namespaces = {}  # namespace prefix -> set of keys
+        self._expiry_heap = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._sweeper_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.shared_hits = 0
+
+    @staticmethod
+    def _namespaces_for(key):
+        parts = str(key).split(':')
+        return [':'.join(parts[:i]) + ':' for i in range(1, len(parts))]
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= len(entry[0])
+        for ns in self._namespaces_for(key):
+            members = self._namespaces.get(ns)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._namespaces[ns]
+        return True
+
+    def get(self, key):
+        """Cached body bytes for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self.shared is None:
+                self.misses += 1
+                return None
+        found = self.shared.get(self._shared_key(key))
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._store_local(key, found[0], found[1])
+        return found[0]
+
+    def _shared_key(self, key):
+        return f"{self.name}/{key}"
+
+    def _store_local(self, key, body, expires_at):
+        self._drop(key)
+        self._entries[key] = (body, expires_at)
+        self._bytes += len(body)
+        for ns in self._namespaces_for(key):
+            self._namespaces.setdefault(ns, set()).add(key)
+        heapq.heappush(self._expiry_heap, (expires_at, key))
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def set(self, key, body, ttl):
+        self.set_many([(key, body)], ttl)
+
+    def set_many(self, items, ttl):
+        """Store several (key, body bytes) pairs with one shared-store write."""
+        expires_at = time.time() + ttl
+        shared_items = []
+        with self._lock:
+            for key, body in items:
+                if ttl <= 0 or len(body) > self.max_bytes:
+                    self._drop(key)
+                    continue
+                self._store_local(key, body, expires_at)
+                shared_items.append((self._shared_key(key), body, expires_at))
+        if self.shared is not None:
+            self.shared.set_many(shared_items)
+        self._ensure_sweeper()
+
+    def invalidate(self, *prefixes):
+        """Drop every key under the given prefixes here, in the shared store and on other workers."""
+        prefixes = [p for p in prefixes if p]
+        dropped = self.invalidate_local(prefixes)
+        if self.shared is not None and prefixes:
+            self.shared.delete_prefixes([self._shared_key(p) for p in prefixes])
+            publish_cache_event("cache", {"cache": self.name, "prefixes": prefixes})
+        return dropped
+
+    def invalidate_local(self, prefixes):
+        dropped = 0
+        with self._lock:
+            for prefix in prefixes:
+                if not prefix:
+                    continue
+                if prefix.endswith(':'):
+                    keys = list(self._namespaces.get(prefix, ()))
+                elif prefix in self._entries:
+                    keys = [prefix]
+                else:
+                    # Partial segment, e.g. "comm": rare, so a scan is acceptable.
+                    keys = [k for k in self._entries if str(k).startswith(prefix)]
+                for key in keys:
+                    if self._drop(key):
+                        dropped += 1
+            self.invalidations += dropped
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+            self._expiry_heap = []
+            self._bytes = 0
+
+    def sweep(self):
+        """Remove expired entries; cost is proportional to what expired."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                expires_at, key = heapq.heappop(heap)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == expires_at:
+                    self._drop(key)
+                    removed += 1
+            # Overwritten/evicted keys leave stale heap items behind; rebuild when they dominate.
+            if len(heap) > 4 * max(64, len(self._entries)):
+                self._expiry_heap = [(exp, k) for k, (_, exp) in self._entries.items()]
+                heapq.heapify(self._expiry_heap)
+            self.expirations += removed
+        if self.shared is not None:
+            self.shared.sweep()
+        return removed
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"API cache sweep failed: {e}")
+
+    def _ensure_sweeper(self):
+        pid = os.getpid()
+        if self._sweeper is not None and self._sweeper.is_alive() and self._sweeper_pid == pid:
+            return
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive() and self._sweeper_pid == pid:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="api-cache-sweeper")
+            self._sweeper.daemon = True
+            self._sweeper_pid = pid
+            self._sweeper.start()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "namespaces": len(self._namespaces),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "shared_hits": self.shared_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+_API_RESPONSE_CACHE = ResponseCache(
+    API_RESPONSE_CACHE_MAX_ENTRIES,
+    API_RESPONSE_CACHE_MAX_BYTES,
+    API_RESPONSE_CACHE_SWEEP_INTERVAL,
+    name='api',
+    shared=_SHARED_CACHE_STORE,
+)
+_BOOK_CACHE = ResponseCache(256, 96 * 1024 * 1024, API_RESPONSE_CACHE_SWEEP_INTERVAL, name='books', shared=_SHARED_CACHE_STORE)
+_BIBLE_API_CACHE = ResponseCache(
+    BIBLE_API_CACHE_MAX_ENTRIES,
+    BIBLE_API_CACHE_MAX_BYTES,
+    API_RESPONSE_CACHE_SWEEP_INTERVAL,
+    name='bible',
+    shared=_SHARED_CACHE_STORE,
+)
+_RESPONSE_CACHES = {"api": _API_RESPONSE_CACHE, "books": _BOOK_CACHE, "bible": _BIBLE_API_CACHE}
+
+def _on_cache_invalidated(payload):
+    cache = _RESPONSE_CACHES.get((payload or {}).get("cache"))
+    if cache is not None:
+        cache.invalidate_local(payload.get("prefixes") or [])
+
+if _CACHE_BUS is not None:
+    _CACHE_BUS.subscribe("cache", _on_cache_invalidated)
+
 def _api_cache_get(key):
     if not API_RESPONSE_CACHE_ENABLED:
         return None
-    now = time.time()
-    with _API_RESPONSE_CACHE_LOCK:
-        entry = _API_RESPONSE_CACHE.get(key)
-        if not entry:
-            return None
-        expires_at = entry.get('expires_at', 0)
-        if expires_at <= now:
-            _API_RESPONSE_CACHE.pop(key, None)
-            return None
-        return entry.get('value')
+    body = _API_RESPONSE_CACHE.get(key)
+    if body is None:
+        return None
+    return json.loads(body)
+
+def _api_cache_response(key):
+    """Cached JSON response for key, built straight from the stored bytes."""
+    if not API_RESPONSE_CACHE_ENABLED:
+        return None
+    body = _API_RESPONSE_CACHE.get(key)
+    if body is None:
+        return None
+    return Response(body, mimetype='application/json')
 
 def _api_cache_set(key, value, ttl=None):
     if not API_RESPONSE_CACHE_ENABLED:
         return
-    try:
-        payload = json.loads(json.dumps(value))
-    except Exception:
-        payload = value
     ttl_sec = float(ttl if ttl is not None else API_RESPONSE_CACHE_TTL)
-    if ttl_sec <= 0:
-        with _API_RESPONSE_CACHE_LOCK:
-            _API_RESPONSE_CACHE.pop(key, None)
+    try:
+        body = (app.json.dumps(value, separators=(",", ":")) + "\n").encode('utf-8')
+    except Exception as e:
+        logger.warning(f"API cache skipped unserializable value for {key}: {e}")
+        _API_RESPONSE_CACHE.invalidate(key)
         return
-    with _API_RESPONSE_CACHE_LOCK:
-        _API_RESPONSE_CACHE[key] = {
-            'value': payload,
-            'expires_at': time.time() + ttl_sec
-        }
+    _API_RESPONSE_CACHE.set(key, body, ttl_sec)
 
 def _api_cache_invalidate_prefixes(*prefixes):
     if not API_RESPONSE_CACHE_ENABLED:
         return
-    clean_prefixes = [p for p in prefixes if p]
-    if not clean_prefixes:
-        return
-    with _API_RESPONSE_CACHE_LOCK:
-        keys = list(_API_RESPONSE_CACHE.keys())
-        for key in keys:
-            if any(str(key).startswith(prefix) for prefix in clean_prefixes):
-                _API_RESPONSE_CACHE.pop(key, None)
+    _API_RESPONSE_CACHE.invalidate(*prefixes)
+
+def get_api_cache_stats():
+    stats = _API_RESPONSE_CACHE.stats()
+    stats["enabled"] = API_RESPONSE_CACHE_ENABLED
+    stats["books"] = _BOOK_CACHE.stats()
+    stats["bible"] = _BIBLE_API_CACHE.stats()
+    stats["bible"]["coalesced"] = _BIBLE_FETCHES.coalesced
+    if _SHARED_CACHE_STORE is not None:
+        stats["shared"] = _SHARED_CACHE_STORE.stats()
+        stats["bus"] = _CACHE_BUS.stats()
+    return stats
 
 def check_rate_limit(user_id, action, limit, window_seconds):
     if not user_id:
@@ -761,87 +1400,378 @@ def moderate_user_content(text):
         return True, "Message appears to be spam."
     return False, ""
 
-def _realtime_subscribe(user_id):
-    q = queue.Queue(maxsize=200)
-    uid = int(user_id)
-    with _REALTIME_SUBSCRIBERS_LOCK:
-        _REALTIME_SUBSCRIBERS.setdefault(uid, []).append(q)
-    return q
-
-def _realtime_unsubscribe(user_id, q):
-    uid = int(user_id)
-    with _REALTIME_SUBSCRIBERS_LOCK:
-        buckets = _REALTIME_SUBSCRIBERS.get(uid) or []
-        if q in buckets:
-            buckets.remove(q)
-        if not buckets:
-            _REALTIME_SUBSCRIBERS.pop(uid, None)
-
-def _realtime_current_user_ids():
-    with _REALTIME_SUBSCRIBERS_LOCK:
-        return list(_REALTIME_SUBSCRIBERS.keys())
+class RealtimeBroker:
+    """Delivers realtime events to SSE subscribers in every worker, in order.
 
-def publish_realtime_event(user_ids, event_type, payload=None):
-    event = str(event_type or '').strip() or 'message'
-    data = payload if isinstance(payload, dict) else {}
-    packet = {"event": event, "payload": data, "ts": datetime.now().isoformat()}
+    Each published event gets a sequence id from a shared log: the realtime_events
+    table with LISTEN/NOTIFY on Postgres, or the shared cache file polled every
+    REALTIME_POLL_INTERVAL seconds on SQLite. A per-process thread reads the log in
+    id order and fans events out to local per-user mailboxes, keeping the most
+    recent REALTIME_REPLAY_MAX of them so a reconnecting stream can resume from its
+    Last-Event-ID. Without a shared log (SHARED_CACHE_ENABLED=0 on SQLite) ids are
+    process-local and delivery only reaches streams on the publishing worker.
+    """
 
-    if user_ids is None:
-        targets = _realtime_current_user_ids()
-    elif isinstance(user_ids, (list, tuple, set)):
-        targets = []
-        for u in user_ids:
+    def __init__(self):
+        self.backend = None
+        self._pid = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()  # guards high_water, ring and the subscriber map together
+        self._ring = deque(maxlen=REALTIME_REPLAY_MAX)
+        self.high_water = 0
+        self._local_seq = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.publish_errors = 0
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid and (self._thread is None or self._thread.is_alive()):
+            return
+        with self._start_lock:
+            if self._pid == pid and (self._thread is None or self._thread.is_alive()):
+                return
+            with self._lock:
+                self._ring.clear()
+            if IS_POSTGRES and POSTGRES_AVAILABLE:
+                self.backend = 'postgres'
+                self.high_water = self._pg_max_id()
+                target = self._listen_postgres
+            elif _SHARED_CACHE_STORE is not None:
+                self.backend = 'file'
+                self.high_water = _SHARED_CACHE_STORE.realtime_bounds()[1]
+                target = self._poll_file
+            else:
+                self.backend = 'local'
+                target = None
+            self._pid = pid
+            self._thread = None
+            if target is not None:
+                self._thread = threading.Thread(target=target, name="realtime-broker")
+                self._thread.daemon = True
+                self._thread.start()
+
+    # Subscribers -----------------------------------------------------------
+
+    def subscribe(self, user_id, mailbox=None):
+        """Register a mailbox; returns (mailbox, high_water). Every event above high_water will reach it.
+
+        mailbox defaults to a queue.Queue; any object with put_nowait() works (the
+        asyncio server passes one that hands packets to its event loop).
+        """
+        self.ensure_started()
+        q = mailbox if mailbox is not None else queue.Queue(maxsize=200)
+        uid = int(user_id)
+        with self._lock:
+            with _REALTIME_SUBSCRIBERS_LOCK:
+                _REALTIME_SUBSCRIBERS.setdefault(uid, []).append(q)
+            return q, self.high_water
+
+    def unsubscribe(self, user_id, q):
+        uid = int(user_id)
+        with _REALTIME_SUBSCRIBERS_LOCK:
+            buckets = _REALTIME_SUBSCRIBERS.get(uid) or []
+            if q in buckets:
+                buckets.remove(q)
+            if not buckets:
+                _REALTIME_SUBSCRIBERS.pop(uid, None)
+
+    def replay(self, user_id, after_id, upto_id):
+        """Packets for user_id with after_id < id <= upto_id, plus whether older ones were lost."""
+        uid = str(int(user_id))
+        if after_id >= upto_id:
+            return [], False
+        with self._lock:
+            ring_start = self._ring[0][0] if self._ring else None
+            if ring_start is not None and ring_start <= after_id + 1:
+                return [packet for event_id, target, packet in self._ring
+                        if after_id < event_id <= upto_id and target in ('*', uid)], False
+        if self.backend == 'local':
+            return [], True
+        rows = self._fetch_after(after_id, target=uid, upto=upto_id, limit=REALTIME_REPLAY_MAX)
+        oldest = self._oldest_id()
+        packets = []
+        for event_id, target, payload in rows:
             try:
-                targets.append(int(u))
+                packet = json.loads(payload)
             except Exception:
                 continue
-    else:
-        try:
-            targets = [int(user_ids)]
-        except Exception:
-            targets = []
-
-    if not targets:
-        return
-
-    with _REALTIME_SUBSCRIBERS_LOCK:
-        for uid in targets:
-            queues = _REALTIME_SUBSCRIBERS.get(uid) or []
-            for q in list(queues):
+            packet["id"] = int(event_id)
+            packets.append(packet)
+        return packets, bool(oldest and oldest > after_id + 1)
+
+    # Publishing ------------------------------------------------------------
+
+    def publish(self, targets, packet):
+        """targets: list of user ids, or None for every connected user."""
+        self.ensure_started()
+        target_keys = ['*'] if targets is None else [str(int(t)) for t in targets]
+        body = json.dumps(packet, separators=(",", ":"))
+        for target in target_keys:
+            try:
+                if self.backend == 'postgres':
+                    self._publish_postgres(target, body)
+                elif self.backend == 'file':
+                    event_id = _SHARED_CACHE_STORE.append_realtime(target, body)
+                    if event_id is None:
+                        raise RuntimeError("hub write failed")
+                    self._wake.set()
+                else:
+                    with self._lock:
+                        self._local_seq += 1
+                        event_id = self._local_seq
+                    self._deliver(event_id, target, dict(packet))
+                self.published += 1
+            except Exception as e:
+                # Never lose the event for streams on this worker, even if the shared log is down.
+                self.publish_errors += 1
+                logger.warning(f"Realtime publish failed ({packet.get('event')}): {e}")
+                self._deliver(None, target, dict(packet))
+
+    def _deliver(self, event_id, target, packet):
+        if event_id is not None:
+            packet["id"] = int(event_id)
+        with self._lock:
+            if event_id is not None:
+                if event_id <= self.high_water:
+                    return
+                self.high_water = int(event_id)
+                self._ring.append((int(event_id), target, packet))
+            with _REALTIME_SUBSCRIBERS_LOCK:
+                if target == '*':
+                    queues = [q for bucket in _REALTIME_SUBSCRIBERS.values() for q in bucket]
+                else:
+                    queues = list(_REALTIME_SUBSCRIBERS.get(int(target)) or [])
+        for q in queues:
+            try:
+                q.put_nowait(packet)
+                self.delivered += 1
+            except queue.Full:
+                # Drop oldest message to keep stream responsive.
+                self.dropped += 1
                 try:
+                    q.get_nowait()
                     q.put_nowait(packet)
                 except Exception:
-                    # Drop oldest message to keep stream responsive.
-                    try:
-                        q.get_nowait()
-                        q.put_nowait(packet)
-                    except Exception:
-                        pass
+                    pass
 
-def ensure_growth_feature_tables(c, db_type):
-    if _is_schema_ready_with_table(c, db_type, "growth_features", "notification_preferences"):
-        return
+    def _deliver_rows(self, rows):
+        for event_id, target, payload in rows:
+            try:
+                packet = json.loads(payload)
+            except Exception:
+                continue
+            self._deliver(int(event_id), str(target), packet)
 
-    if db_type == 'postgres':
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS faith_groups (
-                id SERIAL PRIMARY KEY,
-                slug TEXT UNIQUE,
-                name TEXT NOT NULL,
-                description TEXT,
-                is_private INTEGER DEFAULT 0,
-                owner_user_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS faith_group_members (
-                id SERIAL PRIMARY KEY,
-                group_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                role TEXT DEFAULT 'member',
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(group_id, user_id)
+    # Backends --------------------------------------------------------------
+
+    def _fetch_after(self, after_id, target=None, upto=None, limit=500):
+        if self.backend == 'file':
+            return _SHARED_CACHE_STORE.realtime_after(after_id, target=target, upto=upto, limit=limit)
+        conn, db_type = get_db()
+        try:
+            c = conn.cursor()
+            sql = "SELECT id, target, payload FROM realtime_events WHERE id > %s"
+            params = [after_id]
+            if target is not None:
+                sql += " AND target IN ('*', %s)"
+                params.append(target)
+            if upto is not None:
+                sql += " AND id <= %s"
+                params.append(upto)
+            sql += " ORDER BY id LIMIT %s"
+            params.append(limit)
+            c.execute(sql, params)
+            return [(r[0], r[1], r[2]) for r in c.fetchall()]
+        finally:
+            conn.close()
+
+    def _oldest_id(self):
+        if self.backend == 'file':
+            return _SHARED_CACHE_STORE.realtime_bounds()[0]
+        try:
+            conn, db_type = get_db()
+            try:
+                c = conn.cursor()
+                c.execute("SELECT COALESCE(MIN(id), 0) FROM realtime_events")
+                return int(c.fetchone()[0] or 0)
+            finally:
+                conn.close()
+        except Exception:
+            return 0
+
+    def _pg_max_id(self):
+        try:
+            conn, db_type = get_db()
+            try:
+                c = conn.cursor()
+                c.execute("SELECT COALESCE(MAX(id), 0) FROM realtime_events")
+                return int(c.fetchone()[0] or 0)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"Realtime broker could not read the event log: {e}")
+            return 0
+
+    def _publish_postgres(self, target, body):
+        conn, db_type = get_db()
+        try:
+            c = conn.cursor()
+            # Serialise publishers so commit order (and so NOTIFY order) matches id order.
+            c.execute("SELECT pg_advisory_xact_lock(%s)", (REALTIME_PUBLISH_LOCK_ID,))
+            c.execute(
+                "INSERT INTO realtime_events (target, payload, created_at) VALUES (%s, %s, %s) RETURNING id",
+                (target, body, time.time())
+            )
+            event_id = int(c.fetchone()[0])
+            note = json.dumps({"id": event_id, "target": target, "payload": body}, separators=(",", ":"))
+            if len(note) > 7900:
+                # NOTIFY payloads are capped at 8000 bytes; listeners fetch big events from the table.
+                note = json.dumps({"id": event_id})
+            c.execute("SELECT pg_notify(%s, %s)", (REALTIME_CHANNEL, note))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _listen_postgres(self):
+        import select
+        import psycopg2.extensions
+        last_prune = 0.0
+        while True:
+            conn = None
+            try:
+                conn = _connect_postgres()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {REALTIME_CHANNEL}")
+                # Catch up on anything published while we were (re)connecting.
+                self._deliver_rows(self._fetch_after(self.high_water, limit=REALTIME_REPLAY_MAX))
+                while True:
+                    if time.time() - last_prune > 60:
+                        last_prune = time.time()
+                        conn.cursor().execute(
+                            "DELETE FROM realtime_events WHERE created_at < %s",
+                            (time.time() - REALTIME_REPLAY_SECONDS,)
+                        )
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = json.loads(conn.notifies.pop(0).payload)
+                        if note["id"] != self.high_water + 1 or "payload" not in note:
+                            # Gap or oversized event: read the log in order instead.
+                            self._deliver_rows(self._fetch_after(self.high_water, upto=note["id"]))
+                        else:
+                            self._deliver_rows([(note["id"], note["target"], note["payload"])])
+            except Exception as e:
+                logger.warning(f"Realtime listener reconnecting: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(1.0)
+
+    def _poll_file(self):
+        while True:
+            self._wake.wait(REALTIME_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                rows = _SHARED_CACHE_STORE.realtime_after(self.high_water)
+                self._deliver_rows(rows)
+                _SHARED_CACHE_STORE.sweep()
+            except Exception as e:
+                logger.warning(f"Realtime poll failed: {e}")
+                time.sleep(1.0)
+
+    def stats(self):
+        with _REALTIME_SUBSCRIBERS_LOCK:
+            streams = sum(len(b) for b in _REALTIME_SUBSCRIBERS.values())
+            users = len(_REALTIME_SUBSCRIBERS)
+        return {
+            "backend": self.backend,
+            "high_water": self.high_water,
+            "replay_buffer": len(self._ring),
+            "streams": streams,
+            "users": users,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "publish_errors": self.publish_errors,
+        }
+
+_REALTIME_BROKER = RealtimeBroker()
+
+def _realtime_subscribe(user_id):
+    return _REALTIME_BROKER.subscribe(user_id)
+
+def _realtime_unsubscribe(user_id, q):
+    _REALTIME_BROKER.unsubscribe(user_id, q)
+
+def _realtime_frame(packet):
+    """One SSE frame; events from the shared log carry an id: line for Last-Event-ID."""
+    event_id = packet.get('id')
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}data: {json.dumps(packet)}\n\n"
+
+def _realtime_current_user_ids():
+    with _REALTIME_SUBSCRIBERS_LOCK:
+        return list(_REALTIME_SUBSCRIBERS.keys())
+
+def publish_realtime_event(user_ids, event_type, payload=None):
+    event = str(event_type or '').strip() or 'message'
+    data = payload if isinstance(payload, dict) else {}
+    packet = {"event": event, "payload": data, "ts": datetime.now().isoformat()}
+
+    if user_ids is None:
+        targets = None
+    elif isinstance(user_ids, (list, tuple, set)):
+        targets = []
+        for u in user_ids:
+            try:
+                targets.append(int(u))
+            except Exception:
+                continue
+    else:
+        try:
+            targets = [int(user_ids)]
+        except Exception:
+            targets = []
+
+    if targets is not None and not targets:
+        return
+
+    _REALTIME_BROKER.publish(targets, packet)
+
+def ensure_growth_feature_tables(c, db_type):
+    if _is_schema_ready_with_table(c, db_type, "growth_features", "notification_preferences"):
+        return
+
+    if db_type == 'postgres':
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS faith_groups (
+                id SERIAL PRIMARY KEY,
+                slug TEXT UNIQUE,
+                name TEXT NOT NULL,
+                description TEXT,
+                is_private INTEGER DEFAULT 0,
+                owner_user_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS faith_group_members (
+                id SERIAL PRIMARY KEY,
+                group_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                role TEXT DEFAULT 'member',
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(group_id, user_id)
             )
         """)
         c.execute("""
@@ -1280,18 +2210,540 @@ def record_moderation_event_quick(user_id, source, event_type, score=1.0, meta=N
             except Exception:
                 pass
 
-def _semantic_score_verse(query_tokens, verse):
-    text = _normalize_mem_text(verse.get("text"))
-    ref = _normalize_bible_book_name(verse.get("ref"))
-    book = _normalize_bible_book_name(verse.get("book"))
-    hay_tokens = set((text + " " + ref + " " + book).split())
-    if not hay_tokens:
-        return 0.0
-    hits = len([t for t in query_tokens if t in hay_tokens])
-    overlap = hits / max(1, len(set(query_tokens)))
-    phrase = " ".join(query_tokens)
-    similarity = SequenceMatcher(None, phrase, text[:min(len(text), 500)]).ratio() if phrase else 0.0
-    return round((overlap * 0.75) + (similarity * 0.25), 6)
+class VerseSearchIndex:
+    """In-memory inverted index over every verse for /api/search/semantic.
+
+    Each verse is indexed once as the set of its normalized text tokens plus its
+    normalized reference and book. A query is scored by IDF-weighted token overlap
+    accumulated over the query tokens' posting lists only (NumPy bincount when
+    available), plus a bonus when the whole normalized query appears in the text.
+    Cost follows the posting lists touched, not the number of verses.
+
+    The leader adds rows as fetch_verse() stores them; every process also pulls rows
+    above its high-water id at most every SEMANTIC_INDEX_REFRESH_SECONDS and
+    rebuilds from scratch every SEMANTIC_INDEX_REBUILD_SECONDS to drop deleted rows.
+    """
+
+    PHRASE_BONUS = 0.15
+    RERANK_POOL = 200
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._reset()
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+        self.queries = 0
+
+    def _reset(self):
+        self.docs = []  # verse dicts, position = doc index
+        self.texts = []  # normalized text per doc
+        self.doc_ids = set()
+        self.postings = {}  # token -> list of doc indices
+        self._arrays = {}  # token -> cached numpy posting array
+        self.max_id = 0
+
+    @staticmethod
+    def _doc_tokens(verse):
+        text = _normalize_mem_text(verse.get("text"))
+        tokens = set(text.split())
+        for extra in (_normalize_bible_book_name(verse.get("ref")), _normalize_bible_book_name(verse.get("book"))):
+            if extra:
+                tokens.add(extra)
+        return text, tokens
+
+    def _add_locked(self, verse):
+        verse_id = verse.get("id")
+        if verse_id is None or verse_id in self.doc_ids:
+            return
+        text, tokens = self._doc_tokens(verse)
+        index = len(self.docs)
+        self.docs.append(verse)
+        self.texts.append(text)
+        self.doc_ids.add(verse_id)
+        for token in tokens:
+            self.postings.setdefault(token, []).append(index)
+            self._arrays.pop(token, None)
+        try:
+            self.max_id = max(self.max_id, int(verse_id))
+        except (TypeError, ValueError):
+            pass
+
+    def add(self, verse):
+        with self._lock:
+            self._add_locked(verse)
+
+    @staticmethod
+    def _row_verse(row):
+        return {
+            "id": row_pick(row, 'id', 0),
+            "ref": row_pick(row, 'reference', 1),
+            "text": row_pick(row, 'text', 2) or '',
+            "trans": row_pick(row, 'translation', 3),
+            "source": row_pick(row, 'source', 4),
+            "timestamp": row_pick(row, 'timestamp', 5),
+            "book": row_pick(row, 'book', 6)
+        }
+
+    def _load_rows(self, after_id):
+        conn, db_type = get_db()
+        try:
+            c = get_cursor(conn, db_type)
+            placeholder = '%s' if db_type == 'postgres' else '?'
+            c.execute(f"""
+                SELECT id, reference, text, translation, source, timestamp, book
+                FROM verses
+                WHERE id > {placeholder}
+                ORDER BY id
+            """, (after_id,))
+            verses = []
+            while True:
+                rows = c.fetchmany(2000)
+                if not rows:
+                    break
+                verses.extend(self._row_verse(row) for row in rows)
+            return verses
+        finally:
+            conn.close()
+
+    def ensure_fresh(self):
+        """Build on first use, rebuild periodically, otherwise pull rows newer than max_id."""
+        # Only the very first build makes callers wait; later refreshes are skipped if one is running.
+        if not self._refresh_lock.acquire(blocking=not self.built_at):
+            return
+        try:
+            self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        now = time.time()
+        if now - self.built_at >= SEMANTIC_INDEX_REBUILD_SECONDS:
+            verses = self._load_rows(0)
+            with self._lock:
+                self._reset()
+                for verse in verses:
+                    self._add_locked(verse)
+                self.built_at = self.refreshed_at = now
+            logger.info(f"Semantic index built: {len(verses)} verses, {len(self.postings)} tokens")
+        elif now - self.refreshed_at >= SEMANTIC_INDEX_REFRESH_SECONDS:
+            self.refreshed_at = now
+            verses = self._load_rows(self.max_id)
+            with self._lock:
+                for verse in verses:
+                    self._add_locked(verse)
+
+    def _idf(self, token, total):
+        df = len(self.postings.get(token) or ())
+        return math.log((total + 1) / (df + 0.5))
+
+    def _posting_array(self, token):
+        array = self._arrays.get(token)
+        if array is None:
+            array = self._arrays[token] = np.asarray(self.postings[token], dtype=np.int64)
+        return array
+
+    def search(self, query_tokens, phrase, limit, min_score=0.08):
+        """(top verses with "score", number of verses scoring >= min_score)."""
+        with self._lock:
+            self.queries += 1
+            total = len(self.docs)
+            tokens = list(dict.fromkeys(t for t in query_tokens if t))
+            if not total or not tokens:
+                return [], 0
+            weights = {t: self._idf(t, total) for t in tokens}
+            weight_sum = sum(weights.values())
+            present = [t for t in tokens if t in self.postings]
+            if not present:
+                return [], 0
+            if np is not None:
+                arrays = [self._posting_array(t) for t in present]
+                doc_index = np.concatenate(arrays)
+                doc_weight = np.repeat(
+                    np.asarray([weights[t] for t in present], dtype=np.float64),
+                    [len(a) for a in arrays]
+                )
+                candidates, inverse = np.unique(doc_index, return_inverse=True)
+                overlap = np.bincount(inverse, weights=doc_weight) * ((1.0 - self.PHRASE_BONUS) / weight_sum)
+                pool = min(len(candidates), max(self.RERANK_POOL, limit * 5))
+                top = np.argpartition(-overlap, pool - 1)[:pool] if pool < len(candidates) else np.arange(len(candidates))
+                ranked = [(float(overlap[i]), int(candidates[i])) for i in top]
+                above = int(np.count_nonzero(overlap >= min_score))
+            else:
+                accumulated = {}
+                for token in present:
+                    weight = weights[token]
+                    for index in self.postings[token]:
+                        accumulated[index] = accumulated.get(index, 0.0) + weight
+                scale = (1.0 - self.PHRASE_BONUS) / weight_sum
+                ranked = sorted(((w * scale, i) for i, w in accumulated.items()), reverse=True)
+                ranked = ranked[:max(self.RERANK_POOL, limit * 5)]
+                above = sum(1 for w in accumulated.values() if w * scale >= min_score)
+            results = []
+            for score, index in ranked:
+                if phrase and phrase in self.texts[index]:
+                    score += self.PHRASE_BONUS
+                if score >= min_score:
+                    results.append((round(score, 6), index))
+            results.sort(key=lambda item: (item[0], item[1]), reverse=True)
+            verses = []
+            for score, index in results[:limit]:
+                verse = dict(self.docs[index])
+                verse["score"] = score
+                verses.append(verse)
+            return verses, above
+
+    def stats(self):
+        with self._lock:
+            return {
+                "verses": len(self.docs),
+                "tokens": len(self.postings),
+                "max_id": self.max_id,
+                "numpy": np is not None,
+                "queries": self.queries,
+                "built_at": self.built_at
+            }
+
+class RecommendationPool:
+    """Candidate pools for generate_smart_recommendation(), kept in memory.
+
+    Verse ids are held per book in compact arrays, and each recommended-to user has a
+    bitset of the verse ids they already liked or saved (their preferred books fall
+    out of the same ids). A pick chooses a book weighted by size and a random slot in
+    it, rejecting seen or excluded ids, so a draw costs O(1) expected regardless of
+    corpus size; only users who have seen nearly everything fall back to a scan.
+
+    Like VerseSearchIndex, new rows are added as they are stored, everything above
+    max_id is pulled every RECOMMEND_POOL_REFRESH_SECONDS and the pools are rebuilt
+    every RECOMMEND_POOL_REBUILD_SECONDS to drop deleted rows. User bitsets live for
+    RECOMMEND_USER_TTL_SECONDS and are dropped on like/save changes in this process.
+    """
+
+    MAX_REJECTIONS = 64
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._users = OrderedDict()  # user_id -> (loaded_at, seen bitset, preferred book slots, seed ids)
+        self._reset()
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+        self.draws = 0
+        self.rejections = 0
+        self.scans = 0
+
+    def _reset(self):
+        self.books = []  # slot -> book name
+        self.book_slots = {}  # book name -> slot
+        self.pools = []  # slot -> array of verse ids
+        self.book_of = array('H')  # verse id -> slot + 1 (0 = unknown/deleted)
+        self.max_id = 0
+
+    def _add_locked(self, verse_id, book):
+        verse_id = int(verse_id)
+        if verse_id < len(self.book_of) and self.book_of[verse_id]:
+            return
+        book = book or ''
+        slot = self.book_slots.get(book)
+        if slot is None:
+            slot = self.book_slots[book] = len(self.books)
+            self.books.append(book)
+            self.pools.append(array('q'))
+        if verse_id >= len(self.book_of):
+            self.book_of.extend([0] * (verse_id + 1 - len(self.book_of)))
+        self.book_of[verse_id] = slot + 1
+        self.pools[slot].append(verse_id)
+        self.max_id = max(self.max_id, verse_id)
+
+    def add(self, verse_id, book):
+        if verse_id is None:
+            return
+        with self._lock:
+            self._add_locked(verse_id, book)
+
+    def _load_rows(self, after_id):
+        conn, db_type = get_db()
+        try:
+            c = get_cursor(conn, db_type)
+            placeholder = '%s' if db_type == 'postgres' else '?'
+            c.execute(f"SELECT id, book FROM verses WHERE id > {placeholder} ORDER BY id", (after_id,))
+            rows = []
+            while True:
+                chunk = c.fetchmany(5000)
+                if not chunk:
+                    break
+                rows.extend((row_pick(chunk_row, 'id', 0), row_pick(chunk_row, 'book', 1)) for chunk_row in chunk)
+            return rows
+        finally:
+            conn.close()
+
+    def ensure_fresh(self):
+        """Build on first use, rebuild periodically, otherwise pull rows newer than max_id."""
+        if not self._refresh_lock.acquire(blocking=not self.built_at):
+            return
+        try:
+            now = time.time()
+            if now - self.built_at >= RECOMMEND_POOL_REBUILD_SECONDS:
+                rows = self._load_rows(0)
+                with self._lock:
+                    self._reset()
+                    for verse_id, book in rows:
+                        self._add_locked(verse_id, book)
+                    self._users.clear()
+                    self.built_at = self.refreshed_at = now
+                logger.info(f"Recommendation pools built: {len(rows)} verses in {len(self.books)} books")
+            elif now - self.refreshed_at >= RECOMMEND_POOL_REFRESH_SECONDS:
+                self.refreshed_at = now
+                rows = self._load_rows(self.max_id)
+                with self._lock:
+                    for verse_id, book in rows:
+                        self._add_locked(verse_id, book)
+        finally:
+            self._refresh_lock.release()
+
+    def forget_user(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _load_user(self, user_id):
+        conn, db_type = get_db()
+        try:
+            c = get_cursor(conn, db_type)
+            placeholder = '%s' if db_type == 'postgres' else '?'
+            c.execute(f"""
+                SELECT verse_id, timestamp FROM likes WHERE user_id = {placeholder}
+                UNION ALL
+                SELECT verse_id, timestamp FROM saves WHERE user_id = {placeholder}
+                ORDER BY timestamp DESC
+            """, (user_id, user_id))
+            ids = [row_pick(row, 'verse_id', 0) for row in c.fetchall()]
+            return list(dict.fromkeys(int(verse_id) for verse_id in ids if verse_id is not None))
+        finally:
+            conn.close()
+
+    def _user_state(self, user_id):
+        with self._lock:
+            state = self._users.get(user_id)
+            if state and time.time() - state[0] < RECOMMEND_USER_TTL_SECONDS:
+                self._users.move_to_end(user_id)
+                return state
+        seen_ids = self._load_user(user_id)
+        with self._lock:
+            seen = bytearray((max(seen_ids, default=0) >> 3) + 1)
+            preferred = set()
+            for verse_id in seen_ids:
+                seen[verse_id >> 3] |= 1 << (verse_id & 7)
+                if verse_id < len(self.book_of) and self.book_of[verse_id]:
+                    preferred.add(self.book_of[verse_id] - 1)
+            # Most recent first: the seeds for "liked together" neighbours.
+            state = (time.time(), seen, sorted(preferred), seen_ids[:RECOMMEND_CF_SEEDS])
+            self._users[user_id] = state
+            self._users.move_to_end(user_id)
+            while len(self._users) > RECOMMEND_USER_CACHE_SIZE:
+                self._users.popitem(last=False)
+            return state
+
+    @staticmethod
+    def _is_seen(seen, verse_id):
+        index = verse_id >> 3
+        return index < len(seen) and bool(seen[index] & (1 << (verse_id & 7)))
+
+    def _draw_locked(self, slots, count, seen, skip):
+        weights = [len(self.pools[slot]) for slot in slots]
+        total = sum(weights)
+        if not total:
+            return []
+        cumulative = []
+        running = 0
+        for weight in weights:
+            running += weight
+            cumulative.append(running)
+        picked = []
+        misses = 0
+        while len(picked) < count and misses < self.MAX_REJECTIONS * count:
+            self.draws += 1
+            position = random.randrange(total)
+            slot_index = bisect.bisect_right(cumulative, position)
+            pool = self.pools[slots[slot_index]]
+            verse_id = pool[position - (cumulative[slot_index] - len(pool))]
+            if verse_id in skip or self._is_seen(seen, verse_id):
+                misses += 1
+                self.rejections += 1
+                continue
+            skip.add(verse_id)
+            picked.append(verse_id)
+        if len(picked) < count:
+            # Rejection kept failing: almost everything here is seen, so enumerate what is left.
+            self.scans += 1
+            remaining = [v for slot in slots for v in self.pools[slot] if v not in skip and not self._is_seen(seen, v)]
+            extra = random.sample(remaining, min(count - len(picked), len(remaining)))
+            skip.update(extra)
+            picked.extend(extra)
+        return picked
+
+    def _neighbor_picks(self, seeds, count, seen, skip):
+        """Up to count (verse_id, because_id) from the CF neighbour lists, score-weighted."""
+        candidates = [
+            (verse_id, score, because)
+            for verse_id, score, because in _VERSE_NEIGHBORS.recommend(seeds, k=max(50, count * 5))
+            if verse_id not in skip and not self._is_seen(seen, verse_id)
+        ]
+        # Weighted sampling without replacement (key = u ** (1 / score)) keeps repeat calls varied.
+        candidates.sort(key=lambda item: random.random() ** (1.0 / max(item[1], 1e-6)), reverse=True)
+        picks = [(verse_id, because) for verse_id, _, because in candidates[:count]]
+        skip.update(verse_id for verse_id, _ in picks)
+        return picks
+
+    def sample(self, user_id, count, exclude_ids=()):
+        """Up to count unseen verses as (verse_id, from_preferred_book, because_id).
+
+        Each slot goes to the CF neighbours of the user's recent likes/saves with
+        probability RECOMMEND_CF_SHARE (because_id names the seed verse), the rest
+        to the book pools.
+        """
+        self.ensure_fresh()
+        _, seen, preferred, seeds = self._user_state(user_id)
+        skip = set(exclude_ids or ())
+        picks = []
+        if seeds and _VERSE_NEIGHBORS is not None:
+            wanted = sum(1 for _ in range(count) if random.random() < RECOMMEND_CF_SHARE)
+            if wanted:
+                picks = [(verse_id, False, because) for verse_id, because in self._neighbor_picks(seeds, wanted, seen, skip)]
+        with self._lock:
+            if preferred and len(picks) < count:
+                picks.extend((verse_id, True, None) for verse_id in self._draw_locked(preferred, count - len(picks), seen, skip))
+            if len(picks) < count:
+                preferred_slots = set(preferred)
+                others = [slot for slot in range(len(self.books)) if slot not in preferred_slots]
+                picks.extend((verse_id, False, None) for verse_id in self._draw_locked(others, count - len(picks), seen, skip))
+        return picks
+
+    def stats(self):
+        with self._lock:
+            return {
+                "verses": sum(len(pool) for pool in self.pools),
+                "books": len(self.books),
+                "max_id": self.max_id,
+                "cached_users": len(self._users),
+                "draws": self.draws,
+                "rejections": self.rejections,
+                "scans": self.scans,
+                "built_at": self.built_at
+            }
+
+_SEMANTIC_INDEX = VerseSearchIndex()
+_RECOMMENDER = RecommendationPool()
+_VECTOR_INDEX = VectorIndex(VECTOR_INDEX_DIR) if VectorIndex is not None else None
+_VERSE_NEIGHBORS = VerseNeighbors(VERSE_NEIGHBORS_DIR, top_n=VERSE_NEIGHBORS_TOP_N) if VerseNeighbors is not None else None
+_BATCH_JOB = None
+_BATCH_JOB_PID = None
+_BATCH_JOB_LOCK = threading.Lock()
+
+def run_vector_index_job():
+    """Embed verses added since the last build; retrain when the corpus has grown enough."""
+    if _VECTOR_INDEX is None:
+        return 0
+    _VECTOR_INDEX.maybe_reload(force=True)
+    meta = _VECTOR_INDEX.meta or {}
+    conn, db_type = get_db()
+    try:
+        c = get_cursor(conn, db_type)
+        placeholder = '%s' if db_type == 'postgres' else '?'
+        c.execute(f"SELECT id, reference, text, book FROM verses WHERE id > {placeholder} ORDER BY id", (meta.get("max_id", 0),))
+        docs = []
+        for row in c.fetchall():
+            docs.append((
+                int(row_pick(row, 'id', 0)),
+                f"{row_pick(row, 'text', 2) or ''} {row_pick(row, 'book', 3) or ''}"
+            ))
+        if not docs:
+            return 0
+        if not meta or meta.get("count", 0) + len(docs) > meta.get("trained_count", 0) * (1 + VECTOR_INDEX_RETRAIN_GROWTH):
+            c.execute("SELECT id, reference, text, book FROM verses ORDER BY id")
+            docs = [
+                (int(row_pick(row, 'id', 0)), f"{row_pick(row, 'text', 2) or ''} {row_pick(row, 'book', 3) or ''}")
+                for row in c.fetchall()
+            ]
+            return _VECTOR_INDEX.train(docs)
+        return _VECTOR_INDEX.append(docs)
+    finally:
+        conn.close()
+
+# (source table, weight, extra filter): one user-verse interaction per row, read by id.
+_VERSE_NEIGHBOR_SOURCES = (
+    ("likes", 1.0, ""),
+    ("saves", 1.5, ""),
+    ("verse_highlights", 1.5, ""),
+    # Past likes/saves that were later undone still say something about taste.
+    ("daily_actions", 0.5, "AND action IN ('like', 'save')"),
+)
+
+def run_verse_neighbor_job():
+    """Fold interactions newer than the model's cursors into it; retrain from scratch periodically."""
+    if _VERSE_NEIGHBORS is None:
+        return 0
+    _VERSE_NEIGHBORS.maybe_reload(force=True)
+    meta = _VERSE_NEIGHBORS.meta or {}
+    retrain = not meta or time.time() - meta.get("trained_at", 0) >= VERSE_NEIGHBORS_RETRAIN_SECONDS
+    cursors = {} if retrain else dict(meta.get("cursors") or {})
+    conn, db_type = get_db()
+    try:
+        c = get_cursor(conn, db_type)
+        placeholder = '%s' if db_type == 'postgres' else '?'
+        interactions = []
+        for table, weight, extra in _VERSE_NEIGHBOR_SOURCES:
+            c.execute(f"""
+                SELECT id, user_id, verse_id FROM {table}
+                WHERE id > {placeholder} AND verse_id IS NOT NULL {extra}
+                ORDER BY id
+            """, (int(cursors.get(table, 0)),))
+            for row in c.fetchall():
+                interactions.append((row_pick(row, 'user_id', 1), row_pick(row, 'verse_id', 2), weight))
+                cursors[table] = max(int(cursors.get(table, 0)), int(row_pick(row, 'id', 0)))
+    finally:
+        conn.close()
+    if retrain:
+        return _VERSE_NEIGHBORS.train(interactions, cursors)
+    if not interactions:
+        return 0
+    return _VERSE_NEIGHBORS.update(interactions, cursors)
+
+# (job, period) pairs run by the leader's batch thread.
+_BATCH_JOBS = (
+    (run_vector_index_job, VECTOR_INDEX_JOB_SECONDS),
+    (run_verse_neighbor_job, VERSE_NEIGHBORS_JOB_SECONDS),
+)
+
+def _batch_jobs_loop():
+    next_run = {}
+    while True:
+        time.sleep(5)
+        # One process per host does the batch work; the others reload what it publishes.
+        if not generator.is_leader:
+            continue
+        for job, period in _BATCH_JOBS:
+            if time.time() < next_run.get(job, 0.0):
+                continue
+            next_run[job] = time.time() + period
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"Batch job {job.__name__} failed: {e}")
+
+def _ensure_batch_jobs():
+    global _BATCH_JOB, _BATCH_JOB_PID
+    if np is None:
+        return
+    pid = os.getpid()
+    if _BATCH_JOB is not None and _BATCH_JOB.is_alive() and _BATCH_JOB_PID == pid:
+        return
+    with _BATCH_JOB_LOCK:
+        if _BATCH_JOB is not None and _BATCH_JOB.is_alive() and _BATCH_JOB_PID == pid:
+            return
+        _BATCH_JOB = threading.Thread(target=_batch_jobs_loop, name="batch-jobs")
+        _BATCH_JOB.daemon = True
+        _BATCH_JOB_PID = pid
+        _BATCH_JOB.start()
 
 def ensure_research_feature_tables(c, db_type):
     if _is_schema_ready_with_table(c, db_type, "research_features", "reading_plans"):
@@ -1425,15 +2877,6 @@ def ensure_research_feature_tables(c, db_type):
     ensure_performance_indexes(c, db_type)
     _mark_schema_ready(db_type, "research_features")
 
-def _parse_reference_chapter(reference):
-    ref = str(reference or "")
-    match = re.search(r"\s(\d+)(?:\s*:\s*(\d+))?", ref)
-    if not match:
-        return (10**9, 10**9)
-    chapter = int(match.group(1))
-    verse_num = int(match.group(2)) if match.group(2) else 0
-    return (chapter, verse_num)
-
 def _normalize_mem_text(text):
     return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9\s]", "", str(text or "").lower())).strip()
 
@@ -1469,39 +2912,6 @@ def _compute_text_similarity(a, b):
             hits += 1
     return max(0.0, min(1.0, hits / max(1, len(a_tokens))))
 
-def _dedupe_verses_in_db(c, db_type):
-    if db_type == 'postgres':
-        c.execute("""
-            WITH ranked AS (
-                SELECT id,
-                       ROW_NUMBER() OVER (
-                           PARTITION BY LOWER(TRIM(COALESCE(reference, ''))), LOWER(TRIM(COALESCE(text, '')))
-                           ORDER BY id ASC
-                       ) AS rn
-                FROM verses
-            )
-            DELETE FROM verses v
-            USING ranked r
-            WHERE v.id = r.id AND r.rn > 1
-        """)
-        deleted = c.rowcount if c.rowcount and c.rowcount > 0 else 0
-        return deleted
-    c.execute("""
-        DELETE FROM verses
-        WHERE id IN (
-            SELECT id FROM (
-                SELECT id,
-                       ROW_NUMBER() OVER (
-                           PARTITION BY LOWER(TRIM(IFNULL(reference, ''))), LOWER(TRIM(IFNULL(text, '')))
-                           ORDER BY id ASC
-                       ) AS rn
-                FROM verses
-            ) t
-            WHERE t.rn > 1
-        )
-    """)
-    return c.rowcount if c.rowcount and c.rowcount > 0 else 0
-
 def _remove_orphan_verse_refs(c, db_type):
     if db_type == 'postgres':
         c.execute("SELECT COUNT(*) AS count FROM likes l LEFT JOIN verses v ON l.verse_id = v.id WHERE v.id IS NULL")
@@ -1534,46 +2944,298 @@ def get_public_url():
     except Exception:
         return PUBLIC_URL.rstrip('/')
 
+class DBPoolTimeout(RuntimeError):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+
+class _PooledConnection:
+    """Connection proxy handed out by get_db(); close() returns it to the pool."""
+
+    def __init__(self, pool, raw, record):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_record', record)
+
+    def _checked_raw(self):
+        raw = self._raw
+        if raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return raw
+
+    def __getattr__(self, name):
+        return getattr(self._checked_raw(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._checked_raw(), name, value)
+
+    def close(self):
+        raw = self._raw
+        if raw is None:
+            return
+        object.__setattr__(self, '_raw', None)
+        self._pool.release(raw, self._record)
+
+    def __del__(self):
+        # Handlers that forget conn.close() on an error path must not starve the pool.
+        try:
+            raw = self._raw
+            if raw is not None:
+                object.__setattr__(self, '_raw', None)
+                self._pool.release(raw, self._record, leaked=True)
+        except Exception:
+            pass
+
+
+class DatabasePool:
+    """Bounded, thread-safe connection pool; one per process and db_type."""
+
+    def __init__(self, db_type, connect, max_size, timeout, max_lifetime, ping_after):
+        self.db_type = db_type
+        self.pid = os.getpid()
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self._connect = connect
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._in_use = 0
+        self._counters = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "failed_health_checks": 0,
+            "leaked": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0
+        }
+
+    def acquire(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise DBPoolTimeout(
+                f"No {self.db_type} connection available within {self.timeout:.1f}s "
+                f"(pool size {self.max_size})"
+            )
+        waited = time.monotonic() - started
+        try:
+            raw, record = self._take_healthy()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            self._counters["wait_seconds_total"] += waited
+            if waited > self._counters["wait_seconds_max"]:
+                self._counters["wait_seconds_max"] = waited
+        return _PooledConnection(self, raw, record)
+
+    def _take_healthy(self):
+        while True:
+            with self._lock:
+                # LIFO keeps the hottest connections in use and lets spare ones age out.
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                raw = self._connect()
+                now = time.monotonic()
+                with self._lock:
+                    self._counters["created"] += 1
+                return raw, {"created": now, "last_used": now}
+            raw, record = item
+            now = time.monotonic()
+            if (now - record["created"]) >= self.max_lifetime:
+                self._discard(raw, "recycled")
+                continue
+            if self.ping_after and (now - record["last_used"]) >= self.ping_after and not self._ping(raw):
+                self._discard(raw, "failed_health_checks")
+                continue
+            return raw, record
+
+    def _ping(self, raw):
+        try:
+            if self.db_type == 'postgres':
+                cur = raw.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchone()
+                cur.close()
+                raw.rollback()
+            else:
+                raw.execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, raw):
+        """Roll back anything the borrower left open; False if the connection is unusable."""
+        try:
+            if self.db_type == 'postgres':
+                if raw.closed:
+                    return False
+                import psycopg2.extensions
+                status = raw.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    return False
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+            elif raw.in_transaction:
+                raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw, reason):
+        with self._lock:
+            self._counters[reason] += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def release(self, raw, record, leaked=False):
+        try:
+            if leaked:
+                # A cursor may still reference the raw connection; let GC close it.
+                with self._lock:
+                    self._counters["leaked"] += 1
+            elif os.getpid() != self.pid:
+                pass
+            elif not self._reset(raw):
+                self._discard(raw, "failed_health_checks")
+            elif (time.monotonic() - record["created"]) >= self.max_lifetime:
+                self._discard(raw, "recycled")
+            else:
+                record["last_used"] = time.monotonic()
+                with self._lock:
+                    self._idle.append((raw, record))
+        finally:
+            with self._lock:
+                self._in_use = max(0, self._in_use - 1)
+            self._slots.release()
+
+    def close_idle(self):
+        with self._lock:
+            items = list(self._idle)
+            self._idle.clear()
+        for raw, _ in items:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            in_use = self._in_use
+            idle = len(self._idle)
+        checkouts = counters.pop("checkouts")
+        wait_total = counters.pop("wait_seconds_total")
+        wait_max = counters.pop("wait_seconds_max")
+        return {
+            "db_type": self.db_type,
+            "max_size": self.max_size,
+            "in_use": in_use,
+            "idle": idle,
+            "checkouts": checkouts,
+            "wait_ms_avg": round((wait_total / checkouts) * 1000, 3) if checkouts else 0.0,
+            "wait_ms_max": round(wait_max * 1000, 3),
+            "wait_ms_total": round(wait_total * 1000, 3),
+            **counters
+        }
+
+
+_DB_POOLS = {}
+_DB_POOLS_LOCK = threading.Lock()
+
+def _connect_sqlite():
+    # Pooled connections hop between request threads, one borrower at a time.
+    conn = sqlite3.connect(SQLITE_PATH, timeout=20, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    _tune_sqlite_connection(conn)
+    return conn
+
+def _connect_postgres():
+    import psycopg2
+    import psycopg2.extras
+    return psycopg2.connect(DATABASE_URL, sslmode='require')
+
+def _get_db_pool(db_type):
+    pid = os.getpid()
+    with _DB_POOLS_LOCK:
+        pool = _DB_POOLS.get(db_type)
+        if pool is None or pool.pid != pid:
+            # Fresh pool after a gunicorn fork; inherited sockets are never reused.
+            pool = DatabasePool(
+                db_type,
+                _connect_postgres if db_type == 'postgres' else _connect_sqlite,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                ping_after=DB_POOL_PING_AFTER
+            )
+            _DB_POOLS[db_type] = pool
+        return pool
+
+def _open_db_connection(db_type):
+    if not DB_POOL_ENABLED:
+        return _connect_postgres() if db_type == 'postgres' else _connect_sqlite()
+    return _get_db_pool(db_type).acquire()
+
+def get_db_pool_stats():
+    """Pool counters for the db_status pages (in use, idle, wait time, recycling)."""
+    pid = os.getpid()
+    with _DB_POOLS_LOCK:
+        pools = [p for p in _DB_POOLS.values() if p.pid == pid]
+    return {
+        "enabled": DB_POOL_ENABLED,
+        "pid": pid,
+        "max_size": DB_POOL_MAX_SIZE,
+        "timeout_seconds": DB_POOL_TIMEOUT,
+        "max_lifetime_seconds": DB_POOL_MAX_LIFETIME,
+        "pools": {p.db_type: p.stats() for p in pools}
+    }
+
 def get_db():
     """Get database connection - PostgreSQL for Render, SQLite for local"""
     global POSTGRES_AVAILABLE
     if FORCE_SQLITE:
-        conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-        conn.row_factory = sqlite3.Row
-        _tune_sqlite_connection(conn)
-        return conn, 'sqlite'
+        return _open_db_connection('sqlite'), 'sqlite'
     if FORCE_POSTGRES and not IS_POSTGRES:
         raise RuntimeError("DB_MODE=postgres but DATABASE_URL is not set to a postgres URL")
     if IS_POSTGRES and POSTGRES_AVAILABLE:
         try:
-            import psycopg2
-            import psycopg2.extras
-            conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-            return conn, 'postgres'
+            return _open_db_connection('postgres'), 'postgres'
         except ImportError:
             if STRICT_DB or RENDER_ENV:
                 logger.error("psycopg2 not installed and strict DB mode enabled")
                 raise
             logger.warning("psycopg2 not installed, falling back to SQLite")
-            conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-            conn.row_factory = sqlite3.Row
-            _tune_sqlite_connection(conn)
-            return conn, 'sqlite'
+            return _open_db_connection('sqlite'), 'sqlite'
+        except DBPoolTimeout:
+            # Saturation is not an outage; never fall back to SQLite for it.
+            raise
         except Exception as e:
             logger.error(f"PostgreSQL connection failed: {e}")
             if STRICT_DB or RENDER_ENV:
                 raise
             POSTGRES_AVAILABLE = False
             # Fallback to SQLite if Postgres fails
-            conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-            conn.row_factory = sqlite3.Row
-            _tune_sqlite_connection(conn)
-            return conn, 'sqlite'
+            return _open_db_connection('sqlite'), 'sqlite'
     else:
-        conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-        conn.row_factory = sqlite3.Row
-        _tune_sqlite_connection(conn)
-        return conn, 'sqlite'
+        return _open_db_connection('sqlite'), 'sqlite'
+
+@contextmanager
+def db_connection():
+    """Borrow a connection for a block: `with db_connection() as (conn, db_type): ...`"""
+    conn, db_type = get_db()
+    try:
+        yield conn, db_type
+    finally:
+        conn.close()
 
 def get_cursor(conn, db_type):
     """Get cursor with dict access"""
@@ -1642,6 +3304,8 @@ def parse_duration_to_seconds(duration_value, default_seconds=3600):
 
 def ensure_active_boosts_schema(c, db_type):
     """Backfill missing columns for legacy user_active_boosts schemas."""
+    if SCHEMA_BOOTSTRAPPED:
+        return
     try:
         if db_type == 'postgres':
             c.execute("ALTER TABLE user_active_boosts ADD COLUMN IF NOT EXISTS item_id TEXT")
@@ -1772,40 +3436,797 @@ def _table_columns(conn, db_type, table):
     c.execute(f"PRAGMA table_info({table})")
     return [r[1] for r in c.fetchall()]
 
+def ensure_system_settings_table(c, db_type):
+    if _is_schema_ready_with_table(c, db_type, "system_settings", "system_settings"):
+        return
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS system_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _mark_schema_ready(db_type, "system_settings")
+
+def ensure_presence_table(c, db_type):
+    if _is_schema_ready_with_table(c, db_type, "presence", "user_presence"):
+        return
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_presence (
+            user_id INTEGER PRIMARY KEY,
+            last_seen TEXT,
+            last_path TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _mark_schema_ready(db_type, "presence")
+
+def ensure_realtime_events_table(c, db_type):
+    """Shared realtime event log; SQLite deployments keep it in the shared cache file instead."""
+    if db_type != 'postgres':
+        return
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS realtime_events (
+            id BIGSERIAL PRIMARY KEY,
+            target TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_realtime_events_created ON realtime_events(created_at)")
+
+def ensure_generator_state_table(c, db_type):
+    """Single-row table holding the leader generator's current verse and deadline."""
+    if db_type == 'postgres':
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS generator_state (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT,
+                verse TEXT,
+                next_fetch_at DOUBLE PRECISION,
+                interval_seconds INTEGER,
+                total_verses INTEGER DEFAULT 0,
+                leader TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    else:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS generator_state (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT,
+                verse TEXT,
+                next_fetch_at REAL,
+                interval_seconds INTEGER,
+                total_verses INTEGER DEFAULT 0,
+                leader TEXT,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+def ensure_presence_seen_ts(conn, c, db_type):
+    """Add the numeric last_seen_ts column (epoch seconds), backfill it and index it."""
+    ensure_presence_table(c, db_type)
+    if 'last_seen_ts' not in _table_columns(conn, db_type, 'user_presence'):
+        if db_type == 'postgres':
+            c.execute("ALTER TABLE user_presence ADD COLUMN last_seen_ts DOUBLE PRECISION")
+        else:
+            c.execute("ALTER TABLE user_presence ADD COLUMN last_seen_ts REAL")
+    while True:
+        c.execute("SELECT user_id, last_seen FROM user_presence WHERE last_seen_ts IS NULL LIMIT 500")
+        rows = c.fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            try:
+                seen_ts = datetime.fromisoformat(str(row_pick(row, 'last_seen', 1))).timestamp()
+            except Exception:
+                seen_ts = 0.0
+            updates.append((seen_ts, row_pick(row, 'user_id', 0)))
+        if db_type == 'postgres':
+            c.executemany("UPDATE user_presence SET last_seen_ts = %s WHERE user_id = %s", updates)
+        else:
+            c.executemany("UPDATE user_presence SET last_seen_ts = ? WHERE user_id = ?", updates)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_presence_seen_ts ON user_presence(last_seen_ts)")
+
+def ensure_verse_search_index(conn, c, db_type):
+    """Full-text index over verses: FTS5 on SQLite, a generated tsvector + GIN on Postgres.
+
+    Both stay in sync with verses by themselves (triggers / generated column), so
+    inserts, edits and dedupe deletes need no extra code. reference and book carry
+    more weight than text so "john" ranks John's verses above verses mentioning John.
+    """
+    if db_type == 'postgres':
+        c.execute("""
+            ALTER TABLE verses ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', COALESCE(reference, '') || ' ' || COALESCE(book, '')), 'A') ||
+                setweight(to_tsvector('english', COALESCE(text, '')), 'B')
+            ) STORED
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_verses_search_tsv ON verses USING GIN (search_tsv)")
+        return
+    try:
+        c.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS verses_fts USING fts5(
+                reference, text, book,
+                content='verses', content_rowid='id',
+                tokenize='porter unicode61', prefix='2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: searches keep using the LIKE fallback.
+        logger.warning(f"Verse full-text index unavailable: {e}")
+        return
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS verses_fts_ai AFTER INSERT ON verses BEGIN
+            INSERT INTO verses_fts (rowid, reference, text, book) VALUES (new.id, new.reference, new.text, new.book);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS verses_fts_ad AFTER DELETE ON verses BEGIN
+            INSERT INTO verses_fts (verses_fts, rowid, reference, text, book) VALUES ('delete', old.id, old.reference, old.text, old.book);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS verses_fts_au AFTER UPDATE OF reference, text, book ON verses BEGIN
+            INSERT INTO verses_fts (verses_fts, rowid, reference, text, book) VALUES ('delete', old.id, old.reference, old.text, old.book);
+            INSERT INTO verses_fts (rowid, reference, text, book) VALUES (new.id, new.reference, new.text, new.book);
+        END
+    """)
+    c.execute("INSERT INTO verses_fts (verses_fts) VALUES ('rebuild')")
+
+def verse_content_hash(reference, text):
+    """Dedupe key for a verse row: same reference and same words (ignoring case,
+    spacing and punctuation) hash the same."""
+    ref_key = ' '.join(re.findall(r"[a-z0-9]+", str(reference or '').lower()))
+    return hashlib.sha256(f"{ref_key}\n{_normalize_mem_text(text)}".encode('utf-8')).hexdigest()
+
+# Tables whose verse_id follows a duplicate onto the row it is merged into, with the
+# columns that are UNIQUE together with verse_id (empty when there is no such constraint).
+_VERSE_REF_TABLES = (
+    ("likes", ("user_id",)),
+    ("saves", ("user_id",)),
+    ("verse_collections", ("collection_id",)),
+    ("verse_highlights", ("user_id",)),
+    ("memorization_scores", ("user_id",)),
+    ("verse_memorized", ("user_id",)),
+    ("daily_actions", ("user_id", "action", "event_date")),
+    ("bible_study_notes", ()),
+    ("comments", ()),
+)
+
+def _merge_duplicate_verse(c, db_type, duplicate_id, keep_id):
+    ph = '%s' if db_type == 'postgres' else '?'
+    for table, owner in _VERSE_REF_TABLES:
+        if owner:
+            same_owner = " AND ".join(f"o.{column} = {table}.{column}" for column in owner)
+            c.execute(f"""
+                UPDATE {table} SET verse_id = {ph}
+                WHERE verse_id = {ph}
+                  AND NOT EXISTS (SELECT 1 FROM {table} o WHERE o.verse_id = {ph} AND {same_owner})
+            """, (keep_id, duplicate_id, keep_id))
+            c.execute(f"DELETE FROM {table} WHERE verse_id = {ph}", (duplicate_id,))
+        else:
+            c.execute(f"UPDATE {table} SET verse_id = {ph} WHERE verse_id = {ph}", (keep_id, duplicate_id))
+    c.execute(f"DELETE FROM verses WHERE id = {ph}", (duplicate_id,))
+
+def insert_verse_row(c, db_type, reference, text, translation, source, timestamp, book):
+    """Insert a verse unless one with the same content_hash exists; returns the row id either way."""
+    digest = verse_content_hash(reference, text)
+    values = (reference, text, translation, source, timestamp, book, digest,
+              _normalize_bible_book_name(reference)) + verse_canonical_parts(reference, book)
+    if db_type == 'postgres':
+        c.execute("""
+            INSERT INTO verses (reference, text, translation, source, timestamp, book, content_hash,
+                                ref_key, book_key, book_ord, chapter_num, verse_num)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (content_hash) DO NOTHING
+            RETURNING id
+        """, values)
+        row = c.fetchone()
+        if row:
+            return row_pick(row, 'id', 0)
+        c.execute("SELECT id FROM verses WHERE content_hash = %s", (digest,))
+    else:
+        c.execute("""
+            INSERT INTO verses (reference, text, translation, source, timestamp, book, content_hash,
+                                ref_key, book_key, book_ord, chapter_num, verse_num)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (content_hash) DO NOTHING
+        """, values)
+        if c.rowcount == 1:
+            return c.lastrowid
+        c.execute("SELECT id FROM verses WHERE content_hash = ?", (digest,))
+    row = c.fetchone()
+    return row_pick(row, 'id', 0) if row else None
+
+def backfill_verse_content_hashes(conn, c, db_type):
+    """Hash verses that have no content_hash yet, oldest first, in committed chunks.
+
+    A row whose hash already belongs to an older verse is merged into it (every
+    table in _VERSE_REF_TABLES moves over) and deleted. Returns the number of
+    duplicates removed.
+    """
+    ph = '%s' if db_type == 'postgres' else '?'
+    removed = 0
+    last_id = 0
+    while True:
+        c.execute(f"""
+            SELECT id, reference, text FROM verses
+            WHERE content_hash IS NULL AND id > {ph}
+            ORDER BY id LIMIT {ph}
+        """, (last_id, VERSE_HASH_BACKFILL_CHUNK))
+        rows = c.fetchall()
+        if not rows:
+            break
+        hashed = [(row_pick(row, 'id', 0), verse_content_hash(row_pick(row, 'reference', 1), row_pick(row, 'text', 2)))
+                  for row in rows]
+        last_id = hashed[-1][0]
+        digests = sorted({digest for _, digest in hashed})
+        c.execute(
+            f"SELECT id, content_hash FROM verses WHERE content_hash IN ({', '.join([ph] * len(digests))})",
+            digests
+        )
+        owners = {row_pick(row, 'content_hash', 1): row_pick(row, 'id', 0) for row in c.fetchall()}
+        for verse_id, digest in hashed:
+            keep_id = owners.get(digest)
+            if keep_id is not None and keep_id != verse_id:
+                _merge_duplicate_verse(c, db_type, verse_id, keep_id)
+                removed += 1
+                continue
+            c.execute(f"UPDATE verses SET content_hash = {ph} WHERE id = {ph}", (digest, verse_id))
+            owners[digest] = verse_id
+        conn.commit()
+    if removed:
+        logger.info(f"Verse content-hash backfill merged {removed} duplicate verses")
+    return removed
+
+def ensure_verse_content_hash(conn, c, db_type):
+    """content_hash column + UNIQUE index so duplicate verses are refused at insert time."""
+    if 'content_hash' not in _table_columns(conn, db_type, 'verses'):
+        c.execute("ALTER TABLE verses ADD COLUMN content_hash TEXT")
+        conn.commit()
+    # Plain index first so the backfill's per-chunk hash lookups stay cheap; the
+    # UNIQUE one can only be built once every existing duplicate is merged away.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_verses_content_hash_backfill ON verses (content_hash)")
+    backfill_verse_content_hashes(conn, c, db_type)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_verses_content_hash ON verses (content_hash)")
+    c.execute("DROP INDEX IF EXISTS idx_verses_content_hash_backfill")
+
+def ensure_verse_canonical_order(conn, c, db_type):
+    """Persisted sort/filter keys on verses: ref_key and book_key (normalized, aliases
+    resolved), book_ord from BIBLE_BOOK_ORDER, chapter_num and verse_num. Existing rows
+    are filled in committed chunks; insert_verse_row computes them for new ones."""
+    existing = _table_columns(conn, db_type, 'verses')
+    for column, column_type in (("ref_key", "TEXT"), ("book_key", "TEXT"), ("book_ord", "INTEGER"),
+                                ("chapter_num", "INTEGER"), ("verse_num", "INTEGER")):
+        if column not in existing:
+            c.execute(f"ALTER TABLE verses ADD COLUMN {column} {column_type}")
+    conn.commit()
+    ph = '%s' if db_type == 'postgres' else '?'
+    last_id = 0
+    while True:
+        c.execute(f"""
+            SELECT id, reference, book FROM verses
+            WHERE book_ord IS NULL AND id > {ph}
+            ORDER BY id LIMIT {ph}
+        """, (last_id, VERSE_HASH_BACKFILL_CHUNK))
+        rows = c.fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            reference = row_pick(row, 'reference', 1)
+            updates.append((_normalize_bible_book_name(reference),)
+                           + verse_canonical_parts(reference, row_pick(row, 'book', 2))
+                           + (row_pick(row, 'id', 0),))
+        last_id = updates[-1][-1]
+        c.executemany(f"""
+            UPDATE verses SET ref_key = {ph}, book_key = {ph}, book_ord = {ph}, chapter_num = {ph}, verse_num = {ph}
+            WHERE id = {ph}
+        """, updates)
+        conn.commit()
+    c.execute("CREATE INDEX IF NOT EXISTS idx_verses_canonical ON verses(book_ord, chapter_num, verse_num, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_verses_book_key ON verses(book_key, chapter_num)")
+
+def ensure_library_keyset_indexes(c, db_type):
+    """Index the library pages' (user_id, COALESCE(timestamp, ''), id) keyset; replaces idx_*_user_ts_id."""
+    for table, _ in _LIBRARY_SECTIONS.values():
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_cts_id ON {table}(user_id, (COALESCE(timestamp, '')), id)")
+        c.execute(f"DROP INDEX IF EXISTS idx_{table}_user_ts_id")
+
+# Library sections backed by a per-user (timestamp, id) keyset and a library_counts row.
+_LIBRARY_SECTIONS = {
+    "liked": ("likes", "liked_at"),
+    "saved": ("saves", "saved_at"),
+}
+
+def ensure_library_counts(c, db_type):
+    """library_counts(user_id, section, count) kept current by triggers on likes/saves,
+    plus (user_id, timestamp, id) indexes for the library's keyset pages."""
+    if db_type == 'postgres':
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS library_counts (
+                user_id INTEGER NOT NULL,
+                section TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, section)
+            )
+        """)
+        c.execute("""
+            CREATE OR REPLACE FUNCTION library_counts_sync() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO library_counts (user_id, section, count) VALUES (NEW.user_id, TG_ARGV[0], 1)
+                    ON CONFLICT (user_id, section) DO UPDATE SET count = library_counts.count + 1;
+                ELSE
+                    UPDATE library_counts SET count = GREATEST(count - 1, 0)
+                    WHERE user_id = OLD.user_id AND section = TG_ARGV[0];
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        for section, (table, _) in _LIBRARY_SECTIONS.items():
+            c.execute(f"DROP TRIGGER IF EXISTS {table}_library_count ON {table}")
+            c.execute(f"""
+                CREATE TRIGGER {table}_library_count AFTER INSERT OR DELETE ON {table}
+                FOR EACH ROW EXECUTE PROCEDURE library_counts_sync('{section}')
+            """)
+    else:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS library_counts (
+                user_id INTEGER NOT NULL,
+                section TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, section)
+            )
+        """)
+        for section, (table, _) in _LIBRARY_SECTIONS.items():
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_library_count_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO library_counts (user_id, section, count) VALUES (new.user_id, '{section}', 1)
+                    ON CONFLICT (user_id, section) DO UPDATE SET count = count + 1;
+                END
+            """)
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_library_count_ad AFTER DELETE ON {table} BEGIN
+                    UPDATE library_counts SET count = MAX(count - 1, 0)
+                    WHERE user_id = old.user_id AND section = '{section}';
+                END
+            """)
+    c.execute("DELETE FROM library_counts")
+    for section, (table, _) in _LIBRARY_SECTIONS.items():
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_ts_id ON {table}(user_id, timestamp, id)")
+        c.execute(f"""
+            INSERT INTO library_counts (user_id, section, count)
+            SELECT user_id, '{section}', COUNT(*) FROM {table}
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        """)
+
+_VERSE_SEARCH_READY = {}
+
+def verse_search_ready(conn, db_type):
+    """True once this database has the full-text index; cached per process."""
+    if _VERSE_SEARCH_READY.get(db_type):
+        return True
+    try:
+        if db_type == 'postgres':
+            ready = 'search_tsv' in _table_columns(conn, db_type, 'verses')
+        else:
+            row = conn.cursor().execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'verses_fts'").fetchone()
+            ready = row is not None
+    except Exception as e:
+        logger.warning(f"Verse search readiness check failed: {e}")
+        ready = False
+    _VERSE_SEARCH_READY[db_type] = ready
+    return ready
+
+def parse_verse_search(query, prefix_words=False):
+    """User query -> OR-groups of AND-ed terms.
+
+    "quoted words" are phrases, word* is a prefix, a bare OR starts a new group.
+    Each term is (kind, tokens) with kind 'word', 'prefix' or 'phrase'; with
+    prefix_words every bare word matches as a prefix.
+    """
+    groups = [[]]
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', str(query or '')):
+        if word.upper() in ('OR', '|'):
+            if groups[-1]:
+                groups.append([])
+            continue
+        tokens = re.findall(r"[a-z0-9]+", (phrase or word).lower())
+        if not tokens:
+            continue
+        if phrase or len(tokens) > 1:
+            groups[-1].append(('phrase', tokens))
+        else:
+            groups[-1].append(('prefix' if prefix_words or word.endswith('*') else 'word', tokens))
+    return [group for group in groups if group]
+
+def keyword_search_groups(keywords):
+    """One OR-group per keyword; single words match as prefixes like the old LIKE '%kw%' did."""
+    groups = []
+    for keyword in keywords:
+        tokens = re.findall(r"[a-z0-9]+", str(keyword or '').lower())
+        if len(tokens) == 1:
+            groups.append([('prefix', tokens)])
+        elif tokens:
+            groups.append([('phrase', tokens)])
+    return groups
+
+def _fts5_match(groups, title_only=False):
+    def term(kind, tokens):
+        quoted = '"' + ' '.join(tokens) + '"'
+        return quoted + '*' if kind == 'prefix' else quoted
+    expr = ' OR '.join('(' + ' AND '.join(term(k, t) for k, t in group) + ')' for group in groups)
+    return f"{{reference book}} : ({expr})" if title_only else expr
+
+def _pg_tsquery(groups, title_only=False):
+    weight = 'A' if title_only else ''
+    def lexeme(token, prefix=False):
+        suffix = (':*' if prefix else ':') + weight if (prefix or weight) else ''
+        return token + suffix
+    def term(kind, tokens):
+        if kind == 'phrase':
+            return '(' + ' <-> '.join(lexeme(t) for t in tokens) + ')'
+        return lexeme(tokens[0], prefix=(kind == 'prefix'))
+    return ' | '.join('(' + ' & '.join(term(k, t) for k, t in group) + ')' for group in groups)
+
+def verse_title_match_sql(conn, db_type, groups):
+    """(WHERE fragment on alias v, params) matching reference/book through the full-text index; None if missing."""
+    if not groups or not verse_search_ready(conn, db_type):
+        return None
+    if db_type == 'postgres':
+        return "v.search_tsv @@ to_tsquery('english', %s)", [_pg_tsquery(groups, title_only=True)]
+    return "v.id IN (SELECT rowid FROM verses_fts WHERE verses_fts MATCH ?)", [_fts5_match(groups, title_only=True)]
+
+def search_verse_ids(conn, db_type, groups, limit=100, exclude_ids=None, random_order=False):
+    """Matching verse ids, best BM25/ts_rank first (or random); None if the index is missing.
+
+    Callers fetch the columns they need with WHERE id IN (...).
+    """
+    if not groups or not verse_search_ready(conn, db_type):
+        return None
+    exclude_ids = list(exclude_ids or [])
+    c = conn.cursor()
+    if db_type == 'postgres':
+        exclude_sql = f"AND v.id NOT IN ({','.join(['%s'] * len(exclude_ids))})" if exclude_ids else ""
+        order_sql = "RANDOM()" if random_order else "ts_rank_cd(v.search_tsv, q) DESC, v.id DESC"
+        c.execute(f"""
+            SELECT v.id FROM verses v, to_tsquery('english', %s) q
+            WHERE v.search_tsv @@ q {exclude_sql}
+            ORDER BY {order_sql}
+            LIMIT %s
+        """, [_pg_tsquery(groups)] + exclude_ids + [limit])
+    else:
+        exclude_sql = f"AND rowid NOT IN ({','.join('?' for _ in exclude_ids)})" if exclude_ids else ""
+        order_sql = "RANDOM()" if random_order else "bm25(verses_fts, 5.0, 1.0, 5.0), rowid DESC"
+        c.execute(f"""
+            SELECT rowid FROM verses_fts
+            WHERE verses_fts MATCH ? {exclude_sql}
+            ORDER BY {order_sql}
+            LIMIT ?
+        """, [_fts5_match(groups)] + exclude_ids + [limit])
+    return [row[0] for row in c.fetchall()]
+
+def ensure_activity_log_tables(c, db_type):
+    if _is_schema_ready_with_table(c, db_type, "activity_logs", "user_signup_logs"):
+        return
+    if db_type == 'postgres':
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS audit_logs (
+                id SERIAL PRIMARY KEY,
+                admin_id TEXT,
+                action TEXT,
+                target_user_id INTEGER,
+                details TEXT,
+                ip_address TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS user_activity_logs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                google_id TEXT,
+                email TEXT,
+                action TEXT NOT NULL,
+                details TEXT,
+                ip_address TEXT,
+                user_agent TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS user_signup_logs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER UNIQUE NOT NULL,
+                google_id TEXT UNIQUE NOT NULL,
+                email TEXT NOT NULL,
+                name TEXT,
+                first_signup_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                signup_ip TEXT,
+                total_logins INTEGER DEFAULT 1
+            )
+        """)
+    else:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS audit_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_id TEXT,
+                action TEXT,
+                target_user_id INTEGER,
+                details TEXT,
+                ip_address TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS user_activity_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                google_id TEXT,
+                email TEXT,
+                action TEXT NOT NULL,
+                details TEXT,
+                ip_address TEXT,
+                user_agent TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS user_signup_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER UNIQUE NOT NULL,
+                google_id TEXT UNIQUE NOT NULL,
+                email TEXT NOT NULL,
+                name TEXT,
+                first_signup_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                signup_ip TEXT,
+                total_logins INTEGER DEFAULT 1
+            )
+        """)
+    _mark_schema_ready(db_type, "activity_logs")
+
+def _fetch_system_settings(known_version=None):
+    """Return (values, version); values is None when known_version is still current."""
+    conn, db_type = get_db()
+    try:
+        c = get_cursor(conn, db_type)
+        ensure_system_settings_table(c, db_type)
+        if known_version is not None:
+            if db_type == 'postgres':
+                c.execute("SELECT value FROM system_settings WHERE key = %s", (SYSTEM_SETTINGS_VERSION_KEY,))
+            else:
+                c.execute("SELECT value FROM system_settings WHERE key = ?", (SYSTEM_SETTINGS_VERSION_KEY,))
+            row = c.fetchone()
+            version = str(row_pick(row, 'value', 0, '0')) if row else '0'
+            if version == known_version:
+                return None, version
+        c.execute("SELECT key, value FROM system_settings")
+        values = {}
+        for row in c.fetchall():
+            values[str(row_pick(row, 'key', 0))] = row_pick(row, 'value', 1)
+        return values, str(values.get(SYSTEM_SETTINGS_VERSION_KEY) or '0')
+    finally:
+        conn.close()
+
+def get_system_settings_snapshot(force_refresh=False):
+    """All system_settings rows as a dict, served from memory.
+
+    The copy is revalidated at most every SYSTEM_SETTINGS_CACHE_TTL seconds by reading
+    the settings version row; the full table is only reloaded when that changed.
+    Callers must treat the returned dict as read-only.
+    """
+    now = time.monotonic()
+    with _SYSTEM_SETTINGS_CACHE_LOCK:
+        values = _SYSTEM_SETTINGS_CACHE["values"]
+        version = _SYSTEM_SETTINGS_CACHE["version"]
+        checked_at = _SYSTEM_SETTINGS_CACHE["checked_at"]
+    have_copy = values is not None and not force_refresh
+    if have_copy and (now - checked_at) < SYSTEM_SETTINGS_CACHE_TTL:
+        return values
+    # One thread revalidates; the others keep serving the copy they already have.
+    if not _SYSTEM_SETTINGS_REFRESH_LOCK.acquire(blocking=not have_copy):
+        return values
+    try:
+        fresh_values, fresh_version = _fetch_system_settings(version if have_copy else None)
+        with _SYSTEM_SETTINGS_CACHE_LOCK:
+            if fresh_values is not None:
+                _SYSTEM_SETTINGS_CACHE["values"] = fresh_values
+            _SYSTEM_SETTINGS_CACHE["version"] = fresh_version
+            _SYSTEM_SETTINGS_CACHE["checked_at"] = time.monotonic()
+            return _SYSTEM_SETTINGS_CACHE["values"]
+    except Exception as e:
+        logger.warning(f"System settings refresh failed: {e}")
+        if values is not None:
+            with _SYSTEM_SETTINGS_CACHE_LOCK:
+                _SYSTEM_SETTINGS_CACHE["checked_at"] = time.monotonic()
+            return values
+        return {}
+    finally:
+        _SYSTEM_SETTINGS_REFRESH_LOCK.release()
+
+def bump_system_settings_version(c, db_type):
+    """Record a settings change so every worker reloads on its next revalidation."""
+    token = str(time.time_ns())
+    if db_type == 'postgres':
+        c.execute("""
+            INSERT INTO system_settings (key, value, updated_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (key) DO UPDATE SET
+                value = EXCLUDED.value,
+                updated_at = EXCLUDED.updated_at
+        """, (SYSTEM_SETTINGS_VERSION_KEY, token))
+    else:
+        c.execute("""
+            INSERT INTO system_settings (key, value, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value,
+                updated_at = excluded.updated_at
+        """, (SYSTEM_SETTINGS_VERSION_KEY, token))
+
+def invalidate_system_settings_cache():
+    """Drop this worker's copy; the next read reloads the table."""
+    with _SYSTEM_SETTINGS_CACHE_LOCK:
+        _SYSTEM_SETTINGS_CACHE["values"] = None
+        _SYSTEM_SETTINGS_CACHE["version"] = None
+        _SYSTEM_SETTINGS_CACHE["checked_at"] = 0.0
+
 def read_system_setting(key, default=None):
+    val = get_system_settings_snapshot().get(key)
+    return default if val is None else val
+
+def record_presence(user_id, path=None):
+    """Note that user_id was just seen; the flusher persists it in the background."""
+    if not user_id:
+        return
+    now_ts = time.time()
+    with _PRESENCE_LOCK:
+        _PRESENCE[user_id] = (now_ts, path)
+        _PRESENCE_DIRTY.add(user_id)
+    _ensure_presence_flusher()
+
+def count_online_users(window_seconds):
+    """Users seen by any worker within the last window_seconds (as of the last flush).
+
+    Windows inside the registry's retention are answered from memory; longer ones
+    are an indexed range count on user_presence.last_seen_ts.
+    """
+    window_seconds = float(window_seconds)
+    cutoff = time.time() - window_seconds
+    if window_seconds > PRESENCE_RETENTION_SECONDS:
+        # Write unflushed sightings first so the count is one indexed query, whatever the backlog.
+        if _PRESENCE_DIRTY:
+            flush_presence()
+        conn, db_type = get_db()
+        try:
+            c = get_cursor(conn, db_type)
+            ph = '%s' if db_type == 'postgres' else '?'
+            c.execute(f"SELECT COUNT(*) FROM user_presence WHERE last_seen_ts >= {ph}", (cutoff,))
+            return int(row_pick(c.fetchone(), 'count', 0, 0) or 0)
+        finally:
+            conn.close()
+    _ensure_presence_flusher()
+    with _PRESENCE_LOCK:
+        return sum(1 for seen_ts, _ in _PRESENCE.values() if seen_ts >= cutoff)
+
+def count_online_windows(windows=None):
+    """Online counts keyed by window label, e.g. {"1m": 3, "5m": 8, "15m": 12, "24h": 40}."""
+    windows = windows or list(PRESENCE_WINDOWS)
+    return {label: count_online_users(PRESENCE_WINDOWS[label]) for label in windows}
+
+def flush_presence():
+    """Write dirty registry entries in one batched upsert and merge other workers' rows back in."""
+    with _PRESENCE_LOCK:
+        dirty = list(_PRESENCE_DIRTY)
+        _PRESENCE_DIRTY.clear()
+        batch = [(uid,) + _PRESENCE[uid] for uid in dirty if uid in _PRESENCE]
     conn = None
     try:
         conn, db_type = get_db()
         c = get_cursor(conn, db_type)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        if not SCHEMA_BOOTSTRAPPED:
+            ensure_presence_seen_ts(conn, c, db_type)
+        rows = []
+        for uid, seen_ts, path in batch:
+            seen_iso = datetime.fromtimestamp(seen_ts).isoformat()
+            rows.append((uid, seen_iso, seen_ts, path, seen_iso))
+        if rows:
+            if db_type == 'postgres':
+                c.executemany("""
+                    INSERT INTO user_presence (user_id, last_seen, last_seen_ts, last_path, updated_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        last_seen = EXCLUDED.last_seen,
+                        last_seen_ts = EXCLUDED.last_seen_ts,
+                        last_path = EXCLUDED.last_path,
+                        updated_at = EXCLUDED.updated_at
+                    WHERE user_presence.last_seen_ts IS NULL OR user_presence.last_seen_ts < EXCLUDED.last_seen_ts
+                """, rows)
+            else:
+                c.executemany("""
+                    INSERT INTO user_presence (user_id, last_seen, last_seen_ts, last_path, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        last_seen = excluded.last_seen,
+                        last_seen_ts = excluded.last_seen_ts,
+                        last_path = excluded.last_path,
+                        updated_at = excluded.updated_at
+                    WHERE user_presence.last_seen_ts IS NULL OR user_presence.last_seen_ts < excluded.last_seen_ts
+                """, rows)
+            conn.commit()
+
+        # Pull in users tracked by other workers so counts are global, not per-process.
+        retention_ts = time.time() - PRESENCE_RETENTION_SECONDS
         if db_type == 'postgres':
-            c.execute("SELECT value FROM system_settings WHERE key = %s", (key,))
+            c.execute("SELECT user_id, last_seen_ts, last_path FROM user_presence WHERE last_seen_ts >= %s", (retention_ts,))
         else:
-            c.execute("SELECT value FROM system_settings WHERE key = ?", (key,))
-        row = c.fetchone()
+            c.execute("SELECT user_id, last_seen_ts, last_path FROM user_presence WHERE last_seen_ts >= ?", (retention_ts,))
+        remote = c.fetchall()
         conn.close()
-        if not row:
-            return default
-        if hasattr(row, 'keys'):
-            try:
-                val = row['value']
-            except Exception:
-                val = None
-            return default if val is None else val
-        return row[0] if row[0] is not None else default
-    except Exception:
+        conn = None
+    except Exception as e:
+        logger.warning(f"Presence flush failed: {e}")
         if conn:
             try:
                 conn.close()
             except:
                 pass
-        return default
+        with _PRESENCE_LOCK:
+            _PRESENCE_DIRTY.update(uid for uid, _, _ in batch)
+        return 0
+
+    cutoff_ts = time.time() - PRESENCE_RETENTION_SECONDS
+    with _PRESENCE_LOCK:
+        for row in remote:
+            try:
+                uid = row_pick(row, 'user_id', 0)
+                seen_ts = float(row_pick(row, 'last_seen_ts', 1))
+            except Exception:
+                continue
+            current = _PRESENCE.get(uid)
+            if current is None or current[0] < seen_ts:
+                _PRESENCE[uid] = (seen_ts, row_pick(row, 'last_path', 2))
+        for uid in [uid for uid, (seen_ts, _) in _PRESENCE.items() if seen_ts < cutoff_ts and uid not in _PRESENCE_DIRTY]:
+            del _PRESENCE[uid]
+    return len(batch)
+
+def _presence_flusher_loop(wake):
+    while True:
+        wake.wait(PRESENCE_FLUSH_INTERVAL)
+        wake.clear()
+        flush_presence()
+
+def _ensure_presence_flusher():
+    """Start the flusher once per process (again after a fork), seeding the registry first."""
+    pid = os.getpid()
+    thread = _PRESENCE_FLUSHER["thread"]
+    if thread is not None and thread.is_alive() and _PRESENCE_FLUSHER["pid"] == pid:
+        return
+    with _PRESENCE_LOCK:
+        thread = _PRESENCE_FLUSHER["thread"]
+        if thread is not None and thread.is_alive() and _PRESENCE_FLUSHER["pid"] == pid:
+            return
+        wake = threading.Event()
+        thread = threading.Thread(target=_presence_flusher_loop, args=(wake,), name="presence-flusher")
+        thread.daemon = True
+        _PRESENCE_FLUSHER.update({"thread": thread, "pid": pid, "wake": wake})
+    flush_presence()
+    thread.start()
+    logger.info("Presence flusher started")
+
+def _flush_presence_at_exit():
+    if _PRESENCE_DIRTY:
+        flush_presence()
+
+atexit.register(_flush_presence_at_exit)
 
 def init_db():
     """Initialize database tables"""
@@ -2805,9 +5226,6 @@ def migrate_db():
     finally:
         conn.close()
 
-init_db()
-migrate_db()
-
 def get_challenge_period_key():
     now = datetime.now().astimezone()
     return now.strftime("%Y-%m-%d")
@@ -3587,6 +6005,8 @@ def get_replies_for_parent(c, db_type, parent_type, parent_id, equipped_cache=No
     replies = []
     equipped_cache = equipped_cache if isinstance(equipped_cache, dict) else {}
     hidden_user_ids = set(hidden_user_ids or ())
+    author_ids = {row_pick(row, 'user_id', 1) for row in rows} - set(equipped_cache)
+    equipped_cache.update(get_equipped_items_for_users(c, db_type, author_ids))
     for row in rows:
         try:
             reply_id = row['id']
@@ -3670,10 +6090,13 @@ def get_replies_for_parents(c, db_type, parent_type, parent_ids, equipped_cache=
               AND COALESCE(r.is_deleted, 0) = 0
             ORDER BY r.timestamp ASC
         """, tuple([parent_type, *params]))
+    rows = c.fetchall()
 
     equipped_cache = equipped_cache if isinstance(equipped_cache, dict) else {}
     hidden_user_ids = set(hidden_user_ids or ())
-    for row in c.fetchall():
+    author_ids = {row_pick(row, 'user_id', 2) for row in rows} - set(equipped_cache)
+    equipped_cache.update(get_equipped_items_for_users(c, db_type, author_ids))
+    for row in rows:
         try:
             reply_id = row['id']
             parent_id = row['parent_id']
@@ -3729,6 +6152,32 @@ def get_replies_for_parents(c, db_type, parent_type, parent_ids, equipped_cache=
 
     return replies_map
 
+def invalidate_ban_status(user_id, broadcast=True):
+    """Forget the cached ban state for user_id here and, by default, on every worker."""
+    if not user_id:
+        return
+    with _BAN_STATUS_CACHE_LOCK:
+        _BAN_STATUS_CACHE.pop(int(user_id), None)
+    if broadcast:
+        publish_cache_event("ban", {"user_id": int(user_id)})
+
+def _on_ban_changed(payload):
+    invalidate_ban_status(payload.get("user_id"), broadcast=False)
+
+def _on_cosmetics_changed(payload):
+    invalidate_user_cosmetics(payload.get("user_id"), broadcast=False)
+
+if _CACHE_BUS is not None:
+    _CACHE_BUS.subscribe("ban", _on_ban_changed)
+    _CACHE_BUS.subscribe("cosmetics", _on_cosmetics_changed)
+    _CACHE_BUS.subscribe("schema", _on_schema_flag_cleared)
+
+@app.before_request
+def ensure_cache_bus_listener():
+    # Per-process: the listener must run in every forked worker, not just the one that publishes.
+    if _CACHE_BUS is not None:
+        _CACHE_BUS.ensure_listener()
+
 def check_ban_status(user_id):
     """Check if user is currently banned. Returns (is_banned, reason, expires_at)"""
     global BAN_SCHEMA_READY
@@ -3799,6 +6248,7 @@ def check_ban_status(user_id):
                         c.execute("UPDATE users SET is_banned = 0, ban_expires_at = NULL, ban_reason = NULL WHERE id = ?", (user_id,))
                     conn.commit()
                     conn.close()
+                    invalidate_ban_status(user_id)
                     with _BAN_STATUS_CACHE_LOCK:
                         _BAN_STATUS_CACHE[int(user_id)] = {"ts": time.time(), "value": (False, None, None)}
                     return (False, None, None)
@@ -3932,6 +6382,7 @@ def auto_ban_user(user_id, reason, original_user_id=None, ip_address=None):
         
         conn.commit()
         conn.close()
+        invalidate_ban_status(user_id)
         
         # Log the auto-ban
         log_action(
@@ -3949,19 +6400,321 @@ def auto_ban_user(user_id, reason, original_user_id=None, ip_address=None):
         return False
 
 # Register admin blueprint
-from admin import admin_bp
+from admin import admin_bp, ensure_admin_schema
 app.register_blueprint(admin_bp)
 
+SCHEMA_MIGRATION_LOCK_ID = 4_201_771
+# Ordered, idempotent startup steps. Append new entries with a higher version;
+# never edit a step that has already shipped, since applied versions are skipped.
+SCHEMA_MIGRATIONS = [
+    (1, "base_tables", lambda conn, c, db_type: init_db()),
+    (2, "legacy_columns", lambda conn, c, db_type: migrate_db()),
+    (3, "system_settings", lambda conn, c, db_type: ensure_system_settings_table(c, db_type)),
+    (4, "presence", lambda conn, c, db_type: ensure_presence_table(c, db_type)),
+    (5, "activity_logs", lambda conn, c, db_type: ensure_activity_log_tables(c, db_type)),
+    (6, "active_boosts", lambda conn, c, db_type: ensure_active_boosts_schema(c, db_type)),
+    (7, "daily_challenge", lambda conn, c, db_type: ensure_daily_challenge_tables(c, db_type)),
+    (8, "achievements", lambda conn, c, db_type: ensure_achievement_tables(c, db_type)),
+    (9, "comment_social", lambda conn, c, db_type: ensure_comment_social_tables(c, db_type)),
+    (10, "direct_messages", lambda conn, c, db_type: ensure_dm_tables(c, db_type)),
+    (11, "community_pins", lambda conn, c, db_type: ensure_community_pin_table(c, db_type)),
+    (12, "user_safety", lambda conn, c, db_type: ensure_user_safety_tables(c, db_type)),
+    (13, "notifications", lambda conn, c, db_type: ensure_notification_tables(c, db_type)),
+    (14, "growth_features", lambda conn, c, db_type: ensure_growth_feature_tables(c, db_type)),
+    (15, "engagement_addons", lambda conn, c, db_type: ensure_engagement_addon_tables(c, db_type)),
+    (16, "research_features", lambda conn, c, db_type: ensure_research_feature_tables(c, db_type)),
+    (17, "admin_tables", ensure_admin_schema),
+    (18, "performance_indexes", lambda conn, c, db_type: ensure_performance_indexes(c, db_type)),
+    (19, "presence_seen_ts", ensure_presence_seen_ts),
+    (20, "realtime_events", lambda conn, c, db_type: ensure_realtime_events_table(c, db_type)),
+    (21, "generator_state", lambda conn, c, db_type: ensure_generator_state_table(c, db_type)),
+    (22, "verse_search_index", ensure_verse_search_index),
+    (23, "verse_content_hash", ensure_verse_content_hash),
+    (24, "library_counts", lambda conn, c, db_type: ensure_library_counts(c, db_type)),
+    (25, "verse_canonical_order", ensure_verse_canonical_order),
+    (26, "library_keyset_indexes", lambda conn, c, db_type: ensure_library_keyset_indexes(c, db_type)),
+]
+
+def _applied_schema_versions(c, db_type):
+    if db_type == 'postgres':
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    else:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    c.execute("SELECT version FROM schema_version")
+    return {int(row_pick(row, 'version', 0)) for row in c.fetchall()}
+
+def run_schema_migrations():
+    """Apply pending SCHEMA_MIGRATIONS once per process start.
+
+    After this succeeds every ensure_* helper and schema-ready check is a no-op, so
+    request handlers run no DDL and no catalog lookups. If it fails, the helpers keep
+    their lazy create-on-first-use behaviour.
+    """
+    global SCHEMA_BOOTSTRAPPED, BAN_SCHEMA_READY, RESTRICTION_SCHEMA_READY
+    try:
+        conn, db_type = get_db()
+    except Exception as e:
+        logger.error(f"Schema bootstrap skipped, database unavailable: {e}")
+        return False
+    c = get_cursor(conn, db_type)
+    locked = False
+    try:
+        if db_type == 'postgres':
+            # Serialize concurrent gunicorn workers; the lock is session-level.
+            c.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+            locked = True
+        applied = _applied_schema_versions(c, db_type)
+        conn.commit()
+        pending = [m for m in sorted(SCHEMA_MIGRATIONS, key=lambda m: m[0]) if m[0] not in applied]
+        for version, name, step in pending:
+            started = time.time()
+            step(conn, c, db_type)
+            if db_type == 'postgres':
+                c.execute("""
+                    INSERT INTO schema_version (version, name, applied_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (version) DO NOTHING
+                """, (version, name))
+            else:
+                c.execute("""
+                    INSERT OR IGNORE INTO schema_version (version, name, applied_at)
+                    VALUES (?, ?, ?)
+                """, (version, name, datetime.now().isoformat()))
+            conn.commit()
+            logger.info(f"Applied schema migration {version} ({name}) in {(time.time() - started) * 1000:.0f}ms")
+        SCHEMA_BOOTSTRAPPED = True
+        BAN_SCHEMA_READY = True
+        RESTRICTION_SCHEMA_READY = True
+        logger.info(f"Schema ready ({db_type}): version {max([m[0] for m in SCHEMA_MIGRATIONS])}, {len(pending)} applied now")
+        return True
+    except Exception as e:
+        logger.error(f"Schema bootstrap failed, falling back to lazy table creation: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return False
+    finally:
+        if locked:
+            try:
+                c.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+                conn.commit()
+            except Exception:
+                pass
+        conn.close()
+
+if APP_BACKGROUND_TASKS:
+    run_schema_migrations()
+
+class GeneratorLeaderLock:
+    """Cross-process leadership for BibleGenerator.
+
+    Postgres: a session-level advisory lock held on a dedicated connection, so it is
+    released as soon as the leader process or its connection dies. SQLite: an
+    exclusive flock on GENERATOR_LOCK_PATH, released by the OS when the process exits.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._fd = None
+        self._pid = None
+
+    def try_acquire(self):
+        if self.is_held():
+            return True
+        self.release()
+        if IS_POSTGRES and POSTGRES_AVAILABLE:
+            try:
+                conn = _connect_postgres()
+                conn.autocommit = True
+                c = conn.cursor()
+                c.execute("SELECT pg_try_advisory_lock(%s)", (GENERATOR_LEADER_LOCK_ID,))
+                if c.fetchone()[0]:
+                    self._conn, self._pid = conn, os.getpid()
+                    return True
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Generator leader lock unavailable: {e}")
+            return False
+        try:
+            import fcntl
+        except ImportError:
+            # No flock (Windows dev box): single process, so just lead.
+            self._pid = os.getpid()
+            return True
+        fd = None
+        try:
+            fd = os.open(GENERATOR_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())
+            self._fd, self._pid = fd, os.getpid()
+            return True
+        except OSError:
+            if fd is not None:
+                os.close(fd)
+            return False
+
+    def is_held(self):
+        if self._pid != os.getpid():
+            return False
+        if self._conn is not None:
+            try:
+                c = self._conn.cursor()
+                c.execute("SELECT 1")
+                c.fetchone()
+                return True
+            except Exception:
+                return False
+        return True
+
+    def release(self):
+        if self._pid == os.getpid():
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            if self._fd is not None:
+                try:
+                    os.close(self._fd)
+                except OSError:
+                    pass
+        self._conn = None
+        self._fd = None
+        self._pid = None
+
+class CircuitBreaker:
+    """Per-upstream breaker with rolling error rate and latency tracking.
+
+    closed -> open after VERSE_BREAKER_FAILURES consecutive failures, or when the
+    error rate over the last VERSE_BREAKER_WINDOW calls reaches
+    VERSE_BREAKER_ERROR_RATE. open -> half_open once the cooldown passes; a single
+    probe is let through and either closes the breaker or reopens it with a
+    doubled cooldown.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.cooldown = VERSE_BREAKER_COOLDOWN_SECONDS
+        self.consecutive_failures = 0
+        self.outcomes = deque(maxlen=VERSE_BREAKER_WINDOW)
+        self.latency_ms_avg = None
+        self.last_error = None
+        self.calls = 0
+        self.failures = 0
+        self.skipped = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go out now; half-open admits one probe at a time."""
+        with self._lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.cooldown:
+                    self.skipped += 1
+                    return False
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    self.skipped += 1
+                    return False
+                self._probing = True
+            return True
+
+    def retry_at(self):
+        with self._lock:
+            return self.opened_at + self.cooldown if self.state == "open" else 0.0
+
+    def record_success(self, latency_ms):
+        with self._lock:
+            self.calls += 1
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.latency_ms_avg = latency_ms if self.latency_ms_avg is None else (
+                self.latency_ms_avg * 0.8 + latency_ms * 0.2
+            )
+            if self.state != "closed":
+                logger.info(f"Verse network {self.name} recovered")
+            self.state = "closed"
+            self.cooldown = VERSE_BREAKER_COOLDOWN_SECONDS
+            self._probing = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            errors = self.outcomes.count(False)
+            tripped = (
+                self.state == "half_open"
+                or self.consecutive_failures >= VERSE_BREAKER_FAILURES
+                or (len(self.outcomes) >= 4 and errors / len(self.outcomes) >= VERSE_BREAKER_ERROR_RATE)
+            )
+            if not tripped:
+                return
+            if self.state == "half_open":
+                self.cooldown = min(self.cooldown * 2, VERSE_BREAKER_MAX_COOLDOWN_SECONDS)
+            if self.state != "open":
+                logger.warning(f"Verse network {self.name} circuit open for {int(self.cooldown)}s: {self.last_error}")
+            self.state = "open"
+            self.opened_at = time.time()
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            window = len(self.outcomes)
+            return {
+                "name": self.name,
+                "state": self.state,
+                "error_rate": round(self.outcomes.count(False) / window, 3) if window else 0.0,
+                "latency_ms_avg": round(self.latency_ms_avg, 1) if self.latency_ms_avg is not None else None,
+                "consecutive_failures": self.consecutive_failures,
+                "calls": self.calls,
+                "failures": self.failures,
+                "skipped": self.skipped,
+                "retry_in": max(0, int(math.ceil(self.opened_at + self.cooldown - time.time()))) if self.state == "open" else 0,
+                "last_error": self.last_error
+            }
+
+
 class BibleGenerator:
     def __init__(self):
         self.running = True
         self.interval = self._load_interval_from_db()
-        self.time_left = self.interval
         self.current_verse = None
         self.total_verses = 0
         self.session_id = secrets.token_hex(8)
         self.thread = None
         self.lock = threading.Lock()
+        # Notified whenever session_id changes; /api/current long-polls wait on it.
+        self.changed = threading.Condition(self.lock)
+        # Only the leader process fetches verses; followers mirror its shared state.
+        self.is_leader = False
+        self.leader_lock = GeneratorLeaderLock()
+        # Absolute wall-clock deadline for the next fetch; countdowns are derived from it.
+        self.next_fetch_at = time.time() + self.interval
+        # Set to cut the scheduler's sleep short (interval change, new shared state, shutdown).
+        self._wake = threading.Event()
+        self._last_leader_attempt = 0.0
+        self._last_leader_check = 0.0
+        self._last_state_refresh = 0.0
         
         # Fallback verses in case API fails
         self.fallback_verses = [
@@ -4019,35 +6772,29 @@ class BibleGenerator:
             {"name": "KJV Random", "url": "https://bible-api.com/?random=verse&translation=kjv"}
         ]
         self.network_idx = 0
+        self.breakers = {network["name"]: CircuitBreaker(network["name"]) for network in self.networks}
         self.session = requests.Session()
         self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
+        # Verses fetched ahead of time by the prefetcher, held in memory until fetch_verse() stores one per deadline.
+        self.buffer = deque()
+        self._buffer_cond = threading.Condition()
+        # Serializes upstream calls between the prefetcher and a cold fetch_verse().
+        self._upstream_lock = threading.Lock()
+        self.prefetch_thread = None
+
+        # Prefer the leader's verse and deadline over this process's own guess.
+        self._load_shared_state()
         
         # Start thread
-        self.start_thread()
+        if APP_BACKGROUND_TASKS:
+            self.start_thread()
     
     def _load_interval_from_db(self):
-        """Load verse interval from database, default to 60 seconds"""
+        """Load verse interval from system settings, default to 60 seconds"""
         try:
-            conn, db_type = get_db()
-            c = conn.cursor()
-            
-            # Ensure table exists
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS system_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-            
-            # Get verse_interval setting
-            c.execute("SELECT value FROM system_settings WHERE key = 'verse_interval'")
-            row = c.fetchone()
-            conn.close()
-            
-            if row:
-                interval = int(row[0])
+            value = read_system_setting('verse_interval')
+            if value is not None:
+                interval = int(value)
                 logger.info(f"Loaded verse interval from database: {interval} seconds")
                 return interval
         except Exception as e:
@@ -4062,62 +6809,322 @@ class BibleGenerator:
             self.thread.daemon = True
             self.thread.start()
             logger.info("BibleGenerator thread started")
+        if self.prefetch_thread is None or not self.prefetch_thread.is_alive():
+            self.prefetch_thread = threading.Thread(target=self.prefetch_loop)
+            self.prefetch_thread.daemon = True
+            self.prefetch_thread.start()
     
-    def set_interval(self, seconds):
+    def set_interval(self, seconds, broadcast=True):
         with self.lock:
             self.interval = max(10, min(3600, int(seconds)))
-            self.time_left = min(self.time_left, self.interval)
+            self.next_fetch_at = min(self.next_fetch_at, time.time() + self.interval)
+            interval, countdown = self.interval, self._seconds_left()
+        self._wake.set()
+        if self.is_leader:
+            self._save_shared_state()
+        elif broadcast:
+            publish_cache_event("generator_interval", {"interval": interval})
+        if broadcast:
+            publish_realtime_event(None, "interval_changed", {"interval": interval, "countdown": countdown})
+
+    def apply_remote_interval(self, payload):
+        """Cache-bus handler: an admin changed the interval on another worker."""
+        self.set_interval(payload.get("interval", self.interval), broadcast=False)
+
+    def _state(self):
+        with self.lock:
+            return {
+                "session_id": self.session_id,
+                "verse": self.current_verse,
+                "next_fetch_at": self.next_fetch_at,
+                "interval": self.interval,
+                "total_verses": self.total_verses
+            }
+
+    def apply_shared_state(self, state):
+        """Cache-bus handler: the leader published new state."""
+        if state and not self.is_leader:
+            self._install_state(state)
+
+    def _install_state(self, state):
+        with self.lock:
+            changed = state.get("session_id") and state.get("session_id") != self.session_id
+            if state.get("verse"):
+                self.current_verse = dict(state["verse"])
+            if state.get("session_id"):
+                self.session_id = state["session_id"]
+            if state.get("interval"):
+                self.interval = int(state["interval"])
+            if state.get("next_fetch_at"):
+                self.next_fetch_at = float(state["next_fetch_at"])
+            self.total_verses = int(state.get("total_verses") or self.total_verses)
+            if changed:
+                self.changed.notify_all()
+
+    def _load_shared_state(self):
+        self._last_state_refresh = time.time()
+        conn = None
+        try:
+            conn, db_type = get_db()
+            c = get_cursor(conn, db_type)
+            c.execute("SELECT session_id, verse, next_fetch_at, interval_seconds, total_verses FROM generator_state WHERE id = 1")
+            row = c.fetchone()
+            conn.close()
+            conn = None
+        except Exception as e:
+            logger.warning(f"Could not read shared generator state: {e}")
+            if conn:
+                conn.close()
+            return
+        if not row:
+            return
+        try:
+            verse = json.loads(row_pick(row, 'verse', 1) or 'null')
+        except Exception:
+            verse = None
+        state = {
+            "session_id": row_pick(row, 'session_id', 0),
+            "verse": verse,
+            "next_fetch_at": row_pick(row, 'next_fetch_at', 2),
+            "interval": row_pick(row, 'interval_seconds', 3),
+            "total_verses": row_pick(row, 'total_verses', 4)
+        }
+        self._install_state(state)
+
+    def _save_shared_state(self):
+        """Leader only: persist state for late joiners and push it to every follower."""
+        state = self._state()
+        verse_json = json.dumps(state["verse"])
+        leader = f"{socket.gethostname()}:{os.getpid()}"
+        conn = None
+        try:
+            conn, db_type = get_db()
+            c = get_cursor(conn, db_type)
+            if db_type == 'postgres':
+                c.execute("""
+                    INSERT INTO generator_state (id, session_id, verse, next_fetch_at, interval_seconds, total_verses, leader, updated_at)
+                    VALUES (1, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (id) DO UPDATE SET
+                        session_id = EXCLUDED.session_id,
+                        verse = EXCLUDED.verse,
+                        next_fetch_at = EXCLUDED.next_fetch_at,
+                        interval_seconds = EXCLUDED.interval_seconds,
+                        total_verses = EXCLUDED.total_verses,
+                        leader = EXCLUDED.leader,
+                        updated_at = EXCLUDED.updated_at
+                """, (state["session_id"], verse_json, state["next_fetch_at"], state["interval"], state["total_verses"], leader))
+            else:
+                c.execute("""
+                    INSERT INTO generator_state (id, session_id, verse, next_fetch_at, interval_seconds, total_verses, leader, updated_at)
+                    VALUES (1, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(id) DO UPDATE SET
+                        session_id = excluded.session_id,
+                        verse = excluded.verse,
+                        next_fetch_at = excluded.next_fetch_at,
+                        interval_seconds = excluded.interval_seconds,
+                        total_verses = excluded.total_verses,
+                        leader = excluded.leader,
+                        updated_at = excluded.updated_at
+                """, (state["session_id"], verse_json, state["next_fetch_at"], state["interval"], state["total_verses"], leader))
+            conn.commit()
+            conn.close()
+            conn = None
+        except Exception as e:
+            logger.warning(f"Could not persist shared generator state: {e}")
+            if conn:
+                conn.close()
+        publish_cache_event("generator", state)
+
+    def _follow(self):
+        """One follower tick: try to take over leadership, otherwise mirror the leader."""
+        now = time.time()
+        if _CACHE_BUS is not None:
+            _CACHE_BUS.ensure_listener()
+        if now - self._last_leader_attempt >= GENERATOR_LEADER_RETRY_SECONDS:
+            self._last_leader_attempt = now
+            if self.leader_lock.try_acquire():
+                self._load_shared_state()
+                self.is_leader = True
+                self._last_leader_check = now
+                logger.info(f"BibleGenerator leadership acquired by pid {os.getpid()}")
+                self._save_shared_state()
+                return
+        # Bus events normally keep followers current; reread the row only if the leader looks overdue.
+        if now > self.next_fetch_at + 5 and now - self._last_state_refresh > 2:
+            self._load_shared_state()
+
+    def snapshot(self):
+        """The /api/current payload."""
+        with self.lock:
+            return {
+                "verse": self.current_verse.copy() if self.current_verse else None,
+                "countdown": self._seconds_left(),
+                "total_verses": self.total_verses,
+                "session_id": self.session_id,
+                "interval": self.interval
+            }
+
+    def wait_for_new_session(self, since_session, timeout):
+        """Block until session_id differs from since_session; True if it changed."""
+        with self.changed:
+            return self.changed.wait_for(lambda: self.session_id != since_session, timeout=timeout)
+
+    def _publish_verse_changed(self):
+        data = self.snapshot()
+        publish_realtime_event(None, "verse_changed", data)
     
     def extract_book(self, ref):
         match = re.match(r'^([0-9]?\s?[A-Za-z]+)', ref)
         return match.group(1) if match else "Unknown"
     
-    def fetch_verse(self):
-        """Fetch a new verse from API or use fallback"""
-        network = self.networks[self.network_idx]
-        verse_data = None
+    def _request_verse(self, network):
+        """One upstream call; returns verse_data or raises."""
+        r = self.session.get(network["url"], timeout=VERSE_FETCH_TIMEOUT)
+        if r.status_code != 200:
+            raise RuntimeError(f"status={r.status_code}")
+        data = r.json()
+        if isinstance(data, list):
+            data = data[0] if data else {}
+            ref = f"{data.get('bookname', 'Unknown')} {data.get('chapter', '?')}:{data.get('verse', '?')}"
+            text = str(data.get('text') or '').strip()
+            trans = "WEB"
+        else:
+            ref = str(data.get('reference', 'Unknown'))
+            text = str(data.get('text', '')).strip()
+            trans = str(data.get('translation_name', 'KJV'))
+        if not (text and ref):
+            raise RuntimeError("empty_payload")
+        return {
+            "ref": ref,
+            "text": text,
+            "trans": trans,
+            "source": network["name"],
+            "book": self.extract_book(ref)
+        }
 
-        last_error = None
-        for attempt in range(2):
-            try:
-                r = self.session.get(network["url"], timeout=10)
-                if r.status_code != 200:
-                    last_error = f"status={r.status_code}"
+    def _fetch_local(self):
+        """Random verse from the bundled corpus; None if no translation is shipped."""
+        translation = BIBLE_CORPUS.default_translation(DEFAULT_TRANSLATION)
+        verse = BIBLE_CORPUS.random_verse(translation) if translation else None
+        if not verse:
+            return None
+        return {
+            "ref": verse["ref"],
+            "text": verse["text"],
+            "trans": translation.upper(),
+            "source": "Local corpus",
+            "book": verse["book_name"]
+        }
+
+    def _fetch_upstream(self):
+        """Local corpus first; otherwise each network in rotation, skipping ones whose breaker is open."""
+        verse_data = self._fetch_local()
+        if verse_data:
+            return verse_data
+        with self._upstream_lock:
+            for offset in range(len(self.networks)):
+                idx = (self.network_idx + offset) % len(self.networks)
+                network = self.networks[idx]
+                breaker = self.breakers[network["name"]]
+                if not breaker.allow():
                     continue
-                data = r.json()
-                if isinstance(data, list):
-                    data = data[0] if data else {}
-                    ref = f"{data.get('bookname', 'Unknown')} {data.get('chapter', '?')}:{data.get('verse', '?')}"
-                    text = str(data.get('text') or '').strip()
-                    trans = "WEB"
-                else:
-                    ref = str(data.get('reference', 'Unknown'))
-                    text = str(data.get('text', '')).strip()
-                    trans = str(data.get('translation_name', 'KJV'))
-
-                if text and ref:
-                    book = self.extract_book(ref)
-                    verse_data = {
-                        "ref": ref,
-                        "text": text,
-                        "trans": trans,
-                        "source": network["name"],
-                        "book": book
-                    }
-                    break
-                last_error = "empty_payload"
-            except requests.exceptions.RequestException as e:
-                last_error = str(e)
+                started = time.time()
+                try:
+                    verse_data = self._request_verse(network)
+                except Exception as e:
+                    breaker.record_failure(e)
+                    logger.warning(f"Verse fetch issue from {network['name']}: {e}")
+                    continue
+                breaker.record_success((time.time() - started) * 1000.0)
+                # Rotate network for next time
+                self.network_idx = (idx + 1) % len(self.networks)
+                return verse_data
+        return None
+
+    def _store_verse(self, verse_data):
+        """Reuse the existing row for this verse or insert one; returns its id (None on DB error)."""
+        conn = None
+        try:
+            conn, db_type = get_db()
+            c = get_cursor(conn, db_type)
+            now = datetime.now().isoformat()
+            verse_id = insert_verse_row(c, db_type, verse_data['ref'], verse_data['text'], verse_data['trans'],
+                                        verse_data['source'], now, verse_data['book'])
+            conn.commit()
+            _SEMANTIC_INDEX.add({
+                "id": verse_id,
+                "ref": verse_data['ref'],
+                "text": verse_data['text'],
+                "trans": verse_data['trans'],
+                "source": verse_data['source'],
+                "timestamp": now,
+                "book": verse_data['book']
+            })
+            _RECOMMENDER.add(verse_id, verse_data['book'])
+            return verse_id
+        except Exception as e:
+            logger.error(f"Database error storing verse: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def _is_duplicate(self, verse_data):
+        key = (verse_data['ref'], verse_data['text'])
+        with self.lock:
+            if self.current_verse and (self.current_verse.get('ref'), self.current_verse.get('text')) == key:
+                return True
+        with self._buffer_cond:
+            return any((v['ref'], v['text']) == key for v in self.buffer)
+
+    def _prefetch_one(self):
+        """Fetch and dedupe one verse into the in-memory buffer; False if every network failed.
+
+        Nothing is written until fetch_verse() puts the verse live, so upcoming verses
+        stay out of search, recommendations and the newest-verse query.
+        """
+        verse_data = self._fetch_upstream()
+        if not verse_data:
+            return False
+        if self._is_duplicate(verse_data):
+            return True
+        with self._buffer_cond:
+            if len(self.buffer) < VERSE_PREFETCH_DEPTH:
+                self.buffer.append(verse_data)
+        return True
+
+    def _prefetch_backoff(self):
+        """Seconds to wait after a failed prefetch: until the first breaker reopens, within [2, 60]."""
+        retry_at = [b.retry_at() for b in self.breakers.values()]
+        if all(retry_at):
+            return max(2.0, min(60.0, min(retry_at) - time.time()))
+        return 2.0
+
+    def prefetch_loop(self):
+        """Keep up to VERSE_PREFETCH_DEPTH fetched verses ready while this process leads."""
+        while self.running:
+            try:
+                with self._buffer_cond:
+                    if not self.is_leader or len(self.buffer) >= VERSE_PREFETCH_DEPTH:
+                        # fetch_verse() notifies after taking a verse; the timeout covers leadership changes.
+                        self._buffer_cond.wait(GENERATOR_LEADER_RETRY_SECONDS)
+                        continue
+                if not self._prefetch_one():
+                    with self._buffer_cond:
+                        self._buffer_cond.wait(self._prefetch_backoff())
             except Exception as e:
-                last_error = str(e)
-            time.sleep(0.2)
+                logger.error(f"Verse prefetch error: {e}")
+                time.sleep(5)
 
-        if not verse_data and last_error:
-            logger.warning(f"Verse fetch issue from {network['name']}: {last_error}")
-        
-        # Rotate network for next time
-        self.network_idx = (self.network_idx + 1) % len(self.networks)
-        
+    def _take_buffered(self):
+        with self._buffer_cond:
+            verse_data = self.buffer.popleft() if self.buffer else None
+            self._buffer_cond.notify_all()
+        return verse_data
+
+    def fetch_verse(self):
+        """Switch to the next verse: a prefetched one if ready, else fetch now or fall back"""
+        verse_data = self._take_buffered() or self._fetch_upstream()
         # If API failed, use fallback
         if not verse_data:
             logger.warning("Using fallback verse")
@@ -4129,267 +7136,183 @@ class BibleGenerator:
                 "source": "Fallback",
                 "book": fallback['book']
             }
-        
-        # Store in database
-        try:
-            conn, db_type = get_db()
-            c = get_cursor(conn, db_type)
-            
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO verses (reference, text, translation, source, timestamp, book) 
-                    VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING
-                """, (verse_data['ref'], verse_data['text'], verse_data['trans'], 
-                      verse_data['source'], datetime.now().isoformat(), verse_data['book']))
-            else:
-                c.execute("INSERT OR IGNORE INTO verses (reference, text, translation, source, timestamp, book) VALUES (?, ?, ?, ?, ?, ?)",
-                          (verse_data['ref'], verse_data['text'], verse_data['trans'], 
-                           verse_data['source'], datetime.now().isoformat(), verse_data['book']))
-            
-            conn.commit()
-            
-            # Get the ID
-            if db_type == 'postgres':
-                c.execute("SELECT id FROM verses WHERE reference = %s AND text = %s", 
-                         (verse_data['ref'], verse_data['text']))
-            else:
-                c.execute("SELECT id FROM verses WHERE reference = ? AND text = ?", 
-                         (verse_data['ref'], verse_data['text']))
-            
-            result = c.fetchone()
-            try:
-                verse_id = result['id'] if result else random.randint(1000, 9999)
-            except (TypeError, KeyError):
-                verse_id = result[0] if result else random.randint(1000, 9999)
-            
-            # Update session
+        verse_id = self._store_verse(verse_data)
+
+        with self.lock:
             self.session_id = secrets.token_hex(8)
-            
-            conn.close()
-            
-            with self.lock:
-                self.current_verse = {
-                    "id": verse_id,
-                    "ref": verse_data['ref'],
-                    "text": verse_data['text'],
-                    "trans": verse_data['trans'],
-                    "source": verse_data['source'],
-                    "book": verse_data['book'],
-                    "is_new": True,
-                    "session_id": self.session_id
-                }
+            self.current_verse = {
+                "id": verse_id if verse_id is not None else random.randint(1000, 9999),
+                "ref": verse_data['ref'],
+                "text": verse_data['text'],
+                "trans": verse_data['trans'],
+                "source": verse_data['source'],
+                "book": verse_data['book'],
+                "is_new": True,
+                "session_id": self.session_id
+            }
+            if verse_id is not None:
                 self.total_verses += 1
-                
-            logger.info(f"New verse fetched: {verse_data['ref']}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Database error in fetch_verse: {e}")
-            # Still update current_verse even if DB fails
-            with self.lock:
-                self.current_verse = {
-                    "id": random.randint(1000, 9999),
-                    "ref": verse_data['ref'],
-                    "text": verse_data['text'],
-                    "trans": verse_data['trans'],
-                    "source": verse_data['source'],
-                    "book": verse_data['book'],
-                    "is_new": True,
-                    "session_id": secrets.token_hex(8)
-                }
-            return True
-    
+            self.changed.notify_all()
+        logger.info(f"New verse fetched: {verse_data['ref']}")
+        return True
+
+    def buffer_stats(self):
+        with self._buffer_cond:
+            depth = len(self.buffer)
+        return {"depth": depth, "capacity": VERSE_PREFETCH_DEPTH}
+
     def get_current_verse(self):
         """Thread-safe get current verse"""
         with self.lock:
             return self.current_verse.copy() if self.current_verse else None
     
+    def _seconds_left(self):
+        """Whole seconds until next_fetch_at; caller holds self.lock."""
+        return max(0, int(math.ceil(self.next_fetch_at - time.time())))
+
     def get_time_left(self):
-        """Thread-safe get time left"""
-        with self.lock:
-            return self.time_left
-    
-    def reset_timer(self):
-        """Reset the timer after fetching"""
+        """Seconds until the next fetch, computed from the deadline"""
         with self.lock:
-            self.time_left = self.interval
-    
-    def decrement_timer(self):
-        """Decrement timer by 1 second"""
+            return self._seconds_left()
+
+    def _advance_deadline(self):
+        """Move next_fetch_at one interval on from the deadline that just passed.
+
+        Anchoring on the old deadline (not on when the fetch finished) keeps fetch
+        latency from accumulating; if we fell more than an interval behind, restart
+        from now instead of firing a burst of catch-up fetches.
+        """
         with self.lock:
-            self.time_left -= 1
-            return self.time_left
+            now = time.time()
+            self.next_fetch_at += self.interval
+            if self.next_fetch_at <= now:
+                self.next_fetch_at = now + self.interval
     
     def loop(self):
-        """Main loop - runs forever"""
+        """Main loop - sleeps until the next deadline instead of ticking every second"""
         while self.running:
             try:
-                current = self.get_time_left()
-                if current <= 0:
-                    self.fetch_verse()
-                    self.reset_timer()
-                else:
-                    self.decrement_timer()
+                if not self.is_leader:
+                    self._follow()
+                    if not self.is_leader:
+                        # Followers are fed by the bus; wake only to retry leadership or when poked.
+                        self._wake.wait(GENERATOR_LEADER_RETRY_SECONDS)
+                        self._wake.clear()
+                    continue
+                now = time.time()
+                if now - self._last_leader_check >= GENERATOR_LEADER_RETRY_SECONDS:
+                    self._last_leader_check = now
+                    if not self.leader_lock.is_held():
+                        logger.warning("BibleGenerator lost leadership; following")
+                        self.is_leader = False
+                        self.leader_lock.release()
+                        continue
+                with self.lock:
+                    remaining = self.next_fetch_at - now
+                if remaining > 0:
+                    # set_interval() may pull the deadline in; re-check leadership at least this often.
+                    self._wake.wait(min(remaining, GENERATOR_LEADER_RETRY_SECONDS))
+                    self._wake.clear()
+                    continue
+                self._advance_deadline()
+                self.fetch_verse()
+                self._save_shared_state()
+                # Only after the bus has the new state, so followers don't 304 the clients' refetch.
+                self._publish_verse_changed()
             except Exception as e:
                 logger.error(f"Critical error in generator loop: {e}")
                 time.sleep(5)  # Wait before retrying
                 continue
-            time.sleep(1)
 
 # Global generator instance
 generator = BibleGenerator()
+if _CACHE_BUS is not None:
+    _CACHE_BUS.subscribe("generator", generator.apply_shared_state)
+    _CACHE_BUS.subscribe("generator_interval", generator.apply_remote_interval)
+if APP_BACKGROUND_TASKS:
+    _ensure_batch_jobs()
+CURRENT_LONG_POLL_MAX_SECONDS = max(1.0, min(60.0, float(os.environ.get('CURRENT_LONG_POLL_MAX_SECONDS', '25'))))
 CURRENT_API_CACHE_TTL = max(0.0, float(os.environ.get('API_CURRENT_CACHE_TTL', '0.0' if IMMEDIATE_UPDATE_MODE else '2.0')))
 _current_api_cache = {}
 _current_api_cache_lock = threading.Lock()
 
+def _recommendation_reason(book_name=None, preferred=False):
+    if preferred and book_name:
+        options = [
+            f"Because you like {book_name}",
+            f"A fresh passage from {book_name}",
+            f"Something uplifting from {book_name}",
+            f"More wisdom in {book_name}"
+        ]
+    else:
+        options = [
+            "Recommended for you",
+            "A fresh verse for today",
+            "Something to reflect on",
+            "A new verse to explore"
+        ]
+    return random.choice(options)
+
 # Bind the method to the class
-def generate_smart_recommendation(self, user_id, exclude_ids=None):
-    """Generate recommendation based on user likes"""
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
-    exclude_ids = exclude_ids or []
+def generate_smart_recommendations(self, user_id, count=1, exclude_ids=None):
+    """Up to count verses the user has not liked or saved, favouring books they like."""
     cleaned_exclude = []
-    for item in exclude_ids:
+    for item in exclude_ids or []:
         try:
             cleaned_exclude.append(int(item))
         except (TypeError, ValueError):
             continue
-    exclude_ids = list(dict.fromkeys(cleaned_exclude))
-    
+    count = max(1, min(RECOMMEND_MAX_BATCH, int(count or 1)))
+
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = %s
-                UNION
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = %s
-            """, (user_id, user_id))
-        else:
-            c.execute("""
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = ?
-                UNION
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = ?
-            """, (user_id, user_id))
-        
-        preferred_books = []
-        for row in c.fetchall():
-            try:
-                preferred_books.append(row['book'])
-            except (TypeError, KeyError):
-                preferred_books.append(row[0])
-        
-        if preferred_books:
-            if db_type == 'postgres':
-                placeholders = ','.join(['%s'] * len(preferred_books))
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND v.id NOT IN ({','.join(['%s'] * len(exclude_ids))})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT v.* FROM verses v
-                    WHERE v.book IN ({placeholders})
-                    AND v.id NOT IN (SELECT verse_id FROM likes WHERE user_id = %s)
-                    AND v.id NOT IN (SELECT verse_id FROM saves WHERE user_id = %s)
-                    {exclude_clause}
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                """, (*preferred_books, user_id, user_id, *exclude_params))
-            else:
-                placeholders = ','.join('?' for _ in preferred_books)
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND v.id NOT IN ({','.join('?' for _ in exclude_ids)})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT v.* FROM verses v
-                    WHERE v.book IN ({placeholders})
-                    AND v.id NOT IN (SELECT verse_id FROM likes WHERE user_id = ?)
-                    AND v.id NOT IN (SELECT verse_id FROM saves WHERE user_id = ?)
-                    {exclude_clause}
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                """, (*preferred_books, user_id, user_id, *exclude_params))
-        else:
-            if db_type == 'postgres':
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND id NOT IN ({','.join(['%s'] * len(exclude_ids))})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT * FROM verses 
-                    WHERE id NOT IN (SELECT verse_id FROM likes WHERE user_id = %s)
-                    AND id NOT IN (SELECT verse_id FROM saves WHERE user_id = %s)
-                    {exclude_clause}
-                    ORDER BY RANDOM() LIMIT 1
-                """, (user_id, user_id, *exclude_params))
-            else:
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND id NOT IN ({','.join('?' for _ in exclude_ids)})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT * FROM verses 
-                    WHERE id NOT IN (SELECT verse_id FROM likes WHERE user_id = ?)
-                    AND id NOT IN (SELECT verse_id FROM saves WHERE user_id = ?)
-                    {exclude_clause}
-                    ORDER BY RANDOM() LIMIT 1
-                """, (user_id, user_id, *exclude_params))
-        
-        row = c.fetchone()
-        
-        if row:
-            def pick_reason(book_name=None, preferred=False):
-                if preferred and book_name:
-                    options = [
-                        f"Because you like {book_name}",
-                        f"A fresh passage from {book_name}",
-                        f"Something uplifting from {book_name}",
-                        f"More wisdom in {book_name}"
-                    ]
-                else:
-                    options = [
-                        "Recommended for you",
-                        "A fresh verse for today",
-                        "Something to reflect on",
-                        "A new verse to explore"
-                    ]
-                return random.choice(options)
-            try:
-                return {
-                    "id": row['id'], 
-                    "ref": row['reference'], 
-                    "text": row['text'],
-                    "trans": row['translation'], 
-                    "book": row['book'],
-                    "reason": pick_reason(row['book'], bool(preferred_books))
-                }
-            except (TypeError, KeyError):
-                return {
-                    "id": row[0], 
-                    "ref": row[1], 
-                    "text": row[2],
-                    "trans": row[3], 
-                    "book": row[6],
-                    "reason": pick_reason(row[6], bool(preferred_books))
-                }
-        return None
+        picks = _RECOMMENDER.sample(user_id, count, cleaned_exclude)
+        if not picks:
+            return []
+        wanted_ids = list(dict.fromkeys(
+            [verse_id for verse_id, _, _ in picks] + [because for _, _, because in picks if because is not None]
+        ))
+        conn, db_type = get_db()
+        try:
+            c = get_cursor(conn, db_type)
+            ph = '%s' if db_type == 'postgres' else '?'
+            c.execute(
+                f"SELECT id, reference, text, translation, book FROM verses WHERE id IN ({', '.join([ph] * len(wanted_ids))})",
+                wanted_ids
+            )
+            rows = {row_pick(row, 'id', 0): row for row in c.fetchall()}
+        finally:
+            conn.close()
+        recommendations = []
+        for verse_id, preferred, because in picks:
+            row = rows.get(verse_id)
+            if row is None:
+                # Deleted since the pools were built; the next rebuild drops it.
+                continue
+            book = row_pick(row, 'book', 4)
+            item = {
+                "id": verse_id,
+                "ref": row_pick(row, 'reference', 1),
+                "text": row_pick(row, 'text', 2),
+                "trans": row_pick(row, 'translation', 3),
+                "book": book,
+                "reason": _recommendation_reason(book, preferred)
+            }
+            because_row = rows.get(because) if because is not None else None
+            if because_row is not None:
+                item["reason"] = f"Readers who liked {row_pick(because_row, 'reference', 1)} also liked this"
+                item["because_id"] = because
+            recommendations.append(item)
+        return recommendations
     except Exception as e:
         logger.error(f"Recommendation error: {e}")
-        return None
-    finally:
-        conn.close()
+        return []
 
+def generate_smart_recommendation(self, user_id, exclude_ids=None):
+    """Generate recommendation based on user likes"""
+    recommendations = self.generate_smart_recommendations(user_id, 1, exclude_ids)
+    return recommendations[0] if recommendations else None
+
+BibleGenerator.generate_smart_recommendations = generate_smart_recommendations
 BibleGenerator.generate_smart_recommendation = generate_smart_recommendation
 
 @app.before_request
@@ -4427,48 +7350,9 @@ def check_user_banned():
             """), 503
 
     if 'user_id' in session:
-        # Track user presence for admin analytics.
+        # Track user presence for admin analytics (persisted by the presence flusher).
         try:
-            last_ping = session.get('last_presence_ping', 0)
-            now_ts = time.time()
-            should_ping = True
-            try:
-                should_ping = (now_ts - float(last_ping)) >= 20
-            except Exception:
-                should_ping = True
-            if should_ping:
-                conn, db_type = get_db()
-                c = get_cursor(conn, db_type)
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS user_presence (
-                        user_id INTEGER PRIMARY KEY,
-                        last_seen TEXT,
-                        last_path TEXT,
-                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                now_iso = datetime.now().isoformat()
-                if db_type == 'postgres':
-                    c.execute("""
-                        INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                        VALUES (%s, %s, %s, %s)
-                        ON CONFLICT (user_id) DO UPDATE SET
-                            last_seen = EXCLUDED.last_seen,
-                            last_path = EXCLUDED.last_path,
-                            updated_at = EXCLUDED.updated_at
-                    """, (session['user_id'], now_iso, path, now_iso))
-                else:
-                    c.execute("""
-                        INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                        VALUES (?, ?, ?, ?)
-                        ON CONFLICT(user_id) DO UPDATE SET
-                            last_seen = excluded.last_seen,
-                            last_path = excluded.last_path,
-                            updated_at = excluded.updated_at
-                    """, (session['user_id'], now_iso, path, now_iso))
-                conn.commit()
-                conn.close()
-                session['last_presence_ping'] = now_ts
+            record_presence(session['user_id'], path)
         except Exception:
             pass
 
@@ -4517,7 +7401,11 @@ def health_check():
             "generator_running": generator.thread.is_alive() if generator.thread else False,
             "current_verse": generator.get_current_verse()['ref'] if generator.get_current_verse() else None,
             "time_left": generator.get_time_left(),
-            "interval": generator.interval
+            "interval": generator.interval,
+            "generator_leader": generator.is_leader,
+            "verse_buffer": generator.buffer_stats(),
+            "bible_corpus": BIBLE_CORPUS.stats(),
+            "verse_networks": [breaker.stats() for breaker in generator.breakers.values()]
         }
         return jsonify(status)
     except Exception as e:
@@ -5037,6 +7925,20 @@ def get_current():
     is_banned, reason, _ = check_ban_status(user_id)
     if is_banned:
         return jsonify({"error": "banned", "message": "Account banned", "reason": reason}), 403
+
+    # Conditional mode: ?since_session=<id>[&wait=<seconds>] answers 304 until the verse changes.
+    since_session = (request.args.get('since_session') or '').strip()
+    if since_session:
+        generator.start_thread()
+        try:
+            wait = max(0.0, min(CURRENT_LONG_POLL_MAX_SECONDS, float(request.args.get('wait') or 0)))
+        except ValueError:
+            wait = 0.0
+        if generator.session_id == since_session:
+            if wait <= 0 or not generator.wait_for_new_session(since_session, wait):
+                return Response(status=304, headers={"Cache-Control": "no-store"})
+        return jsonify(generator.snapshot())
+
     if CURRENT_API_CACHE_TTL > 0:
         with _current_api_cache_lock:
             cached = _current_api_cache.get(user_id)
@@ -5046,13 +7948,7 @@ def get_current():
     # Ensure thread is running
     generator.start_thread()
 
-    payload = {
-        "verse": generator.get_current_verse(),
-        "countdown": generator.get_time_left(),
-        "total_verses": generator.total_verses,
-        "session_id": generator.session_id,
-        "interval": generator.interval
-    }
+    payload = generator.snapshot()
     if CURRENT_API_CACHE_TTL > 0:
         with _current_api_cache_lock:
             _current_api_cache[user_id] = {
@@ -5067,7 +7963,13 @@ def bible_books():
         return jsonify({"error": "Not logged in"}), 401
 
     translation = (request.args.get('translation') or DEFAULT_TRANSLATION).lower()
-    data = _fetch_json(f"{BIBLE_API_BASE}/data/{translation}")
+    if BIBLE_CORPUS.has(translation):
+        return jsonify({
+            "translation": BIBLE_CORPUS.translations[translation]["name"],
+            "translation_id": translation,
+            "books": BIBLE_CORPUS.books(translation)
+        })
+    data = _bible_api_load(f"data:{translation}", f"{BIBLE_API_BASE}/data/{translation}", BIBLE_API_BOOKS_FRESH_SECONDS)
     if data and isinstance(data, dict) and "books" in data:
         return jsonify({
             "translation": data.get("translation", translation),
@@ -5094,9 +7996,7 @@ def bible_chapter():
     if not chapter.isdigit():
         return jsonify({"error": "chapter must be a number"}), 400
 
-    query = f"{book} {chapter}"
-    encoded = quote(query)
-    data = _fetch_json(f"{BIBLE_API_BASE}/{encoded}?translation={translation}")
+    data = _bible_passage(translation, f"{book} {chapter}")
     if not data:
         return jsonify({"error": "Unable to load passage"}), 502
 
@@ -5122,12 +8022,23 @@ def bible_compare():
         translations = [t.strip().lower() for t in translations_raw.split(',') if t.strip()]
     else:
         translations = ['web', 'kjv']
-    translations = translations[:6]
+    translations = list(dict.fromkeys(translations))[:6]
+
+    # Fetch every translation at once; whatever misses the deadline is reported as not ok.
+    # Stragglers keep running in the pool and land in the bible cache for the next request.
+    futures = {trans: _BIBLE_COMPARE_POOL.submit(_bible_passage, trans, reference) for trans in translations}
+    wait_futures(list(futures.values()), timeout=BIBLE_COMPARE_DEADLINE_SECONDS)
 
     results = []
-    for trans in translations:
-        encoded = quote(reference)
-        data = _fetch_json(f"{BIBLE_API_BASE}/{encoded}?translation={trans}")
+    aligned = {}
+    for trans, future in futures.items():
+        data = None
+        timed_out = not future.done()
+        if not timed_out:
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.warning(f"Compare fetch failed for {trans}: {e}")
         if not data:
             results.append({
                 "translation_id": trans,
@@ -5135,21 +8046,34 @@ def bible_compare():
                 "reference": reference,
                 "text": "",
                 "verses": [],
-                "ok": False
+                "ok": False,
+                "timed_out": timed_out
             })
             continue
+        verses = data.get("verses", [])
         results.append({
             "translation_id": data.get("translation_id", trans),
             "translation": data.get("translation_name") or data.get("translation") or trans.upper(),
             "reference": data.get("reference", reference),
             "text": data.get("text", ""),
-            "verses": data.get("verses", []),
+            "verses": verses,
             "ok": True
         })
+        for verse in verses:
+            try:
+                position = (int(verse.get("chapter") or 0), int(verse.get("verse")))
+            except (TypeError, ValueError):
+                continue
+            aligned.setdefault(position, {})[trans] = str(verse.get("text") or "").strip()
 
     return jsonify({
         "reference": reference,
-        "translations": results
+        "translations": results,
+        # One row per verse number; a translation missing that verse maps to null.
+        "aligned": [
+            {"chapter": chapter, "verse": verse, "texts": {trans: texts.get(trans) for trans in translations}}
+            for (chapter, verse), texts in sorted(aligned.items())
+        ]
     })
 
 @app.route('/api/bible/topic-search')
@@ -5162,14 +8086,33 @@ def bible_topic_search():
         return jsonify({"topic": "", "verses": [], "count": 0})
 
     keywords = RESEARCH_TOPIC_MAP.get(topic, [])
-    if not keywords:
+    if keywords:
+        groups = keyword_search_groups(keywords)
+    else:
         keywords = [topic]
+        groups = parse_verse_search(topic, prefix_words=True)
     limit = max(1, min(300, int(request.args.get('limit', 100))))
 
     conn, db_type = get_db()
     c = get_cursor(conn, db_type)
     try:
-        if db_type == 'postgres':
+        ids = search_verse_ids(conn, db_type, groups, limit)
+        if ids is not None:
+            if not ids:
+                c.execute("SELECT id, reference, text, translation, source, timestamp, book FROM verses WHERE 1 = 0")
+            elif db_type == 'postgres':
+                c.execute("""
+                    SELECT id, reference, text, translation, source, timestamp, book
+                    FROM verses
+                    WHERE id = ANY(%s)
+                """, (ids,))
+            else:
+                c.execute(f"""
+                    SELECT id, reference, text, translation, source, timestamp, book
+                    FROM verses
+                    WHERE id IN ({','.join('?' for _ in ids)})
+                """, ids)
+        elif db_type == 'postgres':
             predicates = []
             params = []
             for kw in keywords:
@@ -5202,7 +8145,6 @@ def bible_topic_search():
 
         rows = c.fetchall()
         verses = []
-        seen = set()
         for row in rows:
             try:
                 item = {
@@ -5224,13 +8166,6 @@ def bible_topic_search():
                     "timestamp": row[5],
                     "book": row[6]
                 }
-            content_key = (
-                _normalize_bible_book_name(item.get("ref")),
-                _normalize_mem_text(item.get("text"))
-            )
-            if content_key in seen:
-                continue
-            seen.add(content_key)
             verses.append(item)
 
         verses.sort(key=_library_verse_sort_key)
@@ -5286,14 +8221,95 @@ def _strip_gutenberg_boilerplate(text):
     cleaned = re.sub(r'\n{3,}', '\n\n', cleaned).strip()
     return cleaned
 
+_HTTP_SESSION = requests.Session()
+# Sized so every compare worker can hold a keep-alive connection to bible-api.com.
+_HTTP_SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=BIBLE_COMPARE_WORKERS))
+_BIBLE_COMPARE_POOL = ThreadPoolExecutor(max_workers=BIBLE_COMPARE_WORKERS, thread_name_prefix="bible-compare")
+
 def _fetch_json(url, timeout=12):
     try:
-        response = requests.get(url, timeout=timeout)
+        response = _HTTP_SESSION.get(url, timeout=timeout)
         response.raise_for_status()
         return response.json()
     except Exception:
         return None
 
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one; the others wait for its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None}
+            else:
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            return call["result"]
+        try:
+            call["result"] = fn()
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+        return call["result"]
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+_BIBLE_FETCHES = SingleFlight()
+
+def _bible_api_load(key, url, fresh_seconds):
+    """Fetch url through the bible cache: LRU, then the on-disk store, then one upstream call per key.
+
+    Entries are kept for BIBLE_API_CACHE_TTL; once older than fresh_seconds they are
+    still served, and a background thread refreshes them (stale-while-revalidate).
+    """
+    body = _BIBLE_API_CACHE.get(key)
+    if body is not None:
+        try:
+            envelope = json.loads(body)
+        except (TypeError, ValueError):
+            envelope = None
+        if envelope and envelope.get("data") is not None:
+            if time.time() - float(envelope.get("fetched_at") or 0) > fresh_seconds and not _BIBLE_FETCHES.in_flight(key):
+                threading.Thread(
+                    target=lambda: _BIBLE_FETCHES.do(key, lambda: _bible_api_refresh(key, url)), daemon=True
+                ).start()
+            return envelope["data"]
+    return _BIBLE_FETCHES.do(key, lambda: _bible_api_refresh(key, url))
+
+def _bible_api_refresh(key, url):
+    data = _fetch_json(url)
+    if data:
+        envelope = {"fetched_at": time.time(), "data": data}
+        _BIBLE_API_CACHE.set(key, json.dumps(envelope, separators=(',', ':')).encode('utf-8'), BIBLE_API_CACHE_TTL)
+    return data
+
+def _bible_passage(translation, reference):
+    """Passage payload: bundled corpus first, then the cached bible-api.com proxy."""
+    data = BIBLE_CORPUS.passage(translation, reference)
+    if data is not None:
+        return data
+    parsed = parse_reference(reference)
+    if parsed:
+        book, chapter, first, last = parsed
+        span = f":{first}-{last}" if first is not None else ""
+        key = f"passage:{translation}:{_normalize_bible_book_name(book)}:{chapter}{span}"
+    else:
+        key = f"passage:{translation}:{' '.join(reference.lower().split())}"
+    return _bible_api_load(
+        key, f"{BIBLE_API_BASE}/{quote(reference)}?translation={translation}", BIBLE_API_CACHE_TTL
+    )
+
 def _extract_json(text):
     match = re.search(r"\{.*\}", text, re.S)
     if not match:
@@ -5502,9 +8518,13 @@ def books_search():
                 "ai_score": score,
                 "subjects": subjects
             }
-            BOOK_META_CACHE[str(entry["id"])] = entry
             books.append(entry)
 
+        _BOOK_CACHE.set_many(
+            [(f"meta:{b['id']}", json.dumps(b).encode('utf-8')) for b in books if b.get('id') is not None],
+            BOOK_CACHE_TTL
+        )
+
         ranked = _openai_rank_books(q, books)
         if ranked:
             books = ranked
@@ -5521,13 +8541,13 @@ def books_content(book_id):
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
 
-    key = str(book_id)
-    cached = BOOK_TEXT_CACHE.get(key)
+    cached = _BOOK_CACHE.get(f"text:{book_id}")
     if cached:
-        return jsonify(cached)
+        return Response(cached, mimetype='application/json')
 
     try:
-        meta = BOOK_META_CACHE.get(key)
+        meta_body = _BOOK_CACHE.get(f"meta:{book_id}")
+        meta = json.loads(meta_body) if meta_body else None
         if not meta:
             meta_resp = requests.get(f'https://gutendex.com/books/{book_id}', timeout=15)
             if not meta_resp.ok:
@@ -5541,7 +8561,7 @@ def books_content(book_id):
                 "cover": (formats.get('image/jpeg') or formats.get('image/png') or ''),
                 "text_url": _pick_book_text_url(formats)
             }
-            BOOK_META_CACHE[key] = meta
+            _BOOK_CACHE.set(f"meta:{book_id}", json.dumps(meta).encode('utf-8'), BOOK_CACHE_TTL)
 
         text_url = meta.get('text_url')
         if not text_url:
@@ -5566,8 +8586,9 @@ def books_content(book_id):
             "cover": meta.get('cover') or '',
             "text": cleaned
         }
-        BOOK_TEXT_CACHE[key] = payload
-        return jsonify(payload)
+        body = (app.json.dumps(payload, separators=(",", ":")) + "\n").encode('utf-8')
+        _BOOK_CACHE.set(f"text:{book_id}", body, BOOK_CACHE_TTL)
+        return Response(body, mimetype='application/json')
     except Exception as e:
         logger.error(f"Book content error: {e}")
         return jsonify({"error": "book_content_error"}), 500
@@ -5607,14 +8628,7 @@ def set_interval():
         conn, db_type = get_db()
         c = conn.cursor()
         
-        # Ensure table exists
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        ensure_system_settings_table(c, db_type)
         
         # Save interval
         if db_type == 'postgres':
@@ -5633,9 +8647,11 @@ def set_interval():
                     value = excluded.value,
                     updated_at = excluded.updated_at
             """, (str(interval),))
+        bump_system_settings_version(c, db_type)
         
         conn.commit()
         conn.close()
+        invalidate_system_settings_cache()
         logger.info(f"Verse interval saved to database: {interval} seconds")
     except Exception as e:
         logger.error(f"Failed to save interval to DB: {e}")
@@ -6114,6 +9130,7 @@ def init_shop_items():
                       item['price'], item['rarity'], normalized_icon, effects_json))
         
         conn.commit()
+        invalidate_shop_item_meta()
         logger.info("Shop items initialized/updated")
     except Exception as e:
         logger.error(f"Error initializing shop items: {e}")
@@ -6121,7 +9138,8 @@ def init_shop_items():
         conn.close()
 
 # Initialize shop items on startup
-init_shop_items()
+if APP_BACKGROUND_TASKS:
+    init_shop_items()
 
 @app.route('/api/shop/items')
 def get_shop_items():
@@ -6362,6 +9380,7 @@ def purchase_item():
             """, (session['user_id'], -price, f"Purchased {item_name}"))
         
         conn.commit()
+        invalidate_user_cosmetics(session['user_id'])
         
         return jsonify({
             "success": True,
@@ -6531,6 +9550,7 @@ def equip_item():
                       (1 if equip else 0, session['user_id'], item_id))
         
         conn.commit()
+        invalidate_user_cosmetics(session['user_id'])
         
         return jsonify({"success": True, "equipped": equip, "item_id": item_id})
     except Exception as e:
@@ -6672,6 +9692,7 @@ def use_consumable():
         }
 
         conn.commit()
+        invalidate_user_cosmetics(session['user_id'])
         return jsonify({
             "success": True,
             "item_id": item_id,
@@ -7903,9 +10924,9 @@ def get_daily_challenge():
     user_id = int(session['user_id'])
     period_key = get_challenge_period_key()
     cache_key = f"daily_challenge:{user_id}:{period_key}"
-    cached = _api_cache_get(cache_key)
+    cached = _api_cache_response(cache_key)
     if cached is not None:
-        return jsonify(cached)
+        return cached
 
     conn, db_type = get_db()
     c = get_cursor(conn, db_type)
@@ -8188,6 +11209,7 @@ def like_verse():
                 liked = True
         
         conn.commit()
+        _RECOMMENDER.forget_user(session['user_id'])
 
         if liked:
             record_daily_action(session['user_id'], 'like', verse_id)
@@ -8266,6 +11288,7 @@ def save_verse():
                 saved = True
         
         conn.commit()
+        _RECOMMENDER.forget_user(session['user_id'])
         
         # Log the save/unsave action
         if saved:
@@ -8290,163 +11313,230 @@ def save_verse():
     finally:
         conn.close()
 
+def _encode_library_cursor(*values):
+    """Opaque keyset cursor for the sort-key values of the last row on a page."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_library_cursor(cursor, size=2):
+    """Sort-key tuple (last value is the row id) from a cursor; ValueError if it is not one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(values, list) or len(values) != size or not isinstance(values[-1], int):
+        raise ValueError("invalid cursor")
+    return tuple(values)
+
+def _library_section_page(c, db_type, user_id, section, limit, cursor=None, collection_id=None):
+    """One page of a library section, newest first: (items, next cursor or None).
+
+    liked/saved pages are keyed on the like/save row's (timestamp, id); collection
+    pages on the verse_collections row id, scoped to collections the user owns.
+    """
+    ph = '%s' if db_type == 'postgres' else '?'
+    after = _decode_library_cursor(cursor) if cursor else None
+    if section == 'collection':
+        params = [int(collection_id), user_id]
+        keyset = ""
+        if after:
+            keyset = f"AND vc.id < {ph}"
+            params.append(after[1])
+        c.execute(f"""
+            SELECT vc.id AS row_id, v.id, v.reference, v.text
+            FROM verse_collections vc
+            JOIN collections col ON col.id = vc.collection_id
+            JOIN verses v ON v.id = vc.verse_id
+            WHERE vc.collection_id = {ph} AND col.user_id = {ph} {keyset}
+            ORDER BY vc.id DESC
+            LIMIT {ph}
+        """, params + [limit + 1])
+        rows = c.fetchall()
+        items = [{"id": row_pick(row, 'id', 1), "ref": row_pick(row, 'reference', 2), "text": row_pick(row, 'text', 3)}
+                 for row in rows[:limit]]
+        next_cursor = _encode_library_cursor(None, row_pick(rows[limit - 1], 'row_id', 0)) if len(rows) > limit else None
+        return items, next_cursor
+
+    table, stamp_key = _LIBRARY_SECTIONS[section]
+    params = [user_id]
+    keyset = ""
+    if after:
+        # timestamp is nullable; '' keeps undated rows in the order instead of dropping them.
+        keyset = f"AND (COALESCE(t.timestamp, ''), t.id) < ({ph}, {ph})"
+        params.extend(after)
+    c.execute(f"""
+        SELECT t.id AS row_id, COALESCE(t.timestamp, '') AS stamped_at,
+               v.id, v.reference, v.text, v.translation, v.source, v.book
+        FROM {table} t
+        JOIN verses v ON v.id = t.verse_id
+        WHERE t.user_id = {ph} {keyset}
+        ORDER BY COALESCE(t.timestamp, '') DESC, t.id DESC
+        LIMIT {ph}
+    """, params + [limit + 1])
+    rows = c.fetchall()
+    items = []
+    for row in rows[:limit]:
+        item = {
+            "id": row_pick(row, 'id', 2),
+            "ref": row_pick(row, 'reference', 3),
+            "text": row_pick(row, 'text', 4),
+            "trans": row_pick(row, 'translation', 5),
+            "source": row_pick(row, 'source', 6),
+            "book": row_pick(row, 'book', 7),
+            "liked_at": None,
+            "saved_at": None
+        }
+        item[stamp_key] = row_pick(row, 'stamped_at', 1) or None
+        items.append(item)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_library_cursor(row_pick(last, 'stamped_at', 1), row_pick(last, 'row_id', 0))
+    return items, next_cursor
+
+def _library_counts(c, db_type, user_id):
+    ph = '%s' if db_type == 'postgres' else '?'
+    c.execute(f"SELECT section, count FROM library_counts WHERE user_id = {ph}", (user_id,))
+    counts = {section: 0 for section in _LIBRARY_SECTIONS}
+    for row in c.fetchall():
+        counts[row_pick(row, 'section', 0)] = int(row_pick(row, 'count', 1) or 0)
+    return counts
+
+def _library_collections(c, db_type, user_id):
+    """Collection summaries (no verses) for one user."""
+    ph = '%s' if db_type == 'postgres' else '?'
+    c.execute(f"""
+        SELECT col.id, col.name, col.color, COUNT(vc.verse_id) AS count
+        FROM collections col
+        LEFT JOIN verse_collections vc ON col.id = vc.collection_id
+        WHERE col.user_id = {ph}
+        GROUP BY col.id, col.name, col.color
+        ORDER BY col.id
+    """, (user_id,))
+    return [{
+        "id": int(row_pick(row, 'id', 0)),
+        "name": row_pick(row, 'name', 1),
+        "color": row_pick(row, 'color', 2),
+        "count": int(row_pick(row, 'count', 3) or 0)
+    } for row in c.fetchall()]
+
+def _library_ndjson(user_id):
+    """Every library row as one JSON object per line, read page by page."""
+    conn, db_type = get_db()
+    try:
+        c = get_cursor(conn, db_type)
+        yield json.dumps({"section": "counts", **_library_counts(c, db_type, user_id)}) + "\n"
+        for section in _LIBRARY_SECTIONS:
+            cursor = None
+            while True:
+                items, cursor = _library_section_page(c, db_type, user_id, section, LIBRARY_PAGE_MAX, cursor)
+                yield "".join(json.dumps({"section": section, **item}) + "\n" for item in items)
+                if not cursor:
+                    break
+        for collection in _library_collections(c, db_type, user_id):
+            yield json.dumps({"section": "collection", **collection}) + "\n"
+            cursor = None
+            while True:
+                items, cursor = _library_section_page(
+                    c, db_type, user_id, 'collection', LIBRARY_PAGE_MAX, cursor, collection_id=collection["id"]
+                )
+                yield "".join(
+                    json.dumps({"section": "collection_verse", "collection_id": collection["id"], **item}) + "\n"
+                    for item in items
+                )
+                if not cursor:
+                    break
+    finally:
+        conn.close()
+
 @app.route('/api/library')
 def get_library():
+    """Liked/saved verses newest first, one keyset page per section.
+
+    ?section=liked|saved|collection (with collection_id) returns a single section's
+    page; follow next_cursor with ?cursor=. Without section the first page of liked
+    and saved comes back with counts and collection summaries. ?format=ndjson
+    streams the whole library instead.
+    """
     if 'user_id' not in session:
         return jsonify({"liked": [], "saved": [], "collections": []})
     
     is_banned, _, _ = check_ban_status(session['user_id'])
     if is_banned:
         return jsonify({"error": "banned"}), 403
-    
+
+    user_id = session['user_id']
+    if (request.args.get('format') or '').lower() == 'ndjson':
+        return Response(stream_with_context(_library_ndjson(user_id)), mimetype='application/x-ndjson')
+
+    section = (request.args.get('section') or '').strip().lower()
+    limit = max(1, min(LIBRARY_PAGE_MAX, request.args.get('limit', LIBRARY_PAGE_SIZE, type=int) or LIBRARY_PAGE_SIZE))
     conn, db_type = get_db()
     c = get_cursor(conn, db_type)
-    
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, l.timestamp as liked_at
-                FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = %s 
-                ORDER BY l.timestamp DESC
-            """, (session['user_id'],))
-            liked = [{"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                      "source": row['source'], "book": row['book'], "liked_at": row['liked_at'], "saved_at": None} for row in c.fetchall()]
-            
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, s.timestamp as saved_at
-                FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = %s 
-                ORDER BY s.timestamp DESC
-            """, (session['user_id'],))
-            saved = [{"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                      "source": row['source'], "book": row['book'], "liked_at": None, "saved_at": row['saved_at']} for row in c.fetchall()]
-            
-            # GET COLLECTIONS
-            c.execute("""
-                SELECT c.id, c.name, c.color, COUNT(vc.verse_id) as count 
-                FROM collections c
-                LEFT JOIN verse_collections vc ON c.id = vc.collection_id
-                WHERE c.user_id = %s
-                GROUP BY c.id
-            """, (session['user_id'],))
-        else:
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, l.timestamp as liked_at
-                FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = ? 
-                ORDER BY l.timestamp DESC
-            """, (session['user_id'],))
-            rows = c.fetchall()
-            liked = []
-            for row in rows:
-                try:
-                    liked.append({"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                              "source": row['source'], "book": row['book'], "liked_at": row['liked_at'], "saved_at": None})
-                except (TypeError, KeyError):
-                    liked.append({"id": row[0], "ref": row[1], "text": row[2], "trans": row[3], 
-                              "source": row[4], "book": row[6], "liked_at": row[7], "saved_at": None})
-            
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, s.timestamp as saved_at
-                FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = ? 
-                ORDER BY s.timestamp DESC
-            """, (session['user_id'],))
-            rows = c.fetchall()
-            saved = []
-            for row in rows:
-                try:
-                    saved.append({"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                              "source": row['source'], "book": row['book'], "liked_at": None, "saved_at": row['saved_at']})
-                except (TypeError, KeyError):
-                    saved.append({"id": row[0], "ref": row[1], "text": row[2], "trans": row[3], 
-                              "source": row[4], "book": row[6], "liked_at": None, "saved_at": row[7]})
-            
-            # GET COLLECTIONS
-            c.execute("""
-                SELECT c.id, c.name, c.color, COUNT(vc.verse_id) as count 
-                FROM collections c
-                LEFT JOIN verse_collections vc ON c.id = vc.collection_id
-                WHERE c.user_id = ?
-                GROUP BY c.id
-            """, (session['user_id'],))
-        
-        # Build collections list with verses (bulk-loaded to avoid N+1 queries).
-        collection_rows = c.fetchall()
-        collections = []
-        collection_lookup = {}
-        collection_ids = []
-        for row in collection_rows:
-            try:
-                col_id = int(row['id'])
-                col_name = row['name']
-                col_color = row['color']
-                col_count = row['count']
-            except (TypeError, KeyError):
-                col_id = int(row[0])
-                col_name = row[1]
-                col_color = row[2]
-                col_count = row[3]
-            item = {
-                "id": col_id,
-                "name": col_name,
-                "color": col_color,
-                "count": col_count,
-                "verses": []
-            }
-            collections.append(item)
-            collection_lookup[col_id] = item
-            collection_ids.append(col_id)
-
-        ids_sql, ids_params = _build_in_clause_params(db_type, collection_ids)
-        if ids_sql:
-            if db_type == 'postgres':
-                c.execute(f"""
-                    SELECT vc.collection_id, v.id, v.reference, v.text
-                    FROM verse_collections vc
-                    JOIN verses v ON v.id = vc.verse_id
-                    WHERE vc.collection_id IN ({ids_sql})
-                """, ids_params)
-            else:
-                c.execute(f"""
-                    SELECT vc.collection_id, v.id, v.reference, v.text
-                    FROM verse_collections vc
-                    JOIN verses v ON v.id = vc.verse_id
-                    WHERE vc.collection_id IN ({ids_sql})
-                """, ids_params)
-            for v in c.fetchall():
-                try:
-                    collection_id = int(v['collection_id'])
-                    verse_payload = {"id": v['id'], "ref": v['reference'], "text": v['text']}
-                except Exception:
-                    collection_id = int(v[0])
-                    verse_payload = {"id": v[1], "ref": v[2], "text": v[3]}
-                bucket = collection_lookup.get(collection_id)
-                if bucket is not None:
-                    bucket["verses"].append(verse_payload)
-        
-        favorites = next((c for c in collections if (c.get("name") or "").lower() == "favorites"), None)
-        return jsonify({
-            "liked": liked,
-            "saved": saved,
+        if section:
+            collection_id = request.args.get('collection_id', type=int)
+            if section not in _LIBRARY_SECTIONS and not (section == 'collection' and collection_id):
+                return jsonify({"error": "invalid_section"}), 400
+            items, next_cursor = _library_section_page(
+                c, db_type, user_id, section, limit, request.args.get('cursor'), collection_id=collection_id
+            )
+            return jsonify({"section": section, "items": items, "next_cursor": next_cursor})
+
+        payload = {}
+        next_cursors = {}
+        for name in _LIBRARY_SECTIONS:
+            payload[name], next_cursors[name] = _library_section_page(c, db_type, user_id, name, limit)
+        counts = _library_counts(c, db_type, user_id)
+        collections = _library_collections(c, db_type, user_id)
+        favorites = next((col for col in collections if (col.get("name") or "").lower() == "favorites"), None)
+        payload.update({
+            "next_cursors": next_cursors,
             "collections": collections,
-            "liked_count": len(liked),
-            "saved_count": len(saved),
-            "favorites_count": len(favorites.get("verses", [])) if favorites else 0
+            "liked_count": counts["liked"],
+            "saved_count": counts["saved"],
+            "favorites_count": favorites["count"] if favorites else 0
         })
+        return jsonify(payload)
+    except ValueError:
+        return jsonify({"error": "invalid_cursor"}), 400
     except Exception as e:
         logger.error(f"Library error: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
+@app.route('/api/library/collections')
+def get_library_collections():
+    if 'user_id' not in session:
+        return jsonify({"collections": []})
+
+    is_banned, _, _ = check_ban_status(session['user_id'])
+    if is_banned:
+        return jsonify({"error": "banned"}), 403
+
+    conn, db_type = get_db()
+    c = get_cursor(conn, db_type)
+    try:
+        return jsonify({"collections": _library_collections(c, db_type, session['user_id'])})
+    except Exception as e:
+        logger.error(f"Library collections error: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
 @app.route('/api/library/search')
 def search_library_verses():
+    """Verses whose book or reference matches q, filtered, sorted and keyset-paginated in SQL.
+
+    Candidates come from the full-text title index when it exists; the LIKE on
+    book_key/ref_key then applies the exact title match.
+
+    Sorts: canonical/book (book_ord, chapter_num, verse_num), newest, oldest, az;
+    every order ends in v.id so next_cursor can resume it. total is only computed
+    for the first page.
+    """
     raw_query = (request.args.get('q') or '').strip()
     if not raw_query:
         return jsonify({"query": "", "verses": [], "count": 0})
@@ -8460,13 +11550,6 @@ def search_library_verses():
 
     query = raw_query[:80]
     query_key = _normalize_bible_book_name(query)
-    query_lower = query.lower()
-    hint_lower = re.sub(r'^(?:1|2|3)\s*', '', query_lower).strip()
-    hint_lower = re.sub(r'^(?:first|second|third)\s+', '', hint_lower).strip()
-    if not hint_lower:
-        hint_lower = query_lower
-    like_query = f"%{query_lower}%"
-    like_hint = f"%{hint_lower}%"
 
     filter_book = (request.args.get('book') or '').strip()
     filter_chapter = (request.args.get('chapter') or '').strip()
@@ -8475,152 +11558,124 @@ def search_library_verses():
     filter_date_from = (request.args.get('date_from') or '').strip()
     filter_date_to = (request.args.get('date_to') or '').strip()
     sort_mode = (request.args.get('sort') or 'canonical').strip().lower()
+    limit = max(1, min(LIBRARY_PAGE_MAX, request.args.get('limit', LIBRARY_SEARCH_PAGE_SIZE, type=int) or LIBRARY_SEARCH_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    filters = {
+        "book": filter_book,
+        "chapter": filter_chapter,
+        "status": filter_status,
+        "translation": filter_translation,
+        "date_from": filter_date_from,
+        "date_to": filter_date_to,
+        "sort": sort_mode
+    }
+    if not query_key:
+        return jsonify({"query": query, "filters": filters, "verses": [], "count": 0, "total": 0, "next_cursor": None})
+
+    if sort_mode in ('newest', 'oldest'):
+        sort_columns, descending = ["COALESCE(v.timestamp, '')", "v.id"], sort_mode == 'newest'
+    elif sort_mode == 'az':
+        sort_columns, descending = ["LOWER(COALESCE(v.reference, ''))", "v.id"], False
+    else:
+        sort_columns, descending = ["v.book_ord", "v.chapter_num", "v.verse_num", "v.id"], False
 
     conn, db_type = get_db()
+    ph = '%s' if db_type == 'postgres' else '?'
     c = get_cursor(conn, db_type)
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT
-                    v.id,
-                    v.reference,
-                    v.text,
-                    v.translation,
-                    v.source,
-                    v.book,
-                    v.timestamp,
-                    (SELECT MAX(l.timestamp) FROM likes l WHERE l.verse_id = v.id AND l.user_id = %s) AS liked_at,
-                    (SELECT MAX(s.timestamp) FROM saves s WHERE s.verse_id = v.id AND s.user_id = %s) AS saved_at
-                FROM verses v
-                WHERE LOWER(COALESCE(v.book, '')) LIKE %s
-                   OR LOWER(COALESCE(v.reference, '')) LIKE %s
-                   OR LOWER(COALESCE(v.book, '')) LIKE %s
-                   OR LOWER(COALESCE(v.reference, '')) LIKE %s
-                LIMIT 500
-            """, (session['user_id'], session['user_id'], like_query, like_query, like_hint, like_hint))
-        else:
-            c.execute("""
-                SELECT
-                    v.id,
-                    v.reference,
-                    v.text,
-                    v.translation,
-                    v.source,
-                    v.book,
-                    v.timestamp,
-                    (SELECT MAX(l.timestamp) FROM likes l WHERE l.verse_id = v.id AND l.user_id = ?) AS liked_at,
-                    (SELECT MAX(s.timestamp) FROM saves s WHERE s.verse_id = v.id AND s.user_id = ?) AS saved_at
-                FROM verses v
-                WHERE LOWER(IFNULL(v.book, '')) LIKE ?
-                   OR LOWER(IFNULL(v.reference, '')) LIKE ?
-                   OR LOWER(IFNULL(v.book, '')) LIKE ?
-                   OR LOWER(IFNULL(v.reference, '')) LIKE ?
-                LIMIT 500
-            """, (session['user_id'], session['user_id'], like_query, like_query, like_hint, like_hint))
-
-        verses = []
-        for row in c.fetchall():
-            try:
-                entry = {
-                    "id": row['id'],
-                    "ref": row['reference'],
-                    "text": row['text'],
-                    "trans": row['translation'],
-                    "source": row['source'],
-                    "book": row['book'],
-                    "timestamp": row_value(row, 'timestamp'),
-                    "liked_at": row['liked_at'],
-                    "saved_at": row['saved_at']
-                }
-            except (TypeError, KeyError):
-                entry = {
-                    "id": row[0],
-                    "ref": row[1],
-                    "text": row[2],
-                    "trans": row[3],
-                    "source": row[4],
-                    "book": row[5],
-                    "timestamp": row[6],
-                    "liked_at": row[7],
-                    "saved_at": row[8]
-                }
-            entry["is_active"] = bool(entry.get("liked_at"))
-            entry["is_stored"] = bool(entry.get("saved_at"))
-            verses.append(entry)
-
-        filtered = [v for v in verses if _verse_matches_title_query(v, query_key)]
-
+        user_id = session['user_id']
+        where = [f"(v.book_key LIKE {ph} OR v.ref_key LIKE {ph})"]
+        params = [f"%{query_key}%", f"%{query_key}%"]
+        # The title index narrows the candidates so the substring LIKE only runs on those rows.
+        title_match = verse_title_match_sql(conn, db_type, parse_verse_search(query, prefix_words=True))
+        if title_match:
+            where.insert(0, title_match[0])
+            params[:0] = title_match[1]
         if filter_book:
-            book_key = _normalize_bible_book_name(filter_book)
-            filtered = [
-                v for v in filtered
-                if _normalize_bible_book_name(v.get("book") or _extract_book_from_reference(v.get("ref"))) == book_key
-            ]
-
+            where.append(f"v.book_key = {ph}")
+            params.append(_canonical_book_key(filter_book))
         if filter_chapter.isdigit():
-            chapter_value = int(filter_chapter)
-            filtered = [v for v in filtered if _parse_reference_chapter(v.get("ref"))[0] == chapter_value]
-
-        if filter_status in ('active', 'stored'):
-            if filter_status == 'active':
-                filtered = [v for v in filtered if bool(v.get("liked_at"))]
-            else:
-                filtered = [v for v in filtered if bool(v.get("saved_at"))]
-
+            where.append(f"v.chapter_num = {ph}")
+            params.append(int(filter_chapter))
+        if filter_status == 'active':
+            where.append("l.id IS NOT NULL")
+        elif filter_status == 'stored':
+            where.append("s.id IS NOT NULL")
         if filter_translation:
-            filtered = [
-                v for v in filtered
-                if str(v.get("trans") or "").strip().lower() == filter_translation
-            ]
-
+            where.append(f"LOWER(TRIM(COALESCE(v.translation, ''))) = {ph}")
+            params.append(filter_translation)
         if filter_date_from:
-            filtered = [v for v in filtered if str(v.get("timestamp") or "") >= filter_date_from]
-
+            where.append(f"v.timestamp >= {ph}")
+            params.append(filter_date_from)
         if filter_date_to:
-            filtered = [v for v in filtered if str(v.get("timestamp") or "") <= filter_date_to]
-
-        deduped = []
-        seen_ids = set()
-        seen_content = set()
-        for verse in filtered:
-            verse_id = verse.get("id")
-            if verse_id in seen_ids:
-                continue
-            content_key = (
-                _normalize_bible_book_name(verse.get("ref")),
-                _normalize_mem_text(verse.get("text"))
+            where.append(f"v.timestamp <= {ph}")
+            params.append(filter_date_to)
+        # likes/saves are UNIQUE(user_id, verse_id), so these joins never fan out.
+        from_sql = f"""
+            FROM verses v
+            LEFT JOIN likes l ON l.verse_id = v.id AND l.user_id = {ph}
+            LEFT JOIN saves s ON s.verse_id = v.id AND s.user_id = {ph}
+        """
+        join_params = [user_id, user_id]
+
+        total = None
+        if not cursor:
+            c.execute(f"SELECT COUNT(*) AS count {from_sql} WHERE {' AND '.join(where)}", join_params + params)
+            total = int(row_pick(c.fetchone(), 'count', 0) or 0)
+
+        page_where = list(where)
+        page_params = list(params)
+        if cursor:
+            after = _decode_library_cursor(cursor, size=len(sort_columns))
+            page_where.append(
+                f"({', '.join(sort_columns)}) {'<' if descending else '>'} ({', '.join([ph] * len(sort_columns))})"
             )
-            if content_key in seen_content:
-                continue
-            seen_ids.add(verse_id)
-            seen_content.add(content_key)
-            deduped.append(verse)
+            page_params.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        sort_select = ", ".join(f"{column} AS sort_{i}" for i, column in enumerate(sort_columns))
+        c.execute(f"""
+            SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, v.timestamp,
+                   l.timestamp AS liked_at, s.timestamp AS saved_at, {sort_select}
+            {from_sql}
+            WHERE {' AND '.join(page_where)}
+            ORDER BY {', '.join(f'{column} {direction}' for column in sort_columns)}
+            LIMIT {ph}
+        """, join_params + page_params + [limit + 1])
+        rows = c.fetchall()
 
-        if sort_mode == 'newest':
-            deduped.sort(key=lambda v: str(v.get("timestamp") or ''), reverse=True)
-        elif sort_mode == 'oldest':
-            deduped.sort(key=lambda v: str(v.get("timestamp") or ''))
-        elif sort_mode == 'az':
-            deduped.sort(key=lambda v: str(v.get("ref") or '').lower())
-        elif sort_mode == 'book':
-            deduped.sort(key=_library_verse_sort_key)
-        else:
-            deduped.sort(key=_library_verse_sort_key)
+        verses = []
+        for row in rows[:limit]:
+            entry = {
+                "id": row_pick(row, 'id', 0),
+                "ref": row_pick(row, 'reference', 1),
+                "text": row_pick(row, 'text', 2),
+                "trans": row_pick(row, 'translation', 3),
+                "source": row_pick(row, 'source', 4),
+                "book": row_pick(row, 'book', 5),
+                "timestamp": row_pick(row, 'timestamp', 6),
+                "liked_at": row_pick(row, 'liked_at', 7),
+                "saved_at": row_pick(row, 'saved_at', 8)
+            }
+            entry["is_active"] = bool(entry.get("liked_at"))
+            entry["is_stored"] = bool(entry.get("saved_at"))
+            verses.append(entry)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = _encode_library_cursor(
+                *[row_pick(last, f'sort_{i}', 9 + i) for i in range(len(sort_columns))]
+            )
 
         return jsonify({
             "query": query,
-            "filters": {
-                "book": filter_book,
-                "chapter": filter_chapter,
-                "status": filter_status,
-                "translation": filter_translation,
-                "date_from": filter_date_from,
-                "date_to": filter_date_to,
-                "sort": sort_mode
-            },
-            "verses": deduped,
-            "count": len(deduped)
+            "filters": filters,
+            "verses": verses,
+            "count": len(verses),
+            "total": total,
+            "next_cursor": next_cursor
         })
+    except ValueError:
+        return jsonify({"error": "invalid_cursor"}), 400
     except Exception as e:
         logger.error(f"Library search error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -8705,7 +11760,6 @@ def reading_plan():
                 """)
                 raw_verses = c.fetchall()
                 verses = []
-                seen = set()
                 for row in raw_verses:
                     item = {
                         "id": row_pick(row, 'id', 0),
@@ -8716,13 +11770,6 @@ def reading_plan():
                         "timestamp": row_pick(row, 'timestamp', 5),
                         "book": row_pick(row, 'book', 6)
                     }
-                    content_key = (
-                        _normalize_bible_book_name(item.get("ref")),
-                        _normalize_mem_text(item.get("text"))
-                    )
-                    if content_key in seen:
-                        continue
-                    seen.add(content_key)
                     verses.append(item)
                 verses.sort(key=_library_verse_sort_key)
 
@@ -9110,7 +12157,6 @@ def study_pack_export():
             highlight_rows = c.fetchall()
 
         library_items = []
-        seen = set()
         for row in library_rows:
             item = {
                 "id": row_pick(row, 'id', 0),
@@ -9120,10 +12166,6 @@ def study_pack_export():
                 "source": row_pick(row, 'source', 4),
                 "book": row_pick(row, 'book', 5),
             }
-            key = (_normalize_bible_book_name(item["ref"]), _normalize_mem_text(item["text"]))
-            if key in seen:
-                continue
-            seen.add(key)
             library_items.append(item)
         library_items.sort(key=_library_verse_sort_key)
 
@@ -9199,20 +12241,41 @@ def realtime_stream():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
     user_id = int(session['user_id'])
-    mailbox = _realtime_subscribe(user_id)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except (TypeError, ValueError):
+        last_event_id = 0
+    mailbox, high_water = _realtime_subscribe(user_id)
+    backlog, replay_gap = ([], False)
+    if last_event_id > 0:
+        backlog, replay_gap = _REALTIME_BROKER.replay(user_id, last_event_id, high_water)
 
     @stream_with_context
     def _event_stream():
         deadline = time.time() + REALTIME_STREAM_MAX_SECONDS
+        last_sent = max(last_event_id, 0)
         try:
             yield "retry: 2500\n"
-            yield f"data: {json.dumps({'event': 'hello', 'payload': {'user_id': user_id}, 'ts': datetime.now().isoformat()})}\n\n"
+            for packet in backlog:
+                last_sent = max(last_sent, packet['id'])
+                yield _realtime_frame(packet)
+            # The hello frame carries the current position so a reconnect resumes from here.
+            hello = {'event': 'hello', 'payload': {'user_id': user_id, 'replay_gap': replay_gap}, 'ts': datetime.now().isoformat()}
+            if high_water > last_sent:
+                hello['id'] = high_water
+            yield _realtime_frame(hello)
+            last_sent = max(last_sent, high_water)
             while time.time() < deadline:
                 remaining = max(0.25, deadline - time.time())
                 wait_for = min(float(REALTIME_HEARTBEAT_SECONDS), remaining)
                 try:
                     packet = mailbox.get(timeout=wait_for)
-                    yield f"data: {json.dumps(packet)}\n\n"
+                    event_id = packet.get('id')
+                    if event_id is not None:
+                        if event_id <= last_sent:
+                            continue
+                        last_sent = event_id
+                    yield _realtime_frame(packet)
                 except queue.Empty:
                     # Keep chunks flowing frequently so upstream worker watchdogs do not treat the request as stalled.
                     yield f": keepalive {int(time.time())}\n\n"
@@ -10405,52 +13468,64 @@ def semantic_search():
     if len(q) < 2:
         return jsonify({"results": [], "count": 0})
     limit = max(1, min(120, int(request.args.get('limit', 40))))
+    mode = (request.args.get('mode') or 'token').strip().lower()
     uid = int(session['user_id'])
-    cache_key = f"semantic:{uid}:{q.lower()}:{limit}"
-    cached = _api_cache_get(cache_key)
+    cache_key = f"semantic:{uid}:{mode}:{q.lower()}:{limit}"
+    cached = _api_cache_response(cache_key)
     if cached is not None:
-        return jsonify(cached)
+        return cached
+
+    if mode == 'vector' and _VECTOR_INDEX is not None:
+        _ensure_batch_jobs()
+        hits = _VECTOR_INDEX.search(q, limit)
+        if hits:
+            payload = {"results": _vector_hit_verses(hits), "count": len(hits), "query": q, "mode": "vector"}
+            _api_cache_set(cache_key, payload, ttl=8)
+            return jsonify(payload)
+        # No published index yet: answer from the token index below.
 
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        tokens = [t for t in _normalize_mem_text(q).split() if t]
+        phrase = _normalize_mem_text(q)
+        tokens = [t for t in phrase.split() if t]
         for topic, words in RESEARCH_TOPIC_MAP.items():
             if topic in q.lower() or any(t in topic for t in tokens):
-                tokens.extend(words)
+                for word in words:
+                    tokens.extend(_normalize_mem_text(word).split())
         tokens = list(dict.fromkeys([t for t in tokens if t]))
         if not tokens:
             return jsonify({"results": [], "count": 0})
 
-        c.execute("""
-            SELECT id, reference, text, translation, source, timestamp, book
-            FROM verses
-            ORDER BY id DESC
-            LIMIT 3000
-        """)
-        scored = []
-        for row in c.fetchall():
-            verse = {
-                "id": row_pick(row, 'id', 0),
-                "ref": row_pick(row, 'reference', 1),
-                "text": row_pick(row, 'text', 2) or '',
-                "trans": row_pick(row, 'translation', 3),
-                "source": row_pick(row, 'source', 4),
-                "timestamp": row_pick(row, 'timestamp', 5),
-                "book": row_pick(row, 'book', 6)
-            }
-            score = _semantic_score_verse(tokens, verse)
-            if score >= 0.08:
-                verse["score"] = score
-                scored.append(verse)
-        scored.sort(key=lambda v: (v.get("score", 0), str(v.get("timestamp") or "")), reverse=True)
-        payload = {"results": scored[:limit], "count": len(scored), "query": q}
+        _SEMANTIC_INDEX.ensure_fresh()
+        results, count = _SEMANTIC_INDEX.search(tokens, phrase, limit)
+        payload = {"results": results, "count": count, "query": q, "mode": "token"}
         _api_cache_set(cache_key, payload, ttl=8)
         return jsonify(payload)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+def _vector_hit_verses(hits):
+    """Verse rows for [(id, score)] in hit order."""
+    ids = [verse_id for verse_id, _ in hits]
+    conn, db_type = get_db()
+    try:
+        c = get_cursor(conn, db_type)
+        if db_type == 'postgres':
+            c.execute("SELECT id, reference, text, translation, source, timestamp, book FROM verses WHERE id = ANY(%s)", (ids,))
+        else:
+            c.execute(f"SELECT id, reference, text, translation, source, timestamp, book FROM verses WHERE id IN ({','.join('?' for _ in ids)})", ids)
+        by_id = {}
+        for row in c.fetchall():
+            verse = VerseSearchIndex._row_verse(row)
+            by_id[verse["id"]] = verse
     finally:
         conn.close()
+    verses = []
+    for verse_id, score in hits:
+        verse = by_id.get(verse_id)
+        if verse is not None:
+            verse["score"] = round(score, 6)
+            verses.append(verse)
+    return verses
 
 @app.route('/api/admin/data-health')
 def admin_data_health():
@@ -10538,7 +13613,7 @@ def admin_data_health_repair():
     try:
         ensure_research_feature_tables(c, db_type)
         conn.commit()
-        deduped_count = _dedupe_verses_in_db(c, db_type)
+        deduped_count = backfill_verse_content_hashes(conn, c, db_type)
         orphan = _remove_orphan_verse_refs(c, db_type)
         conn.commit()
         return jsonify({
@@ -10628,9 +13703,9 @@ def community_room_messages(slug):
             publish_realtime_event(None, "community_room_new", {"room": room_slug})
             _api_cache_invalidate_prefixes("community_room:", "community:", "recent_users:")
         else:
-            cached = _api_cache_get(cache_key)
+            cached = _api_cache_response(cache_key)
             if cached is not None:
-                return jsonify(cached)
+                return cached
 
         c.execute("""
             SELECT m.id, m.room_slug, m.user_id, m.text, m.timestamp, m.google_name, m.google_picture,
@@ -10780,10 +13855,8 @@ def get_recommendations():
     if is_banned:
         return jsonify({"error": "banned"}), 403
     
-    rec = generator.generate_smart_recommendation(session['user_id'])
-    if rec:
-        return jsonify({"recommendations": [rec]})
-    return jsonify({"recommendations": []})
+    count = request.args.get('count', 1, type=int) or 1
+    return jsonify({"recommendations": generator.generate_smart_recommendations(session['user_id'], count)})
 
 @app.route('/api/mood/<mood>')
 def get_mood_recommendation(mood):
@@ -10807,7 +13880,14 @@ def get_mood_recommendation(mood):
                 exclude_ids.append(int(raw))
         exclude_ids = list(dict.fromkeys(exclude_ids))
         row = None
-        if keywords:
+        ids = search_verse_ids(conn, db_type, keyword_search_groups(keywords), 1, exclude_ids=exclude_ids, random_order=True) if keywords else None
+        if ids:
+            if db_type == 'postgres':
+                c.execute("SELECT id, reference, text, translation, book FROM verses WHERE id = %s", (ids[0],))
+            else:
+                c.execute("SELECT id, reference, text, translation, book FROM verses WHERE id = ?", (ids[0],))
+            row = c.fetchone()
+        elif keywords and ids is None:
             if db_type == 'postgres':
                 clauses = " OR ".join(["text ILIKE %s"] * len(keywords))
                 params = [f"%{k}%" for k in keywords]
@@ -11055,6 +14135,13 @@ def db_status():
             "counts": counts
         }
         conn.close()
+        info["pool"] = get_db_pool_stats()
+        info["api_cache"] = get_api_cache_stats()
+        info["realtime"] = _REALTIME_BROKER.stats()
+        info["semantic_index"] = _SEMANTIC_INDEX.stats()
+        info["recommendation_pools"] = _RECOMMENDER.stats()
+        info["vector_index"] = _VECTOR_INDEX.stats() if _VECTOR_INDEX is not None else None
+        info["verse_neighbors"] = _VERSE_NEIGHBORS.stats() if _VERSE_NEIGHBORS is not None else None
         return jsonify(info)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -11266,57 +14353,7 @@ def log_user_activity(action, user_id=None, message=None, extras=None):
         }
         activity_details_json = json.dumps(activity_details, ensure_ascii=False)
         
-        # Ensure tables exist
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id SERIAL PRIMARY KEY,
-                    admin_id TEXT,
-                    action TEXT,
-                    target_user_id INTEGER,
-                    details TEXT,
-                    ip_address TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    google_id TEXT,
-                    email TEXT,
-                    action TEXT NOT NULL,
-                    details TEXT,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    admin_id TEXT,
-                    action TEXT,
-                    target_user_id INTEGER,
-                    details TEXT,
-                    ip_address TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    google_id TEXT,
-                    email TEXT,
-                    action TEXT NOT NULL,
-                    details TEXT,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        ensure_activity_log_tables(c, db_type)
         
         admin_id = str(user_id) if user_id is not None else "system"
         
@@ -11377,32 +14414,7 @@ def ensure_verse_id(c, db_type, verse_id, verse_payload=None):
     now = datetime.now().isoformat()
 
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM verses WHERE reference = %s AND text = %s", (ref, text))
-        else:
-            c.execute("SELECT id FROM verses WHERE reference = ? AND text = ?", (ref, text))
-        row = c.fetchone()
-        if row:
-            return row['id'] if hasattr(row, 'keys') else row[0]
-    except Exception:
-        pass
-
-    try:
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO verses (reference, text, translation, source, timestamp, book)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (ref, text, trans, source, now, book))
-            c.execute("SELECT id FROM verses WHERE reference = %s AND text = %s", (ref, text))
-        else:
-            c.execute("""
-                INSERT INTO verses (reference, text, translation, source, timestamp, book)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (ref, text, trans, source, now, book))
-            c.execute("SELECT id FROM verses WHERE reference = ? AND text = ?", (ref, text))
-        row = c.fetchone()
-        if row:
-            return row['id'] if hasattr(row, 'keys') else row[0]
+        return insert_verse_row(c, db_type, ref, text, trans, source, now, book)
     except Exception:
         pass
     return verse_id
@@ -11418,9 +14430,13 @@ def generate_rec():
     
     payload = request.get_json(silent=True) or {}
     exclude_ids = payload.get('exclude_ids') if isinstance(payload, dict) else None
-    rec = generator.generate_smart_recommendation(session['user_id'], exclude_ids=exclude_ids)
-    if rec:
-        return jsonify({"success": True, "recommendation": rec})
+    try:
+        count = int(payload.get('count') or 1) if isinstance(payload, dict) else 1
+    except (TypeError, ValueError):
+        count = 1
+    recs = generator.generate_smart_recommendations(session['user_id'], count, exclude_ids=exclude_ids)
+    if recs:
+        return jsonify({"success": True, "recommendation": recs[0], "recommendations": recs})
     return jsonify({"success": False})
 
 @app.route('/api/comments/<int:verse_id>')
@@ -11437,9 +14453,9 @@ def get_comments(verse_id):
         if viewer_id:
             hidden_public_users = get_user_safety_filters(c, db_type, viewer_id)["hidden_public_users"]
         cache_key = f"comments:{int(viewer_id or 0)}:{int(verse_id)}"
-        cached = _api_cache_get(cache_key)
+        cached = _api_cache_response(cache_key)
         if cached is not None:
-            return jsonify(cached)
+            return cached
 
         if db_type == 'postgres':
             c.execute("""
@@ -11515,6 +14531,7 @@ def get_comments(verse_id):
             })
             comment_ids.append(int(comment_id))
 
+        equipped_cache.update(get_equipped_items_for_users(c, db_type, [item["user_id"] for item in prepared]))
         reactions_map = get_reaction_counts_bulk(c, db_type, "comment", comment_ids)
         replies_map = get_replies_for_parents(
             c,
@@ -11710,9 +14727,9 @@ def get_community_messages():
 
         room_slug = (request.args.get('room') or '').strip().lower()
         cache_key = f"community:{int(viewer_id or 0)}:{room_slug or 'general'}"
-        cached = _api_cache_get(cache_key)
+        cached = _api_cache_response(cache_key)
         if cached is not None:
-            return jsonify(cached)
+            return cached
         if room_slug and room_slug != 'general':
             ensure_research_feature_tables(c, db_type)
             conn.commit()
@@ -11838,6 +14855,7 @@ def get_community_messages():
             })
             msg_ids.append(int(msg_id))
 
+        equipped_cache.update(get_equipped_items_for_users(c, db_type, [item["user_id"] for item in prepared]))
         reactions_map = get_reaction_counts_bulk(c, db_type, "community", msg_ids)
         replies_map = get_replies_for_parents(
             c,
@@ -12063,9 +15081,9 @@ def recent_users():
         limit = max(1, min(12, int(request.args.get('limit', 8))))
         uid = session['user_id']
         cache_key = f"recent_users:{int(uid)}:{limit}"
-        cached = _api_cache_get(cache_key)
+        cached = _api_cache_response(cache_key)
         if cached is not None:
-            return jsonify(cached)
+            return cached
         hidden_users = get_user_safety_filters(c, db_type, uid)["hidden_dm_users"]
         if db_type == 'postgres':
             c.execute("""
@@ -12456,9 +15474,9 @@ def safety_my_reports():
     uid = int(session['user_id'])
     limit = max(1, min(200, int(request.args.get('limit', 50))))
     cache_key = f"safety_reports:{uid}:{limit}"
-    cached = _api_cache_get(cache_key)
+    cached = _api_cache_response(cache_key)
     if cached is not None:
-        return jsonify(cached)
+        return cached
 
     conn, db_type = get_db()
     c = get_cursor(conn, db_type)
@@ -13494,95 +16512,28 @@ def get_saved_verses():
 def presence_ping():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
-    conn = None
     try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INTEGER PRIMARY KEY,
-                last_seen TEXT,
-                last_path TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        now_iso = datetime.now().isoformat()
         path = request.json.get('path') if request.is_json else request.path
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    last_seen = EXCLUDED.last_seen,
-                    last_path = EXCLUDED.last_path,
-                    updated_at = EXCLUDED.updated_at
-            """, (session['user_id'], now_iso, path, now_iso))
-        else:
-            c.execute("""
-                INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET
-                    last_seen = excluded.last_seen,
-                    last_path = excluded.last_path,
-                    updated_at = excluded.updated_at
-            """, (session['user_id'], now_iso, path, now_iso))
-        conn.commit()
-        conn.close()
+        record_presence(session['user_id'], path)
         return jsonify({"success": True})
     except Exception as e:
         logger.error(f"Presence ping error: {e}")
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/presence/online')
 def presence_online():
     if 'user_id' not in session:
         return jsonify({"count": 0}), 401
-    conn = None
     try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INTEGER PRIMARY KEY,
-                last_seen TEXT,
-                last_path TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        if db_type == 'postgres':
-            c.execute("SELECT user_id, last_seen FROM user_presence")
-            rows = c.fetchall()
-        else:
-            c.execute("SELECT user_id, last_seen FROM user_presence")
-            rows = c.fetchall()
-
-        now = datetime.now()
-        window = now - timedelta(minutes=3)
-        count = 0
-        for row in rows:
-            try:
-                last_seen = row['last_seen'] if isinstance(row, dict) or hasattr(row, 'keys') else row[1]
-                if not last_seen:
-                    continue
-                last_dt = datetime.fromisoformat(str(last_seen))
-                if last_dt >= window:
-                    count += 1
-            except Exception:
-                continue
-        conn.close()
-        return jsonify({"count": count})
+        window = (request.args.get('window') or '').strip().lower()
+        if window == 'all':
+            windows = count_online_windows()
+            return jsonify({"count": windows["5m"], "windows": windows})
+        if window in PRESENCE_WINDOWS:
+            return jsonify({"count": count_online_users(PRESENCE_WINDOWS[window]), "window": window})
+        return jsonify({"count": count_online_users(180)})
     except Exception as e:
         logger.error(f"Presence online error: {e}")
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
         return jsonify({"count": 0}), 500
 
 @app.route('/api/notifications')
@@ -13592,9 +16543,9 @@ def get_notifications():
     conn = None
     uid = int(session['user_id'])
     cache_key = f"notifications:{uid}:list"
-    cached = _api_cache_get(cache_key)
+    cached = _api_cache_response(cache_key)
     if cached is not None:
-        return jsonify(cached)
+        return cached
     try:
         conn, db_type = get_db()
         c = get_cursor(conn, db_type)
@@ -13745,35 +16696,7 @@ def get_user_activity():
         offset = int(request.args.get('offset', 0))
         action_filter = request.args.get('action')
         
-        # Ensure table exists
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    google_id TEXT,
-                    email TEXT,
-                    action TEXT NOT NULL,
-                    details TEXT,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    google_id TEXT,
-                    email TEXT,
-                    action TEXT NOT NULL,
-                    details TEXT,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        ensure_activity_log_tables(c, db_type)
         conn.commit()
         
         # Build query
@@ -13849,35 +16772,7 @@ def get_user_signup_info():
     c = get_cursor(conn, db_type)
     
     try:
-        # Ensure table exists
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_signup_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    google_id TEXT UNIQUE NOT NULL,
-                    email TEXT NOT NULL,
-                    name TEXT,
-                    first_signup_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    signup_ip TEXT,
-                    total_logins INTEGER DEFAULT 1
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_signup_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    google_id TEXT UNIQUE NOT NULL,
-                    email TEXT NOT NULL,
-                    name TEXT,
-                    first_signup_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    signup_ip TEXT,
-                    total_logins INTEGER DEFAULT 1
-                )
-            """)
+        ensure_activity_log_tables(c, db_type)
         conn.commit()
         
         # Get user info
@@ -0,0 +1,419 @@
+"""
+Local Bible corpus - bundled public-domain translations served without a network hop
+
+The corpus is a single read-only SQLite file (BIBLE_CORPUS_PATH, default
+data/bible_corpus.db). Verses of one translation occupy a contiguous run of rowids
+in canonical order, and a small chapters table maps (translation, book, chapter) to
+its first rowid and verse count, so:
+
+  * a chapter is one rowid range scan, located through an in-memory dict;
+  * a uniformly random verse is first_seq + randrange(verse_count), one rowid lookup.
+
+The deploy build imports the translations bundled under data/corpus/:
+
+    python bible_corpus.py import-csv --translation kjv --name "King James Version" data/corpus/kjv.csv.gz
+
+import-csv reads the common id,b,c,v,t layout (b = 1..66 in canonical order), plain
+or gzipped. import-api pulls a translation chapter by chapter from bible-api.com;
+it takes over a thousand rate-limited requests, so use it offline to produce a file
+to bundle, not at build time.
+"""
+import csv
+import gzip
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_BOOKS = [
+    {"id": "GEN", "name": "Genesis"},
+    {"id": "EXO", "name": "Exodus"},
+    {"id": "LEV", "name": "Leviticus"},
+    {"id": "NUM", "name": "Numbers"},
+    {"id": "DEU", "name": "Deuteronomy"},
+    {"id": "JOS", "name": "Joshua"},
+    {"id": "JDG", "name": "Judges"},
+    {"id": "RUT", "name": "Ruth"},
+    {"id": "1SA", "name": "1 Samuel"},
+    {"id": "2SA", "name": "2 Samuel"},
+    {"id": "1KI", "name": "1 Kings"},
+    {"id": "2KI", "name": "2 Kings"},
+    {"id": "1CH", "name": "1 Chronicles"},
+    {"id": "2CH", "name": "2 Chronicles"},
+    {"id": "EZR", "name": "Ezra"},
+    {"id": "NEH", "name": "Nehemiah"},
+    {"id": "EST", "name": "Esther"},
+    {"id": "JOB", "name": "Job"},
+    {"id": "PSA", "name": "Psalms"},
+    {"id": "PRO", "name": "Proverbs"},
+    {"id": "ECC", "name": "Ecclesiastes"},
+    {"id": "SNG", "name": "Song of Solomon"},
+    {"id": "ISA", "name": "Isaiah"},
+    {"id": "JER", "name": "Jeremiah"},
+    {"id": "LAM", "name": "Lamentations"},
+    {"id": "EZK", "name": "Ezekiel"},
+    {"id": "DAN", "name": "Daniel"},
+    {"id": "HOS", "name": "Hosea"},
+    {"id": "JOL", "name": "Joel"},
+    {"id": "AMO", "name": "Amos"},
+    {"id": "OBA", "name": "Obadiah"},
+    {"id": "JON", "name": "Jonah"},
+    {"id": "MIC", "name": "Micah"},
+    {"id": "NAM", "name": "Nahum"},
+    {"id": "HAB", "name": "Habakkuk"},
+    {"id": "ZEP", "name": "Zephaniah"},
+    {"id": "HAG", "name": "Haggai"},
+    {"id": "ZEC", "name": "Zechariah"},
+    {"id": "MAL", "name": "Malachi"},
+    {"id": "MAT", "name": "Matthew"},
+    {"id": "MRK", "name": "Mark"},
+    {"id": "LUK", "name": "Luke"},
+    {"id": "JHN", "name": "John"},
+    {"id": "ACT", "name": "Acts"},
+    {"id": "ROM", "name": "Romans"},
+    {"id": "1CO", "name": "1 Corinthians"},
+    {"id": "2CO", "name": "2 Corinthians"},
+    {"id": "GAL", "name": "Galatians"},
+    {"id": "EPH", "name": "Ephesians"},
+    {"id": "PHP", "name": "Philippians"},
+    {"id": "COL", "name": "Colossians"},
+    {"id": "1TH", "name": "1 Thessalonians"},
+    {"id": "2TH", "name": "2 Thessalonians"},
+    {"id": "1TI", "name": "1 Timothy"},
+    {"id": "2TI", "name": "2 Timothy"},
+    {"id": "TIT", "name": "Titus"},
+    {"id": "PHM", "name": "Philemon"},
+    {"id": "HEB", "name": "Hebrews"},
+    {"id": "JAS", "name": "James"},
+    {"id": "1PE", "name": "1 Peter"},
+    {"id": "2PE", "name": "2 Peter"},
+    {"id": "1JN", "name": "1 John"},
+    {"id": "2JN", "name": "2 John"},
+    {"id": "3JN", "name": "3 John"},
+    {"id": "JUD", "name": "Jude"},
+    {"id": "REV", "name": "Revelation"},
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    id TEXT PRIMARY KEY, name TEXT, note TEXT, first_seq INTEGER, verse_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS books (
+    translation TEXT, ord INTEGER, id TEXT, name TEXT, chapters INTEGER,
+    PRIMARY KEY (translation, ord)
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    translation TEXT, book_ord INTEGER, chapter INTEGER, first_seq INTEGER, verse_count INTEGER,
+    PRIMARY KEY (translation, book_ord, chapter)
+);
+CREATE TABLE IF NOT EXISTS verses (
+    seq INTEGER PRIMARY KEY, translation TEXT, book_ord INTEGER, chapter INTEGER, verse INTEGER, text TEXT
+);
+"""
+
+_REFERENCE_RE = re.compile(
+    r"^\s*([1-3]?\s*[A-Za-z][A-Za-z\s\.]*?)\s*(\d+)(?:\s*:\s*(\d+)(?:\s*[-–]\s*(\d+))?)?\s*$"
+)
+
+
+def _default_normalize(value):
+    return re.sub(r"[^a-z0-9]", "", str(value or "").strip().lower())
+
+
+def parse_reference(reference):
+    """'John 3', 'John 3:16' or 'John 3:16-18' -> (book, chapter, first, last); None otherwise."""
+    match = _REFERENCE_RE.match(str(reference or ""))
+    if not match:
+        return None
+    book, chapter, first, last = match.groups()
+    first = int(first) if first else None
+    last = int(last) if last else first
+    if first is not None and last < first:
+        return None
+    return book.strip().rstrip('.'), int(chapter), first, last
+
+
+class BibleCorpus:
+    """Read-only view over the corpus file; opened lazily, safe to share across threads."""
+
+    def __init__(self, path, normalize=None, aliases=None):
+        self.path = path
+        self.normalize = normalize or _default_normalize
+        self.aliases = dict(aliases or {})
+        self._local = threading.local()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self.translations = {}
+        self._books = {}
+        self._book_keys = {}
+        self._chapters = {}
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                if os.path.exists(self.path):
+                    self._load_index()
+                    logger.info(f"Bible corpus loaded: {', '.join(sorted(self.translations)) or 'empty'}")
+            except Exception as e:
+                logger.warning(f"Bible corpus unavailable at {self.path}: {e}")
+                self.translations, self._books, self._book_keys, self._chapters = {}, {}, {}, {}
+            self._loaded = True
+
+    def _load_index(self):
+        c = self._conn().cursor()
+        c.execute("SELECT id, name, note, first_seq, verse_count FROM translations WHERE verse_count > 0")
+        self.translations = {
+            row[0]: {"id": row[0], "name": row[1], "note": row[2] or "", "first_seq": row[3], "verse_count": row[4]}
+            for row in c.fetchall()
+        }
+        c.execute("SELECT translation, ord, id, name, chapters FROM books ORDER BY translation, ord")
+        for translation, ordinal, book_id, name, chapters in c.fetchall():
+            self._books.setdefault(translation, {})[ordinal] = {"id": book_id, "name": name, "chapters": chapters}
+            keys = self._book_keys.setdefault(translation, {})
+            keys[self.normalize(name)] = ordinal
+            keys[self.normalize(book_id)] = ordinal
+        for translation, keys in self._book_keys.items():
+            for alias, target in self.aliases.items():
+                target_key = self.normalize(target)
+                if target_key in keys:
+                    keys.setdefault(self.normalize(alias), keys[target_key])
+        c.execute("SELECT translation, book_ord, chapter, first_seq, verse_count FROM chapters")
+        self._chapters = {(row[0], row[1], row[2]): (row[3], row[4]) for row in c.fetchall()}
+
+    def has(self, translation):
+        self._ensure_loaded()
+        return str(translation or '').lower() in self.translations
+
+    def default_translation(self, preferred=None):
+        """preferred if shipped, else web, else kjv, else any shipped translation (None if empty)."""
+        self._ensure_loaded()
+        for candidate in (preferred, 'web', 'kjv'):
+            if candidate and candidate.lower() in self.translations:
+                return candidate.lower()
+        return next(iter(sorted(self.translations)), None)
+
+    def books(self, translation):
+        self._ensure_loaded()
+        translation = translation.lower()
+        return [
+            {"id": book["id"], "name": book["name"], "chapters": book["chapters"]}
+            for _, book in sorted(self._books.get(translation, {}).items())
+        ]
+
+    def _resolve_book(self, translation, book):
+        return self._book_keys.get(translation, {}).get(self.normalize(book))
+
+    def _verse_dict(self, translation, book_ord, chapter, verse, text):
+        book = self._books[translation][book_ord]
+        return {"book_id": book["id"], "book_name": book["name"], "chapter": chapter, "verse": verse, "text": text}
+
+    def passage(self, translation, reference):
+        """bible-api.com shaped payload for a single-chapter reference, or None if not servable."""
+        self._ensure_loaded()
+        translation = str(translation or '').lower()
+        meta = self.translations.get(translation)
+        parsed = parse_reference(reference)
+        if not meta or not parsed:
+            return None
+        book, chapter, first, last = parsed
+        book_ord = self._resolve_book(translation, book)
+        span = self._chapters.get((translation, book_ord, chapter))
+        if book_ord is None or not span:
+            return None
+        first_seq, count = span
+        c = self._conn().cursor()
+        c.execute(
+            "SELECT verse, text FROM verses WHERE seq >= ? AND seq < ? ORDER BY seq",
+            (first_seq, first_seq + count)
+        )
+        rows = c.fetchall()
+        if first is not None:
+            rows = [row for row in rows if first <= row[0] <= last]
+            if not rows:
+                return None
+        verses = [self._verse_dict(translation, book_ord, chapter, verse, text) for verse, text in rows]
+        name = self._books[translation][book_ord]["name"]
+        if first is None:
+            label = f"{name} {chapter}"
+        elif first == last:
+            label = f"{name} {chapter}:{first}"
+        else:
+            label = f"{name} {chapter}:{first}-{last}"
+        return {
+            "reference": label,
+            "verses": verses,
+            "text": "".join(f"{v['text'].strip()}\n" for v in verses),
+            "translation_id": translation,
+            "translation_name": meta["name"],
+            "translation_note": meta["note"]
+        }
+
+    def random_verse(self, translation):
+        """Uniformly random verse as {'ref', 'text', 'book', ...}, or None."""
+        self._ensure_loaded()
+        translation = str(translation or '').lower()
+        meta = self.translations.get(translation)
+        if not meta:
+            return None
+        seq = meta["first_seq"] + random.randrange(meta["verse_count"])
+        c = self._conn().cursor()
+        c.execute("SELECT book_ord, chapter, verse, text FROM verses WHERE seq = ?", (seq,))
+        row = c.fetchone()
+        if not row:
+            return None
+        verse = self._verse_dict(translation, *row)
+        verse["ref"] = f"{verse['book_name']} {verse['chapter']}:{verse['verse']}"
+        verse["translation_id"] = translation
+        verse["translation_name"] = meta["name"]
+        return verse
+
+    def stats(self):
+        self._ensure_loaded()
+        return {
+            "path": self.path,
+            "translations": {t: meta["verse_count"] for t, meta in sorted(self.translations.items())}
+        }
+
+
+def import_translation(path, translation, name, rows, note=""):
+    """Replace one translation in the corpus file.
+
+    rows yields (book_ord, book_id, book_name, chapter, verse, text) in canonical
+    order; book_ord is 0-based. Everything is written in one transaction so the
+    translation's verses stay one contiguous rowid run, and a failed import leaves
+    the previous copy in place.
+    """
+    translation = translation.lower()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        c = conn.cursor()
+        for table in ("verses", "chapters", "books"):
+            c.execute(f"DELETE FROM {table} WHERE translation = ?", (translation,))
+        c.execute("DELETE FROM translations WHERE id = ?", (translation,))
+        c.execute("SELECT COALESCE(MAX(seq), 0) FROM verses")
+        seq = c.fetchone()[0]
+        first_seq = seq + 1
+        books, chapters = {}, {}
+        for book_ord, book_id, book_name, chapter, verse, text in rows:
+            text = str(text or '').strip()
+            if not text:
+                continue
+            seq += 1
+            c.execute(
+                "INSERT INTO verses (seq, translation, book_ord, chapter, verse, text) VALUES (?, ?, ?, ?, ?, ?)",
+                (seq, translation, book_ord, chapter, verse, text)
+            )
+            books.setdefault(book_ord, [book_id, book_name, set()])[2].add(chapter)
+            span = chapters.setdefault((book_ord, chapter), [seq, 0])
+            span[1] += 1
+        c.executemany(
+            "INSERT INTO books (translation, ord, id, name, chapters) VALUES (?, ?, ?, ?, ?)",
+            [(translation, o, b[0], b[1], len(b[2])) for o, b in books.items()]
+        )
+        c.executemany(
+            "INSERT INTO chapters (translation, book_ord, chapter, first_seq, verse_count) VALUES (?, ?, ?, ?, ?)",
+            [(translation, o, ch, span[0], span[1]) for (o, ch), span in chapters.items()]
+        )
+        c.execute(
+            "INSERT INTO translations (id, name, note, first_seq, verse_count) VALUES (?, ?, ?, ?, ?)",
+            (translation, name, note, first_seq, seq - first_seq + 1)
+        )
+        conn.commit()
+        conn.execute("VACUUM")
+        return seq - first_seq + 1
+    finally:
+        conn.close()
+
+
+def _csv_rows(csv_path):
+    opener = gzip.open if csv_path.endswith('.gz') else open
+    with opener(csv_path, 'rt', newline='', encoding='utf-8') as fh:
+        for record in csv.DictReader(fh):
+            book_ord = int(record['b']) - 1
+            if not 0 <= book_ord < len(CANONICAL_BOOKS):
+                continue
+            book = CANONICAL_BOOKS[book_ord]
+            yield book_ord, book["id"], book["name"], int(record['c']), int(record['v']), record['t']
+
+
+def _api_rows(translation, base, delay, retries=5):
+    session = requests.Session()
+
+    def get(url):
+        for attempt in range(retries + 1):
+            time.sleep(delay * (2 ** attempt))
+            try:
+                response = session.get(url, timeout=30)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+            logger.warning(f"{url} failed ({error}), attempt {attempt + 1}/{retries + 1}")
+        raise RuntimeError(f"Giving up on {url} after {retries + 1} attempts")
+
+    order = {book["id"]: index for index, book in enumerate(CANONICAL_BOOKS)}
+    for book in get(f"{base}/data/{translation}").get("books", []):
+        book_ord = order.get(book.get("id"))
+        if book_ord is None:
+            continue
+        for entry in get(f"{base}/data/{translation}/{book['id']}").get("chapters", []):
+            chapter = int(entry.get("chapter"))
+            for verse in get(f"{base}/data/{translation}/{book['id']}/{chapter}").get("verses", []):
+                yield book_ord, book["id"], book.get("name") or CANONICAL_BOOKS[book_ord]["name"], chapter, int(verse["verse"]), verse.get("text")
+            logger.info(f"Imported {book['id']} {chapter}")
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the local Bible corpus")
+    parser.add_argument('--path', default=os.environ.get('BIBLE_CORPUS_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'bible_corpus.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    from_csv = sub.add_parser('import-csv')
+    from_csv.add_argument('--translation', required=True)
+    from_csv.add_argument('--name', required=True)
+    from_csv.add_argument('--note', default='Public Domain')
+    from_csv.add_argument('csv_path')
+    from_api = sub.add_parser('import-api')
+    from_api.add_argument('--translation', required=True)
+    from_api.add_argument('--name')
+    from_api.add_argument('--note', default='Public Domain')
+    from_api.add_argument('--base', default='https://bible-api.com')
+    from_api.add_argument('--delay', type=float, default=2.1, help='seconds between requests (the API rate-limits)')
+    from_api.add_argument('--retries', type=int, default=5, help='retries per request, with exponential backoff')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'import-csv':
+        count = import_translation(args.path, args.translation, args.name, _csv_rows(args.csv_path), args.note)
+    else:
+        rows = _api_rows(args.translation.lower(), args.base.rstrip('/'), args.delay, max(0, args.retries))
+        count = import_translation(args.path, args.translation, args.name or args.translation.upper(), rows, args.note)
+    print(f"{args.translation}: {count} verses -> {args.path}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,234 @@
+"""
+Realtime SSE server - asyncio/ASGI entry point for /api/realtime/stream
+
+Holds long-lived event streams on one event loop instead of one gthread worker
+thread per connected tab. Run it next to the Flask app:
+
+    uvicorn realtime_asgi:app --host 127.0.0.1 --port 8001
+
+and route the stream path to it from the same origin, since the stream reads the
+Flask session cookie. With nginx in front of both servers:
+
+    location = /api/realtime/stream {
+        proxy_pass http://127.0.0.1:8001;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_buffering off;
+        proxy_read_timeout 3700s;
+    }
+    location / {
+        proxy_pass http://127.0.0.1:8000;  # gunicorn app:app
+    }
+
+Without that route the stream keeps being served by gunicorn. Give both servers
+the same SECRET_KEY and DATABASE_URL. Events come from the shared RealtimeBroker, so
+publish_realtime_event() on any gunicorn worker reaches streams held here.
+
+The app module is imported with APP_BACKGROUND_TASKS=0: the web service runs
+migrations, the verse generator and the batch jobs; this process only streams.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+os.environ.setdefault('APP_BACKGROUND_TASKS', '0')
+from app import app as flask_app, _REALTIME_BROKER, _realtime_frame, check_ban_status
+
+logger = logging.getLogger(__name__)
+
+ASGI_HEARTBEAT_SECONDS = max(2, int(os.environ.get('REALTIME_ASGI_HEARTBEAT_SECONDS', '15')))
+# 0 keeps streams open until the client goes away.
+ASGI_STREAM_MAX_SECONDS = max(0, int(os.environ.get('REALTIME_ASGI_MAX_STREAM_SECONDS', '3600')))
+ASGI_MAILBOX_SIZE = max(10, int(os.environ.get('REALTIME_ASGI_MAILBOX_SIZE', '200')))
+
+STREAM_PATH = '/api/realtime/stream'
+
+_STATS = {"open_streams": 0, "total_streams": 0, "dropped": 0}
+
+
+class AsyncMailbox:
+    """Broker mailbox that hands packets from the broker thread to the event loop."""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put_nowait(self, packet):
+        try:
+            self.loop.call_soon_threadsafe(self._put, packet)
+        except RuntimeError:
+            # Loop already closed; the stream is going away anyway.
+            pass
+
+    def _put(self, packet):
+        if self.queue.full():
+            # Drop oldest message to keep stream responsive.
+            _STATS["dropped"] += 1
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(packet)
+
+
+def session_user_id(headers):
+    """User id from the Flask session cookie, or None if missing/invalid/expired."""
+    raw = headers.get('cookie')
+    if not raw:
+        return None
+    try:
+        cookie = SimpleCookie()
+        cookie.load(raw)
+        morsel = cookie.get(flask_app.config.get('SESSION_COOKIE_NAME') or 'session')
+        if morsel is None:
+            return None
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        if serializer is None:
+            return None
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        data = serializer.loads(morsel.value, max_age=max_age)
+        return int(data['user_id']) if data.get('user_id') is not None else None
+    except Exception:
+        return None
+
+
+def _packet(event, payload=None):
+    return {"event": event, "payload": payload or {}, "ts": datetime.now().isoformat()}
+
+
+async def _send_json(send, status, body):
+    data = json.dumps(body).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _watch_disconnect(receive, gone):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            gone.set()
+            return
+
+
+async def _stream(scope, receive, send, headers):
+    loop = asyncio.get_running_loop()
+    user_id = session_user_id(headers)
+    if not user_id:
+        await _send_json(send, 401, {"error": "Not logged in"})
+        return
+    is_banned, reason, _ = await loop.run_in_executor(None, check_ban_status, user_id)
+    if is_banned:
+        await _send_json(send, 403, {"error": "banned", "reason": reason, "message": "Your account has been banned"})
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        last_event_id = int(headers.get('last-event-id') or (query.get('last_event_id') or ['0'])[0] or 0)
+    except ValueError:
+        last_event_id = 0
+
+    mailbox = AsyncMailbox(loop, ASGI_MAILBOX_SIZE)
+    _, high_water = await loop.run_in_executor(None, _REALTIME_BROKER.subscribe, user_id, mailbox)
+    gone = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, gone))
+    _STATS["open_streams"] += 1
+    _STATS["total_streams"] += 1
+    try:
+        backlog, replay_gap = ([], False)
+        if last_event_id > 0:
+            backlog, replay_gap = await loop.run_in_executor(
+                None, _REALTIME_BROKER.replay, user_id, last_event_id, high_water
+            )
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache, no-transform"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+
+        async def emit(text):
+            await send({"type": "http.response.body", "body": text.encode('utf-8'), "more_body": True})
+
+        last_sent = max(last_event_id, 0)
+        await emit("retry: 2500\n")
+        for packet in backlog:
+            last_sent = max(last_sent, packet['id'])
+            await emit(_realtime_frame(packet))
+        hello = _packet('hello', {'user_id': user_id, 'replay_gap': replay_gap})
+        if high_water > last_sent:
+            hello['id'] = high_water
+        await emit(_realtime_frame(hello))
+        last_sent = max(last_sent, high_water)
+
+        deadline = (time.monotonic() + ASGI_STREAM_MAX_SECONDS) if ASGI_STREAM_MAX_SECONDS else None
+        while not gone.is_set():
+            wait_for = ASGI_HEARTBEAT_SECONDS
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    await emit(_realtime_frame(_packet('stream_rotate')))
+                    break
+                wait_for = min(wait_for, remaining)
+            getter = asyncio.ensure_future(mailbox.queue.get())
+            done, _ = await asyncio.wait({getter, watcher}, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                if not gone.is_set():
+                    await emit(f": keepalive {int(time.time())}\n\n")
+                    await emit(_realtime_frame(_packet('heartbeat')))
+                continue
+            packet = getter.result()
+            event_id = packet.get('id')
+            if event_id is not None:
+                if event_id <= last_sent:
+                    continue
+                last_sent = event_id
+            await emit(_realtime_frame(packet))
+        if not gone.is_set():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except Exception as e:
+        logger.info(f"Realtime stream closed for user {user_id}: {e}")
+    finally:
+        _STATS["open_streams"] -= 1
+        watcher.cancel()
+        _REALTIME_BROKER.unsubscribe(user_id, mailbox)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.get_running_loop().run_in_executor(None, _REALTIME_BROKER.ensure_started)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get("headers") or []}
+    path = scope.get("path") or ''
+    if path == STREAM_PATH and scope.get("method", "GET") == "GET":
+        await _stream(scope, receive, send, headers)
+    elif path == '/health':
+        await _send_json(send, 200, {"status": "ok", "streams": dict(_STATS), "broker": _REALTIME_BROKER.stats()})
+    else:
+        await _send_json(send, 404, {"error": "Not found"})
@@ -0,0 +1,345 @@
+"""
+Verse neighbours - item-item collaborative filtering from likes, saves and highlights
+
+Every user is a sparse vector of weighted verse interactions. Verses are compared by
+the cosine of their columns in that user x verse matrix, i.e. co-occurrence counts
+C[i, j] = sum_u w_ui * w_uj normalized by sqrt(C[i, i] * C[j, j]), and each verse
+keeps only its top_n neighbours; scores are damped by C[i, j] / (C[i, j] + shrink)
+so pairs that co-occurred once do not outrank well-supported ones. Everything is
+numpy; the matrix is never dense.
+
+update() is incremental: for each user with new interactions only the pairs that
+involve a changed verse are recomputed (b_i * b_j - a_i * a_j between the old and
+new user vector), merged into the stored co-occurrence counts, and only the
+neighbour lists of verses that gained counts are re-ranked. Work therefore follows
+new interactions, not total history. Removals (unlikes) and drifting norms on
+untouched rows are only picked up by train(), which rebuilds from scratch.
+
+Files under `directory`, versioned and published by atomically replacing meta.json
+like verse_vectors:
+
+    users-<v>.npz      per-user interaction rows (CSR: user_ids, offsets, items, weights)
+    pairs-<v>.npz      co-occurrence counts, keys (i << 32 | j) sorted, both orders
+    neighbors-<v>.npz  per-verse top_n lists (CSR: item_ids, offsets, neighbors, scores)
+
+Only neighbors-<v>.npz is loaded by serving processes.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_LOW_BITS = (1 << 32) - 1
+
+
+def _csr(keys, rows, values, value_dtype):
+    """{key: (np ids, np values)} with ascending keys -> (keys, offsets, ids, values)."""
+    keys = np.asarray(sorted(keys), dtype=np.int64)
+    lengths = [len(rows[k]) for k in keys.tolist()]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    if len(keys):
+        ids = np.concatenate([rows[k] for k in keys.tolist()]).astype(np.int64)
+        vals = np.concatenate([values[k] for k in keys.tolist()]).astype(value_dtype)
+    else:
+        ids = np.zeros(0, dtype=np.int64)
+        vals = np.zeros(0, dtype=value_dtype)
+    return keys, offsets, ids, vals
+
+
+class VerseNeighbors:
+    """Build, persist and query per-verse CF neighbour lists; safe to share across threads."""
+
+    RELOAD_CHECK_SECONDS = 5.0
+
+    def __init__(self, directory, top_n=40, max_user_items=200, shrink=2.0):
+        self.directory = directory
+        self.top_n = top_n
+        self.shrink = shrink
+        self.max_user_items = max_user_items
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.meta = None
+        self.item_ids = None
+        self.offsets = None
+        self.neighbors = None
+        self.scores = None
+        self._meta_mtime = None
+        self._last_check = 0.0
+        self.queries = 0
+
+    # ---- build / persist ------------------------------------------------
+
+    def train(self, interactions, cursors):
+        """Rebuild from every (user_id, verse_id, weight) interaction, then publish."""
+        return self._update(interactions, cursors, fresh=True)
+
+    def update(self, interactions, cursors):
+        """Fold new (user_id, verse_id, weight) interactions into the published model."""
+        self.maybe_reload(force=True)
+        if self.meta is None:
+            return self.train(interactions, cursors)
+        return self._update(interactions, cursors, fresh=False)
+
+    def _load_state(self):
+        paths = self._paths(self.meta["version"])
+        users = np.load(paths["users"])
+        pairs = np.load(paths["pairs"])
+        neighbors = np.load(paths["neighbors"])
+        return (
+            (users["user_ids"], users["offsets"], users["items"], users["weights"]),
+            (pairs["keys"], pairs["vals"]),
+            (neighbors["item_ids"], neighbors["offsets"], neighbors["neighbors"], neighbors["scores"]),
+        )
+
+    def _update(self, interactions, cursors, fresh):
+        started = time.time()
+        if fresh or self.meta is None:
+            empty_i = np.zeros(0, dtype=np.int64)
+            empty_f = np.zeros(0, dtype=np.float32)
+            users, pairs, lists = (empty_i, np.zeros(1, dtype=np.int64), empty_i, empty_f), (empty_i, empty_f), None
+        else:
+            users, pairs, lists = self._load_state()
+        user_ids, user_offsets, user_items, user_weights = users
+
+        # The strongest signal wins per (user, verse) across sources.
+        incoming = {}
+        for user_id, verse_id, weight in interactions:
+            row = incoming.setdefault(int(user_id), {})
+            row[int(verse_id)] = max(float(weight), row.get(int(verse_id), 0.0))
+
+        delta_keys, delta_vals = [], []
+        new_rows = {}
+        for user_id, additions in incoming.items():
+            position = int(np.searchsorted(user_ids, user_id))
+            old = {}
+            if position < len(user_ids) and user_ids[position] == user_id:
+                lo, hi = user_offsets[position], user_offsets[position + 1]
+                old = dict(zip(user_items[lo:hi].tolist(), user_weights[lo:hi].tolist()))
+            new = dict(old)
+            for verse_id, weight in additions.items():
+                if verse_id in new:
+                    new[verse_id] = max(new[verse_id], weight)
+                elif len(new) < self.max_user_items:
+                    new[verse_id] = weight
+            changed = [v for v in new if new[v] != old.get(v, 0.0)]
+            if not changed:
+                continue
+            new_rows[user_id] = new
+            items = np.fromiter(new.keys(), dtype=np.int64, count=len(new))
+            b = np.fromiter(new.values(), dtype=np.float64, count=len(new))
+            a = np.fromiter((old.get(v, 0.0) for v in new), dtype=np.float64, count=len(new))
+            changed_set = set(changed)
+            is_changed = np.fromiter((v in changed_set for v in new), dtype=bool, count=len(new))
+            ci, ui = np.flatnonzero(is_changed), np.flatnonzero(~is_changed)
+            # changed x all (covers changed x changed in both orders and the diagonal)...
+            delta_keys.append(((items[ci][:, None] << 32) | items[None, :]).ravel())
+            delta_vals.append((np.outer(b[ci], b) - np.outer(a[ci], a)).ravel())
+            # ...plus unchanged x changed, the mirror of the changed x unchanged block.
+            if len(ui):
+                delta_keys.append(((items[ui][:, None] << 32) | items[ci][None, :]).ravel())
+                delta_vals.append((np.outer(b[ui], b[ci]) - np.outer(a[ui], a[ci])).ravel())
+
+        if not delta_keys and not fresh:
+            self._publish_meta_only(cursors)
+            return 0
+
+        keys, vals = pairs
+        touched = np.zeros(0, dtype=np.int64)
+        if delta_keys:
+            dkeys, inverse = np.unique(np.concatenate(delta_keys), return_inverse=True)
+            dvals = np.bincount(inverse, weights=np.concatenate(delta_vals)).astype(np.float32)
+            position = np.searchsorted(keys, dkeys)
+            found = position < len(keys)
+            found[found] = keys[position[found]] == dkeys[found]
+            vals = vals.copy()
+            vals[position[found]] += dvals[found]
+            keys = np.insert(keys, position[~found], dkeys[~found])
+            vals = np.insert(vals, position[~found], dvals[~found])
+            touched = np.unique(dkeys >> 32)
+
+        users = self._merge_users(user_ids, user_offsets, user_items, user_weights, new_rows)
+        lists = self._rerank(keys, vals, touched, lists)
+        self._publish(users, (keys, vals), lists, cursors, trained=fresh)
+        logger.info(
+            f"Verse neighbours {'trained' if fresh else 'updated'}: {len(new_rows)} users, "
+            f"{len(touched)} verses re-ranked, {len(keys)} pairs in {time.time() - started:.1f}s"
+        )
+        return len(touched)
+
+    @staticmethod
+    def _merge_users(user_ids, offsets, items, weights, new_rows):
+        """Replace the CSR rows of users in new_rows (adding new users)."""
+        rows, values = {}, {}
+        for index, user_id in enumerate(user_ids.tolist()):
+            if user_id not in new_rows:
+                rows[user_id] = items[offsets[index]:offsets[index + 1]]
+                values[user_id] = weights[offsets[index]:offsets[index + 1]]
+        for user_id, row in new_rows.items():
+            rows[user_id] = np.fromiter(row.keys(), dtype=np.int64, count=len(row))
+            values[user_id] = np.fromiter(row.values(), dtype=np.float32, count=len(row))
+        return _csr(rows.keys(), rows, values, np.float32)
+
+    def _rerank(self, keys, vals, touched, lists):
+        """Top-n cosine neighbours for every touched verse; other rows are kept as they were."""
+        rows, values = {}, {}
+        if lists is not None:
+            item_ids, offsets, neighbors, scores = lists
+            touched_set = set(touched.tolist())
+            for index, verse_id in enumerate(item_ids.tolist()):
+                if verse_id not in touched_set:
+                    rows[verse_id] = neighbors[offsets[index]:offsets[index + 1]]
+                    values[verse_id] = scores[offsets[index]:offsets[index + 1]]
+        if len(keys):
+            first = keys >> 32
+            second = keys & _LOW_BITS
+            diagonal = first == second
+            norm_ids, norms = first[diagonal], np.sqrt(np.maximum(vals[diagonal], 1e-12))
+            starts = np.searchsorted(keys, touched << 32)
+            ends = np.searchsorted(keys, (touched + 1) << 32)
+            for verse_id, lo, hi in zip(touched.tolist(), starts.tolist(), ends.tolist()):
+                other = second[lo:hi]
+                counts = vals[lo:hi]
+                keep = (other != verse_id) & (counts > 0)
+                other, counts = other[keep], counts[keep]
+                if not len(other):
+                    continue
+                own = norms[np.searchsorted(norm_ids, verse_id)]
+                theirs = norms[np.minimum(np.searchsorted(norm_ids, other), len(norm_ids) - 1)]
+                # Shrink pairs seen together only once or twice toward 0.
+                score = counts / (own * theirs) * (counts / (counts + self.shrink))
+                top = min(self.top_n, len(score))
+                best = np.argpartition(-score, top - 1)[:top]
+                best = best[np.argsort(-score[best], kind='stable')]
+                rows[verse_id] = other[best]
+                values[verse_id] = score[best]
+        return _csr(rows.keys(), rows, values, np.float32)
+
+    def _publish(self, users, pairs, lists, cursors, trained):
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            version = int(time.time() * 1000)
+            paths = self._paths(version)
+            np.savez(paths["users"], user_ids=users[0], offsets=users[1], items=users[2], weights=users[3])
+            np.savez(paths["pairs"], keys=pairs[0], vals=pairs[1])
+            np.savez(paths["neighbors"], item_ids=lists[0], offsets=lists[1], neighbors=lists[2], scores=lists[3])
+            previous = self.meta or {}
+            meta = {
+                "version": version,
+                "cursors": dict(cursors),
+                "users": int(len(users[0])),
+                "verses": int(len(lists[0])),
+                "pairs": int(len(pairs[0])),
+                "top_n": self.top_n,
+                "trained_at": time.time() if trained else previous.get("trained_at", time.time()),
+                "built_at": time.time(),
+            }
+            self._write_meta(meta)
+            self._cleanup(keep={version, previous.get("version")})
+        self.maybe_reload(force=True)
+
+    def _publish_meta_only(self, cursors):
+        """Nothing changed the model; just advance the source cursors."""
+        with self._write_lock:
+            meta = dict(self.meta)
+            meta["cursors"] = dict(cursors)
+            meta["built_at"] = time.time()
+            self._write_meta(meta)
+        self.maybe_reload(force=True)
+
+    def _write_meta(self, meta):
+        tmp = os.path.join(self.directory, "meta.json.tmp")
+        with open(tmp, "w") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, os.path.join(self.directory, "meta.json"))
+
+    def _paths(self, version):
+        return {
+            "users": os.path.join(self.directory, f"users-{version}.npz"),
+            "pairs": os.path.join(self.directory, f"pairs-{version}.npz"),
+            "neighbors": os.path.join(self.directory, f"neighbors-{version}.npz"),
+        }
+
+    def _cleanup(self, keep):
+        for name in os.listdir(self.directory):
+            match = re.match(r"^(?:users|pairs|neighbors)-(\d+)\.npz$", name)
+            if match and int(match.group(1)) not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def maybe_reload(self, force=False):
+        """Pick up a build published by any process; cheap when nothing changed."""
+        now = time.time()
+        if not force and now - self._last_check < self.RELOAD_CHECK_SECONDS:
+            return self.meta is not None
+        self._last_check = now
+        meta_path = os.path.join(self.directory, "meta.json")
+        try:
+            mtime = os.path.getmtime(meta_path)
+        except OSError:
+            return self.meta is not None
+        if mtime == self._meta_mtime and self.meta is not None:
+            return True
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+            lists = np.load(self._paths(meta["version"])["neighbors"])
+            loaded = (lists["item_ids"], lists["offsets"], lists["neighbors"], lists["scores"])
+        except Exception as e:
+            logger.warning(f"Verse neighbours reload failed: {e}")
+            return self.meta is not None
+        with self._lock:
+            self.item_ids, self.offsets, self.neighbors, self.scores = loaded
+            self.meta = meta
+            self._meta_mtime = mtime
+        return True
+
+    # ---- query ----------------------------------------------------------
+
+    def neighbors_of(self, verse_id):
+        """[(neighbour id, score)] best first for one verse."""
+        if not self.maybe_reload():
+            return []
+        with self._lock:
+            item_ids, offsets, neighbors, scores = self.item_ids, self.offsets, self.neighbors, self.scores
+        position = int(np.searchsorted(item_ids, verse_id))
+        if position >= len(item_ids) or item_ids[position] != verse_id:
+            return []
+        lo, hi = offsets[position], offsets[position + 1]
+        return list(zip(neighbors[lo:hi].tolist(), scores[lo:hi].tolist()))
+
+    def recommend(self, seed_ids, k=50):
+        """[(verse_id, score, because_id)] for verses near the seeds, best first.
+
+        Scores add up over seeds; because_id is the seed contributing the most, so a
+        pick can be explained as "people who liked <because_id> also liked this".
+        """
+        if not self.maybe_reload():
+            return []
+        with self._lock:
+            self.queries += 1
+        totals, best = {}, {}
+        seeds = set(seed_ids)
+        for seed in seed_ids:
+            for verse_id, score in self.neighbors_of(seed):
+                if verse_id in seeds:
+                    continue
+                totals[verse_id] = totals.get(verse_id, 0.0) + score
+                if score > best.get(verse_id, (0.0, None))[0]:
+                    best[verse_id] = (score, seed)
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(verse_id, score, best[verse_id][1]) for verse_id, score in ranked]
+
+    def stats(self):
+        self.maybe_reload()
+        meta = dict(self.meta or {})
+        meta["queries"] = self.queries
+        meta["directory"] = self.directory
+        return meta
@@ -0,0 +1,328 @@
+"""
+Verse vectors - CPU-only LSA embeddings with an IVF nearest-neighbour index
+
+Embeddings are hashed TF-IDF (unigrams + bigrams, crc32 into `dims` buckets)
+projected onto `rank` latent dimensions with a randomized truncated SVD, so verses
+that share vocabulary neighbourhoods land close together even without exact word
+overlap. Everything is numpy; no model download and no network.
+
+Files under `directory`, all written to versioned names and published by
+atomically replacing meta.json, so readers in other processes never see a partial
+build:
+
+    model-<v>.npz     idf weights and the dims x rank projection
+    vectors-<v>.npy   float32 (count x rank), L2-normalized, grouped by IVF list,
+                      opened with mmap_mode='r'
+    ids-<v>.npy       verse id per vector row
+    ivf-<v>.npz       centroids and per-list row offsets
+
+train() fits everything from scratch; append() folds new verses into the existing
+model and centroids, which is what the periodic batch job uses between retrains.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text or '').lower())
+
+
+class VectorIndex:
+    """Build, persist and query verse embeddings; safe to share across threads."""
+
+    RELOAD_CHECK_SECONDS = 5.0
+
+    def __init__(self, directory, dims=1 << 16, rank=96, nprobe=8, seed=7):
+        self.directory = directory
+        self.dims = dims
+        self.rank = rank
+        self.nprobe = nprobe
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.meta = None
+        self.idf = None
+        self.projection = None
+        self.vectors = None
+        self.ids = None
+        self.centroids = None
+        self.offsets = None
+        self._meta_mtime = None
+        self._last_check = 0.0
+        self.queries = 0
+
+    # ---- features -------------------------------------------------------
+
+    def _features(self, text):
+        """Hashed (bucket -> raw term count) for unigrams and bigrams."""
+        tokens = tokenize(text)
+        counts = {}
+        for term in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            bucket = zlib.crc32(term.encode('utf-8')) % self.dims
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+
+    def _csr(self, texts):
+        """Sparse sublinear-tf rows as CSR arrays (indptr, indices, data)."""
+        indptr = [0]
+        indices = []
+        data = []
+        for text in texts:
+            counts = self._features(text)
+            if not counts:
+                # Keep every row non-empty so per-row norms stay defined.
+                counts = {0: 1}
+            for bucket, count in counts.items():
+                indices.append(bucket)
+                data.append(1.0 + math.log(count))
+            indptr.append(len(indices))
+        return (
+            np.asarray(indptr, dtype=np.int64),
+            np.asarray(indices, dtype=np.int64),
+            np.asarray(data, dtype=np.float32),
+        )
+
+    def _weight(self, csr, idf):
+        indptr, indices, data = csr
+        data = data * idf[indices]
+        norms = np.sqrt(np.add.reduceat(data * data, indptr[:-1]))
+        norms[norms == 0] = 1.0
+        data = data / np.repeat(norms, np.diff(indptr))
+        return indptr, indices, data.astype(np.float32)
+
+    @staticmethod
+    def _rows(csr):
+        indptr = csr[0]
+        return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+    def _matmul(self, csr, dense):
+        """csr (n x dims) @ dense (dims x l), one bincount per output column."""
+        indptr, indices, data = csr
+        rows = self._rows(csr)
+        columns = np.ascontiguousarray(dense.T)
+        out = np.empty((len(indptr) - 1, dense.shape[1]), dtype=np.float32)
+        for j in range(dense.shape[1]):
+            out[:, j] = np.bincount(rows, weights=data * columns[j][indices], minlength=len(indptr) - 1)
+        return out
+
+    def _rmatmul(self, csr, dense):
+        """csr.T (dims x n) @ dense (n x l)."""
+        indptr, indices, data = csr
+        rows = self._rows(csr)
+        columns = np.ascontiguousarray(dense.T)
+        out = np.empty((self.dims, dense.shape[1]), dtype=np.float32)
+        for j in range(dense.shape[1]):
+            out[:, j] = np.bincount(indices, weights=data * columns[j][rows], minlength=self.dims)
+        return out
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).astype(np.float32)
+
+    def _embed_csr(self, csr):
+        return self._normalize(self._matmul(csr, self.projection))
+
+    # ---- ivf ------------------------------------------------------------
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 8192):
+            assignment[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ centroids.T, axis=1)
+        return assignment
+
+    def _kmeans(self, vectors, rng, iterations=12):
+        nlist = max(1, min(1024, int(math.sqrt(len(vectors)))))
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            # Re-seed empty lists from random sample points.
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = self._normalize(sums)
+        return centroids
+
+    # ---- build / persist ------------------------------------------------
+
+    def train(self, docs):
+        """Fit idf, the SVD projection and IVF centroids on [(id, text), ...], then publish."""
+        if not docs:
+            return 0
+        started = time.time()
+        rng = np.random.default_rng(self.seed)
+        raw = self._csr([text for _, text in docs])
+        n = len(docs)
+        df = np.bincount(raw[1], minlength=self.dims).astype(np.float32)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        csr = self._weight(raw, idf)
+
+        rank = max(1, min(self.rank, n - 1)) if n > 1 else 1
+        width = min(self.dims, rank + 16)
+        basis, _ = np.linalg.qr(self._matmul(csr, rng.standard_normal((self.dims, width)).astype(np.float32)))
+        # One power iteration is enough to separate the leading topics from noise.
+        back, _ = np.linalg.qr(self._rmatmul(csr, basis))
+        basis, _ = np.linalg.qr(self._matmul(csr, back))
+        _, _, vt = np.linalg.svd(self._rmatmul(csr, basis).T, full_matrices=False)
+        projection = np.ascontiguousarray(vt[:rank].T, dtype=np.float32)
+
+        vectors = self._normalize(self._matmul(csr, projection))
+        centroids = self._kmeans(vectors, rng)
+        ids = np.asarray([doc_id for doc_id, _ in docs], dtype=np.int64)
+        self._publish(idf, projection, vectors, ids, centroids, self._assign(vectors, centroids), trained_count=n)
+        logger.info(f"Verse vectors trained: {n} verses, rank {rank}, {len(centroids)} lists in {time.time() - started:.1f}s")
+        return n
+
+    def append(self, docs):
+        """Embed new [(id, text), ...] with the current model and add them to their nearest lists."""
+        self.maybe_reload(force=True)
+        if self.projection is None:
+            return self.train(docs)
+        if not docs:
+            return 0
+        known = set(np.asarray(self.ids).tolist())
+        docs = [(doc_id, text) for doc_id, text in docs if doc_id not in known]
+        if not docs:
+            return 0
+        new_vectors = self._embed_csr(self._weight(self._csr([text for _, text in docs]), self.idf))
+        new_ids = np.asarray([doc_id for doc_id, _ in docs], dtype=np.int64)
+        old_assignment = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        vectors = np.concatenate([np.asarray(self.vectors), new_vectors])
+        ids = np.concatenate([np.asarray(self.ids), new_ids])
+        assignment = np.concatenate([old_assignment, self._assign(new_vectors, self.centroids)])
+        self._publish(self.idf, self.projection, vectors, ids, self.centroids, assignment,
+                      trained_count=self.meta.get("trained_count", len(ids)))
+        return len(docs)
+
+    def _publish(self, idf, projection, vectors, ids, centroids, assignment, trained_count):
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))]).astype(np.int64)
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            version = int(time.time() * 1000)
+            paths = self._paths(version)
+            np.savez(paths["model"], idf=idf, projection=projection)
+            np.save(paths["vectors"], np.ascontiguousarray(vectors[order], dtype=np.float32))
+            np.save(paths["ids"], ids[order])
+            np.savez(paths["ivf"], centroids=centroids, offsets=offsets)
+            meta = {
+                "version": version,
+                "count": int(len(ids)),
+                "max_id": int(ids.max()) if len(ids) else 0,
+                "trained_count": int(trained_count),
+                "rank": int(projection.shape[1]),
+                "lists": int(len(centroids)),
+                "dims": self.dims,
+                "built_at": time.time(),
+            }
+            tmp = os.path.join(self.directory, "meta.json.tmp")
+            with open(tmp, "w") as fh:
+                json.dump(meta, fh)
+            os.replace(tmp, os.path.join(self.directory, "meta.json"))
+            self._cleanup(keep={version, (self.meta or {}).get("version")})
+        self.maybe_reload(force=True)
+
+    def _paths(self, version):
+        return {
+            "model": os.path.join(self.directory, f"model-{version}.npz"),
+            "vectors": os.path.join(self.directory, f"vectors-{version}.npy"),
+            "ids": os.path.join(self.directory, f"ids-{version}.npy"),
+            "ivf": os.path.join(self.directory, f"ivf-{version}.npz"),
+        }
+
+    def _cleanup(self, keep):
+        """Drop versions older than the previous one; open memmaps of them stay valid until closed."""
+        for name in os.listdir(self.directory):
+            match = re.match(r"^(?:model|vectors|ids|ivf)-(\d+)\.np[yz]$", name)
+            if match and int(match.group(1)) not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def maybe_reload(self, force=False):
+        """Pick up a build published by any process; cheap when nothing changed."""
+        now = time.time()
+        if not force and now - self._last_check < self.RELOAD_CHECK_SECONDS:
+            return self.meta is not None
+        self._last_check = now
+        meta_path = os.path.join(self.directory, "meta.json")
+        try:
+            mtime = os.path.getmtime(meta_path)
+        except OSError:
+            return self.meta is not None
+        if mtime == self._meta_mtime and self.meta is not None:
+            return True
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+            paths = self._paths(meta["version"])
+            model = np.load(paths["model"])
+            ivf = np.load(paths["ivf"])
+            loaded = (
+                model["idf"], model["projection"],
+                np.load(paths["vectors"], mmap_mode='r'), np.load(paths["ids"], mmap_mode='r'),
+                ivf["centroids"], ivf["offsets"],
+            )
+        except Exception as e:
+            logger.warning(f"Verse vectors reload failed: {e}")
+            return self.meta is not None
+        with self._lock:
+            self.idf, self.projection, self.vectors, self.ids, self.centroids, self.offsets = loaded
+            self.meta = meta
+            self._meta_mtime = mtime
+        return True
+
+    # ---- query ----------------------------------------------------------
+
+    def search(self, text, k=40, nprobe=None):
+        """[(verse_id, cosine score)] best first; [] if no index is published yet."""
+        if not self.maybe_reload():
+            return []
+        with self._lock:
+            idf, projection, vectors, ids = self.idf, self.projection, self.vectors, self.ids
+            centroids, offsets = self.centroids, self.offsets
+            self.queries += 1
+        counts = self._features(text)
+        if not counts:
+            return []
+        buckets = np.fromiter(counts.keys(), dtype=np.int64)
+        weights = (1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32))) * idf[buckets]
+        query = weights @ projection[buckets]
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0:
+            return []
+        query = (query / norm).astype(np.float32)
+        nprobe = max(1, min(len(centroids), nprobe or self.nprobe))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(offsets[p], offsets[p + 1]) for p in probe])
+        if not len(rows):
+            return []
+        scores = vectors[rows] @ query
+        top = min(k, len(rows))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        return [(int(ids[rows[i]]), float(scores[i])) for i in best]
+
+    def stats(self):
+        self.maybe_reload()
+        meta = dict(self.meta or {})
+        meta["queries"] = self.queries
+        meta["directory"] = self.directory
+        return meta